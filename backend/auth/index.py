@@ -1,71 +1,81 @@
-import json
-import os
-import psycopg2
-from typing import Dict, Any
+import db
+import instrument
+import passwords
+import runtime
+import sessions
+from typing import Dict, Any, Optional, Tuple
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+router = runtime.Router('Content-Type, Authorization, X-Read-After')
+
+def find_employee(event: Dict[str, Any], login: str) -> Optional[Tuple]:
     '''
-    Business: Авторизация сотрудников по логину и паролю
-    Args: event - dict с httpMethod, body (login, password)
-          context - объект с request_id
-    Returns: HTTP response с данными пользователя или ошибкой
+    Business: Ищет сотрудника по логину на реплике чтения; если его там ещё нет (только что создан) - на primary
+    Returns: (id, login, name, role, status, password) или None
     '''
-    method: str = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
+    for connection in (db.read_connection(event), db.connection()):
+        with connection as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT id, login, name, role, status, password FROM employees WHERE login = %s",
+                (login,)
+            )
+            employee = cur.fetchone()
+            cur.close()
+        if employee or not db.replica_enabled():
+            return employee
+    return None
+
+def rehash_password(employee: Tuple, password: str) -> None:
+    '''
+    Business: Перехеширует открытый или слабый пароль после успешного входа; KDF - в пуле passwords
+    Если пул занят, вход не задерживается и не проваливается: перехеш случится при следующем входе
+    '''
+    try:
+        password_hash = passwords.new_hash(password)
+    except runtime.Unavailable:
+        return
+    with db.connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "UPDATE employees SET password = %s WHERE id = %s AND password = %s",
+            (password_hash, employee[0], employee[5])
+        )
+        conn.commit()
+        cur.close()
+
+@router.route('POST')
+def authenticate(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    body_data = runtime.body(event)
     
-    if method != 'POST':
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'}),
-            'isBase64Encoded': False
-        }
+    if body_data.get('action') == 'logout':
+        session = sessions.from_event(event)
+        if session:
+            with db.connection() as conn:
+                cur = conn.cursor()
+                sessions.revoke(cur, session)
+                conn.commit()
+                cur.close()
+        
+        return runtime.respond(200, {'success': True})
     
-    body_data = json.loads(event.get('body', '{}'))
     login = body_data.get('login', '')
     password = body_data.get('password', '')
     
     if not login or not password:
-        return {
-            'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Login and password required'}),
-            'isBase64Encoded': False
-        }
-    
-    database_url = os.environ.get('DATABASE_URL')
+        return runtime.error(400, 'Login and password required')
     
-    conn = psycopg2.connect(database_url)
-    cur = conn.cursor()
+    employee = find_employee(event, login)
     
-    cur.execute(
-        "SELECT id, login, name, role, status FROM employees WHERE login = %s AND password = %s",
-        (login, password)
-    )
+    if not employee:
+        passwords.verify_password(login, password, passwords.DUMMY_HASH)
+    elif not passwords.verify_password(login, password, employee[5]):
+        employee = None
     
-    employee = cur.fetchone()
-    cur.close()
-    conn.close()
+    if employee and passwords.needs_rehash(employee[5]):
+        rehash_password(employee, password)
     
     if not employee:
-        return {
-            'statusCode': 401,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Invalid credentials'}),
-            'isBase64Encoded': False
-        }
+        return runtime.error(401, 'Invalid credentials')
     
     result = {
         'id': employee[0],
@@ -75,9 +85,18 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         'status': employee[4]
     }
     
-    return {
-        'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps(result),
-        'isBase64Encoded': False
-    }
+    session = sessions.new_session(employee[0], employee[3])
+    result['token'] = sessions.encode_token(session)
+    result['expires_at'] = session.expires_at
+    
+    return runtime.respond(200, result)
+
+@instrument.traced
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Авторизация сотрудников по логину и паролю, выдача и отзыв сессионных токенов
+    Args: event - dict с httpMethod, body (login, password) или body (action='logout') с токеном в Authorization
+          context - объект с request_id
+    Returns: HTTP response с данными пользователя и токеном или ошибкой
+    '''
+    return router.dispatch(event, context)
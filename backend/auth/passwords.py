@@ -0,0 +1,152 @@
+'''
+Хеширование паролей сотрудников (PBKDF2-SHA256 из stdlib) и кэш недавних успешных проверок.
+Файл лежит копией в backend/auth и backend/employees и должен оставаться одинаковым.
+'''
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+import runtime
+
+futures = runtime.lazy('concurrent.futures')
+
+ALGORITHM = 'pbkdf2_sha256'
+ITERATIONS = int(os.environ.get('PASSWORD_ITERATIONS', '200000'))
+VERIFY_TIMEOUT = float(os.environ.get('PASSWORD_VERIFY_TIMEOUT', '5'))
+RETRY_AFTER = int(os.environ.get('PASSWORD_RETRY_AFTER', '2'))
+CACHE_TTL = float(os.environ.get('PASSWORD_CACHE_TTL', '300'))
+CACHE_SIZE = int(os.environ.get('PASSWORD_CACHE_SIZE', '1024'))
+
+_executor: Optional[Any] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> Any:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = futures.ThreadPoolExecutor(max_workers=int(os.environ.get('PASSWORD_WORKERS', '2')))
+    return _executor
+
+
+def _run(function: Any, *args: Any) -> Any:
+    '''
+    Business: Выполняет KDF в пуле потоков, не дольше VERIFY_TIMEOUT
+    Returns: результат function; пул не успел - runtime.Unavailable (503 с Retry-After), задача из очереди снимается
+    '''
+    future = _get_executor().submit(function, *args)
+    try:
+        return future.result(timeout=VERIFY_TIMEOUT)
+    except futures.TimeoutError:
+        future.cancel()
+        raise runtime.Unavailable('Password check is busy, retry later', RETRY_AFTER)
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode('ascii').rstrip('=')
+
+
+def _unb64(data: str) -> bytes:
+    return base64.b64decode(data + '=' * (-len(data) % 4))
+
+
+def hash_password(password: str, iterations: int = ITERATIONS) -> str:
+    salt = os.urandom(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+    return f'{ALGORITHM}${iterations}${_b64(salt)}${_b64(digest)}'
+
+
+def new_hash(password: str) -> str:
+    '''
+    Business: hash_password для обработчиков - в том же пуле потоков, что и проверка, с тем же таймаутом
+    '''
+    return _run(hash_password, password)
+
+
+# Хеш текущей стоимости для проверки при неизвестном логине: KDF выполняется так же, как для существующего
+# сотрудника, и время ответа не выдаёт, есть ли логин. Соль и дайджест нулевые - с ним не совпадёт ни один пароль
+DUMMY_HASH = f'{ALGORITHM}${ITERATIONS}${_b64(bytes(16))}${_b64(bytes(32))}'
+
+
+def is_hashed(stored: str) -> bool:
+    return stored.startswith(ALGORITHM + '$')
+
+
+def needs_rehash(stored: str) -> bool:
+    '''
+    Business: Хранимое значение - открытый пароль из старых записей или хеш со слабее текущей стоимостью
+    '''
+    return not is_hashed(stored) or int(stored.split('$')[1]) < ITERATIONS
+
+
+def _verify(password: str, stored: str) -> bool:
+    if not is_hashed(stored):
+        return hmac.compare_digest(password.encode('utf-8'), stored.encode('utf-8'))
+    _, iterations, salt, expected = stored.split('$')
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), _unb64(salt), int(iterations))
+    return hmac.compare_digest(digest, _unb64(expected))
+
+
+class VerificationCache:
+    '''
+    Business: Ограниченный по размеру и времени кэш успешных проверок (login, hash)
+    Хранит не пароль, а HMAC пароля с ключом из хеша: смена пароля меняет хеш и инвалидирует запись.
+    '''
+
+    def __init__(self, ttl: float = CACHE_TTL, size: int = CACHE_SIZE) -> None:
+        self.ttl = ttl
+        self.size = size
+        self._entries: 'OrderedDict[str, Tuple[str, bytes, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _fingerprint(password: str, stored: str) -> bytes:
+        return hmac.new(stored.encode('utf-8'), password.encode('utf-8'), hashlib.sha256).digest()
+
+    def hit(self, login: str, password: str, stored: str) -> bool:
+        with self._lock:
+            entry = self._entries.get(login)
+            if entry is None:
+                return False
+            cached_hash, fingerprint, expires_at = entry
+            if expires_at < time.monotonic() or cached_hash != stored:
+                del self._entries[login]
+                return False
+            self._entries.move_to_end(login)
+        return hmac.compare_digest(fingerprint, self._fingerprint(password, stored))
+
+    def remember(self, login: str, password: str, stored: str) -> None:
+        if self.ttl <= 0 or self.size <= 0:
+            return
+        entry = (stored, self._fingerprint(password, stored), time.monotonic() + self.ttl)
+        with self._lock:
+            self._entries[login] = entry
+            self._entries.move_to_end(login)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+
+cache = VerificationCache()
+
+
+def verify_password(login: str, password: str, stored: Optional[str]) -> bool:
+    '''
+    Business: Проверяет пароль против хранимого значения, KDF выполняется в пуле потоков
+    Args: login - логин для кэша проверок, password - введённый пароль
+          stored - значение из employees.password (хеш или открытый пароль старых записей)
+    Returns: True, если пароль верный; пул не успел за VERIFY_TIMEOUT - runtime.Unavailable
+    '''
+    if not stored:
+        return False
+    if cache.hit(login, password, stored):
+        return True
+    if not _run(_verify, password, stored):
+        return False
+    cache.remember(login, password, stored)
+    return True
@@ -0,0 +1,187 @@
+'''
+Общий каркас обработчиков: маршрутизация по HTTP-методу, заранее собранные заголовки и статические ответы,
+ленивый импорт тяжёлых модулей и JSON-кодек (orjson, если установлен и не задан JSON_CODEC=stdlib, иначе json).
+Файл лежит копией в каждой папке backend/* и должен оставаться одинаковым.
+'''
+import importlib
+import importlib.util
+import json
+import os
+from types import ModuleType
+from typing import Any, Callable, Dict, Optional
+
+Handler = Callable[[Dict[str, Any], Any], Dict[str, Any]]
+
+
+class Frozen(dict):
+    '''
+    Business: dict, который нельзя изменить - общие заголовки и статические ответы переиспользуются между вызовами
+    '''
+
+    def _readonly(self, *args: Any, **kwargs: Any) -> None:
+        raise TypeError('shared response object is read-only, copy it with dict() first')
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _readonly
+
+
+class BadRequest(Exception):
+    '''
+    Business: Ошибка разбора запроса; Router отвечает на неё 400 с текстом исключения (без текста - INVALID_JSON)
+    '''
+
+
+class Unavailable(Exception):
+    '''
+    Business: Временная перегрузка (например, очередь пула KDF); Router отвечает 503 с Retry-After
+    '''
+
+    def __init__(self, message: str, retry_after: int = 1) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def lazy(name: str) -> ModuleType:
+    '''
+    Business: Откладывает импорт модуля до первого обращения к атрибуту (psycopg2 не грузится для OPTIONS и 4xx)
+    Args: name - полное имя модуля, например 'psycopg2.extras'
+    '''
+
+    class LazyModule(ModuleType):
+        def __getattr__(self, attr: str) -> Any:
+            module = importlib.import_module(name)
+            self.__dict__.update(module.__dict__)
+            return getattr(module, attr)
+
+    return LazyModule(name)
+
+
+JSON_CODEC = os.environ.get('JSON_CODEC', 'auto')
+CODEC = 'orjson' if JSON_CODEC != 'stdlib' and importlib.util.find_spec('orjson') else 'json'
+_orjson = lazy('orjson')
+
+
+def dumps(value: Any) -> str:
+    if CODEC == 'orjson':
+        return _orjson.dumps(value).decode('utf-8')
+    return json.dumps(value)
+
+
+def loads(raw: str) -> Any:
+    if CODEC == 'orjson':
+        return _orjson.loads(raw)
+    return json.loads(raw)
+
+
+JSON_HEADERS = Frozen({'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'})
+
+
+def _static(status: int, error: str) -> Frozen:
+    return Frozen({'statusCode': status, 'headers': JSON_HEADERS, 'body': json.dumps({'error': error}),
+                   'isBase64Encoded': False})
+
+
+METHOD_NOT_ALLOWED = _static(405, 'Method not allowed')
+INVALID_JSON = _static(400, 'Request body must be a JSON object')
+UNAUTHORIZED = _static(401, 'Unauthorized')
+FORBIDDEN = _static(403, 'Forbidden')
+
+
+def respond(status: int, payload: Any) -> Dict[str, Any]:
+    return {'statusCode': status, 'headers': JSON_HEADERS, 'body': dumps(payload), 'isBase64Encoded': False}
+
+
+def error(status: int, message: str) -> Dict[str, Any]:
+    return respond(status, {'error': message})
+
+
+def respond_raw(status: int, body: str, etag: Optional[str] = None) -> Dict[str, Any]:
+    '''
+    Business: Ответ с уже готовым JSON-телом (например, собранным в Postgres через db.fetch_json)
+    Args: etag - версия данных для If-None-Match; добавляет ETag и открывает его фронтенду, а Vary: Authorization
+                 не даёт общим кэшам отдать ответ одного сотрудника другому
+    '''
+    if etag is None:
+        return {'statusCode': status, 'headers': JSON_HEADERS, 'body': body, 'isBase64Encoded': False}
+    headers = Frozen(JSON_HEADERS, **{'ETag': etag, 'Vary': 'Authorization', 'Access-Control-Expose-Headers': 'ETag'})
+    return {'statusCode': status, 'headers': headers, 'body': body, 'isBase64Encoded': False}
+
+
+def unavailable(exc: Unavailable) -> Dict[str, Any]:
+    headers = Frozen(JSON_HEADERS, **{'Retry-After': str(exc.retry_after),
+                                      'Access-Control-Expose-Headers': 'Retry-After'})
+    return {'statusCode': 503, 'headers': headers, 'body': dumps({'error': str(exc)}), 'isBase64Encoded': False}
+
+
+def with_read_token(response: Dict[str, Any], token: Optional[str]) -> Dict[str, Any]:
+    '''
+    Business: Добавляет к ответу на запись токен read-your-writes (db.write_token), который клиент вернёт в X-Read-After
+    '''
+    if token is None:
+        return response
+    headers = Frozen(response['headers'], **{'X-Read-After': token, 'Access-Control-Expose-Headers': 'X-Read-After'})
+    return dict(response, headers=headers)
+
+
+def not_modified(etag: str) -> Dict[str, Any]:
+    headers = Frozen({'ETag': etag, 'Vary': 'Authorization', 'Access-Control-Allow-Origin': '*',
+                      'Access-Control-Expose-Headers': 'ETag'})
+    return {'statusCode': 304, 'headers': headers, 'body': '', 'isBase64Encoded': False}
+
+
+def body(event: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Business: Разбирает JSON-тело запроса выбранным кодеком
+    Returns: dict тела (пустой, если тела нет); не-JSON и не-объект - BadRequest
+    '''
+    try:
+        parsed = loads(event.get('body') or '{}')
+    except ValueError:
+        raise BadRequest()
+    if not isinstance(parsed, dict):
+        raise BadRequest()
+    return parsed
+
+
+class Router:
+    '''
+    Business: Выбор обработчика по httpMethod; OPTIONS и 405 отдаются готовыми объектами без работы на вызов
+    Args: allow_headers - заголовки запроса, разрешённые в CORS preflight
+    '''
+
+    def __init__(self, allow_headers: str = 'Content-Type, Authorization') -> None:
+        self.allow_headers = allow_headers
+        self.routes: Dict[str, Handler] = {}
+        self.options = self._preflight()
+
+    def _preflight(self) -> Frozen:
+        methods = ', '.join(list(self.routes) + ['OPTIONS'])
+        return Frozen({
+            'statusCode': 200,
+            'headers': Frozen({
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': methods,
+                'Access-Control-Allow-Headers': self.allow_headers,
+                'Access-Control-Max-Age': '86400'
+            }),
+            'body': '',
+            'isBase64Encoded': False
+        })
+
+    def route(self, method: str) -> Callable[[Handler], Handler]:
+        def register(handler: Handler) -> Handler:
+            self.routes[method] = handler
+            self.options = self._preflight()
+            return handler
+        return register
+
+    def dispatch(self, event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        method = event.get('httpMethod', 'GET')
+        handler = self.routes.get(method)
+        if handler is None:
+            return self.options if method == 'OPTIONS' else METHOD_NOT_ALLOWED
+        try:
+            return handler(event, context)
+        except BadRequest as exc:
+            return error(400, str(exc)) if exc.args else INVALID_JSON
+        except Unavailable as exc:
+            return unavailable(exc)
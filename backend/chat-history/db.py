@@ -0,0 +1,400 @@
+'''
+Общий слой доступа к Postgres для облачных функций.
+Каждая функция деплоится отдельно, поэтому файл лежит копией в каждой папке backend/*
+и должен оставаться одинаковым во всех функциях.
+'''
+import functools
+import os
+import select
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import instrument
+import runtime
+
+psycopg2 = runtime.lazy('psycopg2')
+extensions = runtime.lazy('psycopg2.extensions')
+
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '4'))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))
+HEALTHCHECK_AFTER = float(os.environ.get('DB_HEALTHCHECK_AFTER', '30'))
+READ_DSN_ENV = 'DATABASE_READ_URL'
+READ_YOUR_WRITES_SECONDS = float(os.environ.get('DB_READ_YOUR_WRITES_SECONDS', '30'))
+REPLICA_RETRY_SECONDS = float(os.environ.get('DB_REPLICA_RETRY_SECONDS', '5'))
+READ_AFTER_HEADER = 'X-Read-After'
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+@functools.lru_cache(maxsize=None)
+def traced_connection_factory() -> Any:
+    '''
+    Business: Классы соединения и курсора для трассировки; собираются при первом соединении,
+              чтобы psycopg2 импортировался только на пути в базу
+    '''
+
+    class TracedCursor(extensions.cursor):
+        '''
+        Business: Курсор, который при включённой трассировке пишет время и строки каждого запроса в instrument.current()
+        '''
+
+        def execute(self, query: Any, vars: Any = None) -> None:
+            trace = instrument.current()
+            if trace is None:
+                return super().execute(query, vars)
+            started = time.perf_counter()
+            try:
+                return super().execute(query, vars)
+            finally:
+                trace.query(query, time.perf_counter() - started, self.rowcount)
+
+        def _timed_fetch(self, fetch: Callable[..., Any], *args: Any) -> Any:
+            trace = instrument.current()
+            if trace is None:
+                return fetch(*args)
+            started = time.perf_counter()
+            try:
+                return fetch(*args)
+            finally:
+                trace.add('fetch', time.perf_counter() - started)
+
+        def fetchone(self) -> Any:
+            return self._timed_fetch(super().fetchone)
+
+        def fetchmany(self, size: Optional[int] = None) -> Any:
+            return self._timed_fetch(super().fetchmany, self.arraysize if size is None else size)
+
+        def fetchall(self) -> Any:
+            return self._timed_fetch(super().fetchall)
+
+    class TracedConnection(extensions.connection):
+        def cursor(self, *args: Any, **kwargs: Any) -> Any:
+            kwargs.setdefault('cursor_factory', TracedCursor)
+            return super().cursor(*args, **kwargs)
+
+    return TracedConnection
+
+
+class ConnectionPool:
+    '''
+    Business: Пул соединений, переживающий тёплые вызовы функции
+    Args: dsn_env - имя переменной окружения со строкой подключения
+          size - максимум одновременно выданных соединений
+    '''
+
+    def __init__(self, dsn_env: str = 'DATABASE_URL', size: int = POOL_SIZE) -> None:
+        self.dsn_env = dsn_env
+        self.size = size
+        self._idle: List[Tuple[Any, float]] = []
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self.stats: Dict[str, int] = {
+            'checkouts': 0,
+            'waits': 0,
+            'handshakes': 0,
+            'reconnects': 0,
+            'discarded': 0
+        }
+
+    def _count(self, key: str) -> None:
+        with self._cond:
+            self.stats[key] += 1
+
+    def _connect(self) -> Any:
+        self._count('handshakes')
+        trace = instrument.current()
+        if trace is not None:
+            trace.handshakes += 1
+        if instrument.ENABLED:
+            return psycopg2.connect(os.environ.get(self.dsn_env), connection_factory=traced_connection_factory())
+        return psycopg2.connect(os.environ.get(self.dsn_env))
+
+    def _is_alive(self, conn: Any, idle_for: float) -> bool:
+        if conn.closed:
+            return False
+        if idle_for < HEALTHCHECK_AFTER:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT 1')
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self) -> Any:
+        with self._cond:
+            if not self._idle and self._in_use >= self.size:
+                self.stats['waits'] += 1
+                deadline = time.monotonic() + POOL_TIMEOUT
+                while not self._idle and self._in_use >= self.size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(f'No free connection in {self.dsn_env} pool after {POOL_TIMEOUT}s')
+                    self._cond.wait(remaining)
+            self._in_use += 1
+            self.stats['checkouts'] += 1
+            entry = self._idle.pop() if self._idle else None
+
+        try:
+            if entry is not None:
+                conn, last_used = entry
+                if self._is_alive(conn, time.monotonic() - last_used):
+                    return conn
+                self._count('reconnects')
+                _close_quietly(conn)
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    def putconn(self, conn: Any, discard: bool = False) -> None:
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+
+        with self._cond:
+            self._in_use -= 1
+            if discard or conn.closed:
+                self.stats['discarded'] += 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+                conn = None
+            self._cond.notify()
+
+        if conn is not None:
+            _close_quietly(conn)
+
+    def closeall(self) -> None:
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            _close_quietly(conn)
+
+
+def _close_quietly(conn: Any) -> None:
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(dsn_env: str = 'DATABASE_URL') -> ConnectionPool:
+    pool = _pools.get(dsn_env)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(dsn_env)
+            if pool is None:
+                pool = _pools[dsn_env] = ConnectionPool(dsn_env)
+    return pool
+
+
+@contextmanager
+def connection(dsn_env: str = 'DATABASE_URL') -> Iterator[Any]:
+    '''
+    Business: Выдаёт соединение из пула и возвращает его обратно после запроса
+    Args: dsn_env - имя переменной окружения со строкой подключения
+    Returns: psycopg2 connection; незакоммиченная транзакция откатывается при возврате
+    '''
+    pool = get_pool(dsn_env)
+    trace = instrument.current()
+    if trace is None:
+        conn = pool.getconn()
+    else:
+        started = time.perf_counter()
+        conn = pool.getconn()
+        trace.add('db-connect', time.perf_counter() - started)
+    discard = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        discard = True
+        raise
+    finally:
+        pool.putconn(conn, discard=discard)
+
+
+_replica_down_until = 0.0
+
+
+def replica_enabled() -> bool:
+    return bool(os.environ.get(READ_DSN_ENV))
+
+
+def _replica_down() -> None:
+    global _replica_down_until
+    _replica_down_until = time.monotonic() + REPLICA_RETRY_SECONDS
+
+
+def write_token(cur: Any) -> Optional[str]:
+    '''
+    Business: Токен read-your-writes для ответа на запись; вызывать после commit на том же соединении
+    Returns: '<LSN primary>@<unix ms>' или None, если реплика не настроена (лишнего запроса нет)
+    '''
+    if not replica_enabled():
+        return None
+    cur.execute('SELECT pg_current_wal_lsn()::text')
+    return f'{cur.fetchone()[0]}@{int(time.time() * 1000)}'
+
+
+def read_after(event: Optional[Dict[str, Any]]) -> Optional[str]:
+    '''
+    Business: LSN из заголовка X-Read-After запроса, если токен моложе READ_YOUR_WRITES_SECONDS
+    Returns: LSN, который реплика должна была применить, чтобы клиент увидел свою запись; иначе None
+    '''
+    headers = (event or {}).get('headers') or {}
+    value = next((v for k, v in headers.items() if k.lower() == READ_AFTER_HEADER.lower()), None)
+    if not value:
+        return None
+    lsn, _, written_ms = value.partition('@')
+    try:
+        age = time.time() - int(written_ms) / 1000
+    except ValueError:
+        return None
+    return lsn if '/' in lsn and age < READ_YOUR_WRITES_SECONDS else None
+
+
+def read_dsn_env(event: Optional[Dict[str, Any]] = None) -> str:
+    '''
+    Business: Куда идти за чтением - на реплику (DATABASE_READ_URL) или на primary
+    Args: event - запрос; свежий X-Read-After отправляет на primary, пока реплика не применила этот LSN
+    Returns: имя переменной окружения со строкой подключения; недоступная реплика - primary
+             (после ошибки подключения реплика пропускается REPLICA_RETRY_SECONDS секунд)
+    '''
+    if not replica_enabled() or time.monotonic() < _replica_down_until:
+        return 'DATABASE_URL'
+    lsn = read_after(event)
+    if lsn is None:
+        return READ_DSN_ENV
+    try:
+        with connection(READ_DSN_ENV) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT COALESCE(pg_last_wal_replay_lsn(), pg_current_wal_lsn()) >= %s::pg_lsn",
+                (lsn,)
+            )
+            caught_up = cur.fetchone()[0]
+            cur.close()
+            conn.rollback()
+    except psycopg2.OperationalError:
+        _replica_down()
+        return 'DATABASE_URL'
+    except psycopg2.DataError:
+        return 'DATABASE_URL'
+    return READ_DSN_ENV if caught_up else 'DATABASE_URL'
+
+
+@contextmanager
+def read_connection(event: Optional[Dict[str, Any]] = None) -> Iterator[Any]:
+    '''
+    Business: Соединение для чтения - реплика, если она настроена и уже видит записи клиента, иначе primary
+    Returns: соединение, как connection(); если к реплике не удалось подключиться, чтение идёт на primary,
+             а реплика пропускается REPLICA_RETRY_SECONDS секунд. LISTEN/NOTIFY на реплике не работает -
+             long-poll идёт через listening()
+    '''
+    dsn_env = read_dsn_env(event)
+    with ExitStack() as stack:
+        try:
+            conn = stack.enter_context(connection(dsn_env))
+        except psycopg2.OperationalError:
+            if dsn_env == 'DATABASE_URL':
+                raise
+            _replica_down()
+            conn = stack.enter_context(connection('DATABASE_URL'))
+        yield conn
+
+
+def pool_stats(dsn_env: Optional[str] = None) -> Dict[str, Dict[str, int]]:
+    names = [dsn_env] if dsn_env else list(_pools)
+    return {name: dict(_pools[name].stats) for name in names if name in _pools}
+
+
+@contextmanager
+def listening(*channels: str, dsn_env: str = 'DATABASE_URL') -> Iterator[Any]:
+    '''
+    Business: Подписывает соединение из пула на каналы LISTEN/NOTIFY на время запроса
+    Args: channels - имена каналов (константы из кода, не пользовательский ввод)
+    Returns: соединение в autocommit; после выхода подписки снимаются и соединение возвращается в пул
+    '''
+    with connection(dsn_env) as conn:
+        conn.autocommit = True
+        cur = conn.cursor()
+        try:
+            for channel in channels:
+                cur.execute(f'LISTEN {channel}')
+            yield conn
+        finally:
+            if not conn.closed:
+                try:
+                    cur.execute('UNLISTEN *')
+                except psycopg2.Error:
+                    pass
+                cur.close()
+                del conn.notifies[:]
+                conn.autocommit = False
+
+
+def wait_notify(conn: Any, timeout: float, accept: Callable[[Any], bool] = lambda notify: True) -> bool:
+    '''
+    Business: Ждёт подходящее уведомление NOTIFY без опроса базы
+    Args: conn - соединение из listening(), timeout - секунды ожидания
+          accept - фильтр по уведомлению (channel, payload)
+    Returns: True, если уведомление пришло до таймаута
+    '''
+    deadline = time.monotonic() + timeout
+    while True:
+        while conn.notifies:
+            if accept(conn.notifies.pop(0)):
+                return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        if select.select([conn], [], [], remaining) == ([], [], []):
+            return False
+        conn.poll()
+
+
+def fetch_json(cur: Any, query: str, args: Any = ()) -> str:
+    '''
+    Business: Собирает JSON-массив результата запроса на стороне Postgres (json_agg)
+    Args: query - SELECT, имена колонок которого совпадают с ключами ответа; порядок задаёт его ORDER BY
+    Returns: готовое тело ответа - без промежуточного списка dict и json.dumps в Python
+    '''
+    cur.execute(f"SELECT COALESCE(json_agg(t), '[]'::json)::text FROM ({query}) t", args)
+    return cur.fetchone()[0]
+
+
+def list_version(cur: Any, scope: str) -> int:
+    '''
+    Business: Версия изменяемого списка (chats, employees) для ETag
+    Returns: сумма слотов list_versions; триггеры увеличивают один слот при каждом коммите изменений
+    '''
+    cur.execute("SELECT COALESCE(sum(version), 0) FROM list_versions WHERE scope = %s", (scope,))
+    return cur.fetchone()[0]
+
+
+def if_none_match(event: Dict[str, Any], etag: str) -> bool:
+    '''
+    Business: Проверяет заголовок If-None-Match запроса против текущего ETag
+    Returns: True, если клиент уже имеет эту версию и можно ответить 304
+    '''
+    headers = event.get('headers') or {}
+    value = next((v for k, v in headers.items() if k.lower() == 'if-none-match'), None)
+    if not value:
+        return False
+    tags = [tag.strip() for tag in value.split(',')]
+    return '*' in tags or etag in tags or f'W/{etag}' in tags
@@ -1,78 +1,130 @@
-import json
-import os
-import psycopg2
-from typing import Dict, Any
+import db
+import instrument
+import runtime
+import sessions
+from typing import Dict, Any, Optional
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+HISTORY_PAGE_SIZE = 50
+
+def chat_partition(alias: str) -> str:
     '''
-    Business: Получение истории изменений чата
-    Args: event - dict с httpMethod, queryStringParameters (chat_id)
-          context - объект с request_id
-    Returns: HTTP response с историей чата
+    Business: Условие на ключ секции messages/chat_history для чтений одного чата (как CHAT_PARTITION в messages):
+              у открытого чата подзапрос даёт FALSE, и *_cold отсекается при выполнении (pruning по initplan);
+              у заархивированного читаются обе секции - новые записи в него вставляются в hot
+    Args: alias - псевдоним таблицы в запросе; id чата передаётся именованным параметром chat_id
     '''
-    method: str = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    if method != 'GET':
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'}),
-            'isBase64Encoded': False
-        }
+    return f'{alias}.archived IN (FALSE, (SELECT c.archived_at IS NOT NULL FROM chats c WHERE c.id = %(chat_id)s))'
+
+def open_chat(cur: Any, chat_id: int, limit: int, history_limit: int = HISTORY_PAGE_SIZE) -> Optional[str]:
+    '''
+    Business: Всё для экрана открытого чата одним запросом - один снимок данных и одно соединение
+    Args: chat_id - id чата, limit - размер последней страницы сообщений
+          history_limit - сколько последних записей истории вернуть
+    Returns: готовое JSON-тело {chat, messages, next_cursor, has_more, history} или None, если чата нет;
+             next_cursor - before_id для следующей страницы в messages GET
+    '''
+    cur.execute(f"""
+        WITH page AS (
+            SELECT m.id, m.sender_type, m.message, m.created_at, e.name AS sender_name
+            FROM messages m
+            LEFT JOIN employees e ON m.sender_id = e.id
+            WHERE m.chat_id = %(chat_id)s AND {chat_partition('m')}
+            ORDER BY m.id DESC
+            LIMIT %(limit)s + 1
+        ), shown AS (
+            SELECT * FROM page ORDER BY id DESC LIMIT %(limit)s
+        ), recent AS (
+            SELECT h.id, h.action, h.details, h.created_at, e.name AS employee_name
+            FROM chat_history h
+            LEFT JOIN employees e ON h.employee_id = e.id
+            WHERE h.chat_id = %(chat_id)s AND {chat_partition('h')}
+            ORDER BY h.id DESC
+            LIMIT %(history_limit)s
+        ), more AS (
+            SELECT count(*) > %(limit)s AS has_more FROM page
+        )
+        SELECT json_build_object(
+            'chat', json_build_object(
+                'id', c.id, 'user_name', c.user_name, 'user_email', c.user_email, 'status', c.status,
+                'assigned_to', c.assigned_to, 'created_at', c.created_at, 'operator_name', e.name,
+                'is_closed', c.is_closed, 'resolution_status', c.resolution_status, 'updated_at', c.updated_at
+            ),
+            'messages', COALESCE((SELECT json_agg(s ORDER BY s.id) FROM shown s), '[]'::json),
+            'next_cursor', CASE WHEN more.has_more THEN (SELECT min(id) FROM shown) END,
+            'has_more', more.has_more,
+            'history', COALESCE((SELECT json_agg(r ORDER BY r.created_at, r.id) FROM recent r), '[]'::json)
+        )::text
+        FROM chats c
+        LEFT JOIN employees e ON c.assigned_to = e.id
+        CROSS JOIN more
+        WHERE c.id = %(chat_id)s
+    """, {'chat_id': chat_id, 'limit': limit, 'history_limit': history_limit})
+    row = cur.fetchone()
+    return row[0] if row else None
+
+router = runtime.Router('Content-Type, Authorization, If-None-Match, X-Read-After')
+
+@router.route('GET')
+def get_history(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    if not sessions.from_event(event):
+        return runtime.UNAUTHORIZED
     
     params = event.get('queryStringParameters') or {}
     chat_id = params.get('chat_id')
     
     if not chat_id:
-        return {
-            'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'chat_id required'}),
-            'isBase64Encoded': False
-        }
-    
-    database_url = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(database_url)
-    cur = conn.cursor()
+        return runtime.error(400, 'chat_id required')
     
-    cur.execute("""
-        SELECT h.id, h.action, h.details, h.created_at, e.name as employee_name
-        FROM chat_history h
-        LEFT JOIN employees e ON h.employee_id = e.id
-        WHERE h.chat_id = %s
-        ORDER BY h.created_at ASC
-    """, (chat_id,))
+    if params.get('view') == 'open':
+        try:
+            chat_id = int(chat_id)
+            limit = min(int(params.get('limit') or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE)
+        except ValueError:
+            limit = 0
+        
+        if limit < 1:
+            return runtime.error(400, 'Invalid chat_id or limit')
+        
+        with db.read_connection(event) as conn:
+            cur = conn.cursor()
+            body = open_chat(cur, chat_id, limit)
+            cur.close()
+        
+        if body is None:
+            return runtime.error(404, 'Chat not found')
+        
+        return runtime.respond_raw(200, body)
     
-    history = cur.fetchall()
-    result = []
-    for item in history:
-        result.append({
-            'id': item[0],
-            'action': item[1],
-            'details': item[2],
-            'created_at': item[3].isoformat() if item[3] else None,
-            'employee_name': item[4]
-        })
+    with db.read_connection(event) as conn:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT count(*), COALESCE(max(h.id), 0) FROM chat_history h
+            WHERE h.chat_id = %(chat_id)s AND {chat_partition('h')}
+        """, {'chat_id': chat_id})
+        etag = '"history-%s-%d-%d"' % ((chat_id,) + cur.fetchone())
+        body = None if db.if_none_match(event, etag) else db.fetch_json(cur, f"""
+            SELECT h.id, h.action, h.details, h.created_at, e.name as employee_name
+            FROM chat_history h
+            LEFT JOIN employees e ON h.employee_id = e.id
+            WHERE h.chat_id = %(chat_id)s AND {chat_partition('h')}
+            ORDER BY h.created_at ASC, h.id ASC
+        """, {'chat_id': chat_id})
+        cur.close()
     
-    cur.close()
-    conn.close()
+    if body is None:
+        return runtime.not_modified(etag)
     
-    return {
-        'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps(result),
-        'isBase64Encoded': False
-    }
+    return runtime.respond_raw(200, body, etag)
+
+@instrument.traced
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Получение истории изменений чата
+    Args: event - dict с httpMethod, queryStringParameters (chat_id;
+                  view=open [&limit] - чат, последняя страница сообщений и история одним запросом)
+          context - объект с request_id
+    Returns: HTTP response с историей чата
+    '''
+    return router.dispatch(event, context)
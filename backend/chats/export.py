@@ -0,0 +1,189 @@
+'''
+Потоковая выгрузка чатов с сообщениями и историей (комплаенс): gzip NDJSON - строка на чат с вложенными messages и
+history, или gzip CSV - строка на сообщение или запись истории. Строки идут из серверного курсора (NDJSON) или
+COPY ... TO STDOUT (CSV) прямо в gzip, память не зависит от объёма выгрузки. Чаты выгружаются по возрастанию id
+пачками по транзакции; каждая пачка - отдельный gzip-член, дописанный в конец файла, поэтому выгрузку можно
+продолжить с after_id последней завершённой пачки, а файл целиком читается как один gzip-поток.
+'''
+import gzip
+import os
+from datetime import date
+from typing import Any, Dict, Optional
+
+import db
+
+EXPORT_DIR = os.environ.get('EXPORT_DIR', '/tmp')
+BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', '2000'))
+FETCH_SIZE = int(os.environ.get('EXPORT_FETCH_SIZE', '500'))
+COMPRESS_LEVEL = int(os.environ.get('EXPORT_GZIP_LEVEL', '6'))
+FORMATS = ('ndjson', 'csv')
+
+CHATS_WINDOW = """
+    SELECT count(*), max(id) FROM (
+        SELECT id FROM chats
+        WHERE created_at >= %(created_from)s AND created_at < %(created_to)s AND id > %(after_id)s
+        ORDER BY id
+        LIMIT %(limit)s
+    ) w
+"""
+
+NDJSON_QUERY = """
+    SELECT json_build_object(
+        'id', c.id, 'user_name', c.user_name, 'user_email', c.user_email, 'status', c.status,
+        'assigned_to', c.assigned_to, 'operator_name', e.name, 'is_closed', c.is_closed,
+        'resolution_status', c.resolution_status, 'created_at', c.created_at, 'updated_at', c.updated_at,
+        'messages', COALESCE((
+            SELECT json_agg(json_build_object(
+                'id', m.id, 'sender_type', m.sender_type, 'sender_id', m.sender_id, 'sender_name', se.name,
+                'message', m.message, 'created_at', m.created_at
+            ) ORDER BY m.id)
+            FROM messages m
+            LEFT JOIN employees se ON se.id = m.sender_id
+            WHERE m.chat_id = c.id
+        ), '[]'),
+        'history', COALESCE((
+            SELECT json_agg(json_build_object(
+                'id', h.id, 'action', h.action, 'details', h.details, 'employee_id', h.employee_id,
+                'employee_name', he.name, 'created_at', h.created_at
+            ) ORDER BY h.created_at, h.id)
+            FROM chat_history h
+            LEFT JOIN employees he ON he.id = h.employee_id
+            WHERE h.chat_id = c.id
+        ), '[]')
+    )::text
+    FROM chats c
+    LEFT JOIN employees e ON e.id = c.assigned_to
+    WHERE c.id > %(after_id)s AND c.id <= %(last_id)s
+      AND c.created_at >= %(created_from)s AND c.created_at < %(created_to)s
+    ORDER BY c.id
+"""
+
+CSV_QUERY = """
+    SELECT c.id AS chat_id, c.user_name, c.user_email, c.status AS chat_status, c.resolution_status,
+           e.name AS operator_name, c.created_at AS chat_created_at,
+           t.kind, t.item_id, t.created_at, t.type, t.author_name, t.text
+    FROM chats c
+    LEFT JOIN employees e ON e.id = c.assigned_to
+    LEFT JOIN LATERAL (
+        SELECT 'message' AS kind, m.id AS item_id, m.created_at, m.sender_type AS type,
+               se.name AS author_name, m.message AS text
+        FROM messages m
+        LEFT JOIN employees se ON se.id = m.sender_id
+        WHERE m.chat_id = c.id
+        UNION ALL
+        SELECT 'history', h.id, h.created_at, h.action, he.name, h.details
+        FROM chat_history h
+        LEFT JOIN employees he ON he.id = h.employee_id
+        WHERE h.chat_id = c.id
+    ) t ON TRUE
+    WHERE c.id > %(after_id)s AND c.id <= %(last_id)s
+      AND c.created_at >= %(created_from)s AND c.created_at < %(created_to)s
+    ORDER BY c.id, t.created_at, t.kind, t.item_id
+"""
+
+
+class CountingWriter:
+    '''
+    Business: Обёртка над gzip-файлом, считающая байты до сжатия
+    '''
+
+    def __init__(self, out: Any) -> None:
+        self.out = out
+        self.bytes = 0
+
+    def write(self, data: bytes) -> int:
+        self.bytes += len(data)
+        return self.out.write(data)
+
+
+def previous_month(today: Optional[date] = None) -> Dict[str, date]:
+    first = (today or date.today()).replace(day=1)
+    start = (first.replace(year=first.year - 1, month=12) if first.month == 1
+             else first.replace(month=first.month - 1))
+    return {'created_from': start, 'created_to': first}
+
+
+def default_path(fmt: str, created_from: date, created_to: date) -> str:
+    return os.path.join(EXPORT_DIR, f'chats_{created_from.isoformat()}_{created_to.isoformat()}.{fmt}.gz')
+
+
+def export_batch(conn: Any, raw: Any, fmt: str, window: Dict[str, Any], header: bool) -> Dict[str, Any]:
+    '''
+    Business: Выгружает следующую пачку чатов окна в новый gzip-член в конце raw, в одной транзакции
+    Args: conn - соединение из пула, raw - файл, открытый на дозапись в бинарном режиме
+          window - created_from, created_to, after_id и limit; header - писать ли заголовок CSV
+    Returns: dict с числом чатов, строк и байт до сжатия и last_chat_id пачки (None - чатов больше нет)
+    '''
+    cur = conn.cursor()
+    cur.execute(CHATS_WINDOW, window)
+    chats, last_id = cur.fetchone()
+    if not chats:
+        cur.close()
+        conn.rollback()
+        return {'chats': 0, 'rows': 0, 'bytes': 0, 'last_chat_id': None}
+    args = dict(window, last_id=last_id)
+    with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=COMPRESS_LEVEL) as compressed:
+        out = CountingWriter(compressed)
+        if fmt == 'csv':
+            options = '(FORMAT csv, HEADER true)' if header else '(FORMAT csv)'
+            cur.copy_expert(f'COPY ({cur.mogrify(CSV_QUERY, args).decode()}) TO STDOUT WITH {options}', out)
+            rows = cur.rowcount
+        else:
+            rows = 0
+            stream = conn.cursor(name='chat_export')
+            stream.execute(NDJSON_QUERY, args)
+            while True:
+                batch = stream.fetchmany(FETCH_SIZE)
+                if not batch:
+                    break
+                out.write(''.join(row[0] + '\n' for row in batch).encode())
+                rows += len(batch)
+            stream.close()
+    cur.close()
+    conn.rollback()
+    return {'chats': chats, 'rows': rows, 'bytes': out.bytes, 'last_chat_id': last_id}
+
+
+def export(fmt: str = 'ndjson', created_from: Optional[date] = None, created_to: Optional[date] = None,
+           after_id: int = 0, path: Optional[str] = None, limit: int = BATCH_SIZE,
+           max_batches: int = 100) -> Dict[str, Any]:
+    '''
+    Business: Выгрузка чатов, созданных в [created_from, created_to), с их сообщениями и историей
+    Args: fmt - ndjson или csv; без дат - прошлый календарный месяц
+          after_id - продолжить после этого чата: файл дописывается, а не перезаписывается
+          limit - чатов в пачке (транзакции), max_batches - пачек за вызов
+    Returns: dict с путём, числом чатов и строк, байтами до и после сжатия, last_chat_id и done;
+             пачка, прерванная ошибкой, обрезается из файла, так что повтор с тем же after_id безопасен
+    '''
+    if fmt not in FORMATS:
+        raise ValueError(f'format must be one of {FORMATS}')
+    if created_from is None or created_to is None:
+        month = previous_month()
+        created_from = created_from or month['created_from']
+        created_to = created_to or month['created_to']
+    path = path or default_path(fmt, created_from, created_to)
+    window = {'created_from': created_from, 'created_to': created_to, 'after_id': after_id, 'limit': limit}
+    totals = {'chats': 0, 'rows': 0, 'bytes': 0}
+    done = False
+    with open(path, 'ab' if after_id else 'wb') as raw:
+        started_size = raw.tell()
+        for _ in range(max_batches):
+            committed = raw.tell()
+            try:
+                with db.read_connection() as conn:
+                    batch = export_batch(conn, raw, fmt, window, header=fmt == 'csv' and window['after_id'] == 0)
+            except BaseException:
+                raw.truncate(committed)
+                raise
+            if batch['last_chat_id'] is None:
+                done = True
+                break
+            for key in totals:
+                totals[key] += batch[key]
+            window['after_id'] = batch['last_chat_id']
+            if batch['chats'] < limit:
+                done = True
+                break
+        compressed_bytes = raw.tell() - started_size
+    return dict(totals, path=path, format=fmt, compressed_bytes=compressed_bytes,
+                last_chat_id=window['after_id'], done=done)
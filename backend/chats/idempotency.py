@@ -0,0 +1,97 @@
+'''
+Необязательный заголовок Idempotency-Key для chats POST и messages POST: ответ первого запроса с ключом хранится в
+idempotency_keys до истечения IDEMPOTENCY_TTL_HOURS, повторы получают его без новых вставок. Ключ занимается в той же
+транзакции, что и вставка, поэтому одновременный дубль ждёт на уникальном индексе (scope, key) и после commit
+первого читает сохранённый ответ; при откате первого ключ достаётся дублю.
+Файл лежит копией в backend/chats и backend/messages и должен оставаться одинаковым.
+'''
+import hashlib
+import os
+from typing import Any, Dict, Optional
+
+import db
+import runtime
+
+HEADER = 'Idempotency-Key'
+TTL_HOURS = float(os.environ.get('IDEMPOTENCY_TTL_HOURS', '24'))
+MAX_KEY_LENGTH = 255
+
+
+def key(event: Dict[str, Any]) -> Optional[str]:
+    '''
+    Business: Значение Idempotency-Key из заголовков запроса
+    Returns: ключ или None; ключ длиннее MAX_KEY_LENGTH - BadRequest
+    '''
+    headers = event.get('headers') or {}
+    value = next((v for k, v in headers.items() if k.lower() == HEADER.lower()), None)
+    if not value or not value.strip():
+        return None
+    if len(value.strip()) > MAX_KEY_LENGTH:
+        raise runtime.BadRequest(f'{HEADER} must be at most {MAX_KEY_LENGTH} characters')
+    return value.strip()
+
+
+def fingerprint(event: Dict[str, Any]) -> bytes:
+    return hashlib.sha256((event.get('body') or '').encode()).digest()
+
+
+def claim(cur: Any, scope: str, idempotency_key: str, event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    '''
+    Business: Занимает ключ внутри транзакции записи, до вставок; просроченная запись занимается заново
+    Args: scope - функция ('chats', 'messages'), event - запрос, тело которого сравнивается с первым
+    Returns: None - ключ наш, нужно выполнить запрос и вызвать store до commit;
+             иначе готовый ответ: сохранённый ответ первого запроса или 422 для того же ключа с другим телом
+    '''
+    request_hash = fingerprint(event)
+    cur.execute("""
+        INSERT INTO idempotency_keys (scope, key, request_hash, expires_at)
+        VALUES (%s, %s, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 hour')
+        ON CONFLICT (scope, key) DO UPDATE
+        SET request_hash = EXCLUDED.request_hash, status_code = NULL, response = NULL, expires_at = EXCLUDED.expires_at
+        WHERE idempotency_keys.expires_at <= CURRENT_TIMESTAMP
+        RETURNING 1
+    """, (scope, idempotency_key, request_hash, TTL_HOURS))
+    if cur.fetchone():
+        return None
+    cur.execute(
+        "SELECT request_hash, status_code, response FROM idempotency_keys WHERE scope = %s AND key = %s",
+        (scope, idempotency_key)
+    )
+    stored_hash, status_code, response = cur.fetchone()
+    if bytes(stored_hash) != request_hash:
+        return runtime.error(422, f'{HEADER} was already used with a different request body')
+    return replayed(runtime.respond_raw(status_code, response))
+
+
+def store(cur: Any, scope: str, idempotency_key: str, response: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Business: Сохраняет ответ под занятым ключом; вызывать в той же транзакции до commit
+    Returns: тот же response
+    '''
+    cur.execute(
+        "UPDATE idempotency_keys SET status_code = %s, response = %s WHERE scope = %s AND key = %s",
+        (response['statusCode'], response['body'], scope, idempotency_key)
+    )
+    return response
+
+
+def replayed(response: Dict[str, Any]) -> Dict[str, Any]:
+    headers = runtime.Frozen(response['headers'], **{
+        'Idempotent-Replayed': 'true',
+        'Access-Control-Expose-Headers': 'Idempotent-Replayed'
+    })
+    return dict(response, headers=headers)
+
+
+def purge() -> int:
+    '''
+    Business: Удаляет просроченные ключи; запускается периодическим заданием
+    Returns: количество удалённых строк
+    '''
+    with db.connection() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM idempotency_keys WHERE expires_at <= CURRENT_TIMESTAMP")
+        deleted = cur.rowcount
+        conn.commit()
+        cur.close()
+    return deleted
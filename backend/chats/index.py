@@ -1,223 +1,484 @@
-import json
 import os
-import psycopg2
-from typing import Dict, Any
-from datetime import datetime
+import db
+import directory
+import export
+import idempotency
+import instrument
+import outbox
+import runtime
+import sessions
+from typing import Dict, Any, List, Optional, Tuple
+from datetime import date, datetime
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+MAX_WAIT_SECONDS = 25
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', '90'))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', '500'))
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+UPDATED_OVERLAP_SECONDS = float(os.environ.get('CHATS_UPDATED_OVERLAP_SECONDS', '5'))
+CHAT_STATUSES = ('waiting', 'assigned', 'closed')
+RESOLUTION_STATUSES = ('solved', 'unsolved')
+ASSIGNMENT_ORDER = {
+    'least_open': """(SELECT l.open_chats FROM operator_load l WHERE l.employee_id = e.id) NULLS FIRST,
+                     e.last_assigned_at NULLS FIRST, e.id""",
+    'round_robin': 'e.last_assigned_at NULLS FIRST, e.id'
+}
+
+def parse_list_filters(params: Dict[str, Any], session: sessions.Session) -> Dict[str, Any]:
     '''
-    Business: Управление чатами - создание, получение списка, назначение оператору
-    Args: event - dict с httpMethod, body, queryStringParameters
+    Business: Разбирает фильтры списка чатов из query string
+    Args: params - queryStringParameters
+          session - сессия сотрудника; оператор видит только свои чаты, администратор - все
+    Returns: dict фильтров для fetch_chats; ValueError при некорректных значениях
+    '''
+    filters = {
+        'operator_id': session.employee_id if session.role == 'operator' else None,
+        'include_closed': params.get('include_closed', 'false') == 'true',
+        'open_only': params.get('open_only', 'false') == 'true',
+        'status': params.get('status') or None,
+        'resolution_status': params.get('resolution_status') or None,
+        'assigned_to': int(params['assigned_to']) if params.get('assigned_to') else None,
+        'created_from': datetime.fromisoformat(params['created_from']) if params.get('created_from') else None,
+        'created_to': datetime.fromisoformat(params['created_to']) if params.get('created_to') else None,
+        'updated_after': datetime.fromisoformat(params['updated_after']) if params.get('updated_after') else None
+    }
+    if filters['status'] and filters['status'] not in CHAT_STATUSES:
+        raise ValueError('status')
+    if filters['resolution_status'] and filters['resolution_status'] not in RESOLUTION_STATUSES:
+        raise ValueError('resolution_status')
+    return filters
+
+def encode_cursor(chat: Tuple) -> str:
+    return f"{int(bool(chat[7]))}_{chat[5].isoformat()}_{chat[0]}"
+
+def decode_cursor(cursor: str) -> Tuple[bool, datetime, int]:
+    is_closed, created_at, chat_id = cursor.split('_')
+    return is_closed == '1', datetime.fromisoformat(created_at), int(chat_id)
+
+def build_chats_query(filters: Dict[str, Any], limit: Optional[int] = None,
+                      cursor: Optional[Tuple[bool, datetime, int]] = None,
+                      join_names: bool = not directory.ENABLED) -> Tuple[str, List[Any]]:
+    '''
+    Business: Строит запрос чатов по фильтрам в порядке (is_closed, created_at DESC, id DESC)
+    Args: filters - результат parse_list_filters
+          limit - размер страницы (None - без ограничения)
+          cursor - (is_closed, created_at, id) последнего чата предыдущей страницы
+          join_names - брать operator_name через JOIN employees; без него operator_name = NULL и заполняется
+                       из directory (страницы и long-poll), полный список для json_agg всегда с JOIN
+          updated_after перечитывается с запасом UPDATED_OVERLAP_SECONDS: updated_at - это время начала
+          транзакции, и транзакция, закоммиченная позже ответа, иначе осталась бы за курсором навсегда
+    Returns: SQL и аргументы; колонки (id, user_name, user_email, status, assigned_to, created_at,
+             operator_name, is_closed, resolution_status, updated_at)
+    '''
+    conditions = []
+    args: List[Any] = []
+    operator_id = filters['operator_id']
+    if operator_id:
+        conditions.append('c.assigned_to = %s')
+        args.append(operator_id)
+    if filters['open_only'] or (operator_id and not filters['include_closed'] and not filters['updated_after']):
+        conditions.append('c.is_closed = FALSE')
+    if filters['updated_after']:
+        conditions.append("c.updated_at > %s - %s * INTERVAL '1 second'")
+        args.extend([filters['updated_after'], UPDATED_OVERLAP_SECONDS])
+    for column in ('status', 'resolution_status', 'assigned_to'):
+        if filters[column] is not None:
+            conditions.append(f'c.{column} = %s')
+            args.append(filters[column])
+    if filters['created_from']:
+        conditions.append('c.created_at >= %s')
+        args.append(filters['created_from'])
+    if filters['created_to']:
+        conditions.append('c.created_at < %s')
+        args.append(filters['created_to'])
+    if cursor:
+        conditions.append('(c.is_closed > %s OR (c.is_closed = %s AND (c.created_at, c.id) < (%s, %s)))')
+        args.extend([cursor[0], cursor[0], cursor[1], cursor[2]])
+    
+    where = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+    page = ''
+    if limit is not None:
+        page = 'LIMIT %s'
+        args.append(limit)
+    operator_name, join = 'e.name', 'LEFT JOIN employees e ON c.assigned_to = e.id'
+    if not join_names:
+        operator_name, join = 'NULL::text', ''
+    query = f"""
+        SELECT c.id, c.user_name, c.user_email, c.status, c.assigned_to, 
+               c.created_at, {operator_name} as operator_name, c.is_closed, c.resolution_status, c.updated_at
+        FROM chats c
+        {join}
+        {where}
+        ORDER BY c.is_closed ASC, c.created_at DESC, c.id DESC
+        {page}
+    """
+    return query, args
+
+def fetch_chats(cur: Any, filters: Dict[str, Any], limit: Optional[int] = None,
+                cursor: Optional[Tuple[bool, datetime, int]] = None) -> List[Tuple]:
+    cur.execute(*build_chats_query(filters, limit, cursor))
+    return cur.fetchall()
+
+def serialize_chats(cur: Any, chats: List[Tuple]) -> List[Dict[str, Any]]:
+    '''
+    Business: Строки fetch_chats в dict ответа; имена операторов - из справочника, если JOIN отключён
+    '''
+    operator_names = directory.names(cur, [chat[4] for chat in chats]) if directory.ENABLED else {}
+    return [{
+        'id': chat[0],
+        'user_name': chat[1],
+        'user_email': chat[2],
+        'status': chat[3],
+        'assigned_to': chat[4],
+        'created_at': chat[5].isoformat() if chat[5] else None,
+        'operator_name': operator_names.get(chat[4]) if directory.ENABLED else chat[6],
+        'is_closed': chat[7],
+        'resolution_status': chat[8],
+        'updated_at': chat[9].isoformat() if chat[9] else None
+    } for chat in chats]
+
+def reopen_or_create_chat(cur: Any, user_name: str, user_email: str, message: str) -> Tuple[int, Optional[int]]:
+    '''
+    Business: Переоткрывает последний закрытый нерешённый чат клиента или создаёт новый - одним запросом
+    Args: cur - курсор внутри транзакции
+          user_name, user_email, message - данные обращения клиента
+    Returns: (chat_id, id назначенного оператора или None); оператор выбирается стратегией ASSIGNMENT_STRATEGY,
+             занятые параллельными запросами строки сначала пропускаются (SKIP LOCKED), затем ожидаются;
+             новый чат сразу учитывается в operator_daily_stats
+    '''
+    strategy = os.environ.get('ASSIGNMENT_STRATEGY', 'least_open')
+    order = ASSIGNMENT_ORDER.get(strategy, ASSIGNMENT_ORDER['least_open'])
+    pick = f"""
+        SELECT e.id FROM employees e
+        WHERE e.status = 'online' AND e.role = 'operator'
+        ORDER BY {order}
+        LIMIT 1
+    """
+    cur.execute(f"""
+        WITH existing AS (
+            SELECT id FROM chats
+            WHERE user_email = %(user_email)s AND is_closed = TRUE AND resolution_status = 'unsolved'
+            ORDER BY updated_at DESC
+            LIMIT 1
+            FOR UPDATE
+        ), operator AS (
+            SELECT COALESCE(({pick} FOR UPDATE OF e SKIP LOCKED), ({pick} FOR UPDATE OF e)) AS id
+        ), touched AS (
+            UPDATE employees SET last_assigned_at = CURRENT_TIMESTAMP
+            WHERE id = (SELECT id FROM operator)
+        ), reopened AS (
+            UPDATE chats c
+            SET is_closed = FALSE,
+                status = CASE WHEN o.id IS NULL THEN 'waiting' ELSE 'assigned' END,
+                assigned_to = COALESCE(o.id, c.assigned_to),
+                updated_at = CURRENT_TIMESTAMP
+            FROM existing x, operator o
+            WHERE c.id = x.id
+            RETURNING c.id
+        ), created AS (
+            INSERT INTO chats (user_name, user_email, status, assigned_to)
+            SELECT %(user_name)s, %(user_email)s, CASE WHEN o.id IS NULL THEN 'waiting' ELSE 'assigned' END, o.id
+            FROM operator o
+            WHERE NOT EXISTS (SELECT 1 FROM existing)
+            RETURNING id
+        ), chat AS (
+            SELECT id, TRUE AS reopened FROM reopened
+            UNION ALL
+            SELECT id, FALSE AS reopened FROM created
+        ), first_message AS (
+            INSERT INTO messages (chat_id, sender_type, message)
+            SELECT id, 'user', %(message)s FROM chat
+        ), history AS (
+            INSERT INTO chat_history (chat_id, action, details, employee_id)
+            SELECT chat.id,
+                   CASE WHEN chat.reopened THEN 'reopened' ELSE 'created' END,
+                   CASE WHEN NOT chat.reopened THEN 'New chat created'
+                        WHEN o.id IS NULL THEN 'Chat reopened by client, waiting for operator'
+                        ELSE 'Chat reopened by client' END,
+                   o.id
+            FROM chat, operator o
+        ), events AS (
+            INSERT INTO chat_outbox (event_type, chat_id, payload)
+            SELECT CASE WHEN chat.reopened THEN 'chat.reopened' ELSE 'chat.created' END, chat.id,
+                   jsonb_build_object('assigned_to', o.id)
+            FROM chat, operator o
+        ), stats AS (
+            INSERT INTO operator_daily_stats (day, employee_id, chats_created)
+            SELECT CURRENT_DATE, COALESCE(o.id, 0), 1
+            FROM chat, operator o
+            WHERE NOT chat.reopened
+            ON CONFLICT (day, employee_id) DO UPDATE
+            SET chats_created = operator_daily_stats.chats_created + EXCLUDED.chats_created
+        )
+        SELECT chat.id, o.id FROM chat, operator o
+    """, {'user_name': user_name, 'user_email': user_email, 'message': message})
+    chat_id, operator_id = cur.fetchone()
+    return chat_id, operator_id
+
+def close_chat(cur: Any, chat_id: int, resolution_status: str, employee_id: int) -> None:
+    '''
+    Business: Закрывает чат, пишет историю и добавляет закрытие в дневную аналитику - одним запросом
+    Args: employee_id - сотрудник из сессии; в аналитику закрытие идёт назначенному оператору, если он есть
+    Returns: None; повторное закрытие уже закрытого чата аналитику не меняет
+    '''
+    cur.execute("""
+        WITH prev AS (
+            SELECT id, is_closed FROM chats WHERE id = %(chat_id)s FOR UPDATE
+        ), closed AS (
+            UPDATE chats c
+            SET is_closed = TRUE, status = 'closed', resolution_status = %(resolution_status)s,
+                updated_at = CURRENT_TIMESTAMP
+            FROM prev
+            WHERE c.id = prev.id
+            RETURNING c.id, c.created_at, c.assigned_to, prev.is_closed AS was_closed
+        ), history AS (
+            INSERT INTO chat_history (chat_id, action, details, employee_id)
+            SELECT id, 'closed', 'Chat closed as ' || %(resolution_status)s, %(employee_id)s FROM closed
+        )
+        INSERT INTO operator_daily_stats (day, employee_id, chats_closed, solved, unsolved, handle_seconds)
+        SELECT CURRENT_DATE, COALESCE(assigned_to, %(employee_id)s, 0), 1,
+               (%(resolution_status)s = 'solved')::int, (%(resolution_status)s = 'unsolved')::int,
+               EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - created_at)
+        FROM closed
+        WHERE NOT was_closed
+        ON CONFLICT (day, employee_id) DO UPDATE
+        SET chats_closed = operator_daily_stats.chats_closed + EXCLUDED.chats_closed,
+            solved = operator_daily_stats.solved + EXCLUDED.solved,
+            unsolved = operator_daily_stats.unsolved + EXCLUDED.unsolved,
+            handle_seconds = operator_daily_stats.handle_seconds + EXCLUDED.handle_seconds
+    """, {'chat_id': chat_id, 'resolution_status': resolution_status, 'employee_id': employee_id})
+
+@instrument.traced
+def outbox_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Точка входа для периодического задания - доставляет события из chat_outbox обработчикам
+    Args: event - dict, опционально с max_batches и limit
           context - объект с request_id
-    Returns: HTTP response с данными чатов
+    Returns: dict с количеством обработанных, отложенных на повтор и окончательно неудачных событий
+             и удалённых просроченных ключей идемпотентности
+    '''
+    result = outbox.drain(
+        max_batches=int(event.get('max_batches') or 10),
+        limit=int(event.get('limit') or outbox.BATCH_SIZE)
+    )
+    result['idempotency_keys_purged'] = idempotency.purge()
+    return result
+
+def archive_chats(cur: Any, days: int = ARCHIVE_AFTER_DAYS, limit: int = ARCHIVE_BATCH_SIZE) -> int:
+    '''
+    Business: Переносит сообщения и историю закрытых давно чатов в холодные партиции
+    Args: cur - курсор внутри транзакции
+          days - сколько дней чат должен быть закрыт, limit - максимум чатов за проход
+    Returns: количество заархивированных чатов; повторное открытие чата возвращает его данные триггером
+    '''
+    cur.execute("""
+        WITH candidates AS (
+            SELECT id FROM chats
+            WHERE is_closed = TRUE AND archived_at IS NULL
+              AND updated_at < CURRENT_TIMESTAMP - %(days)s * INTERVAL '1 day'
+            ORDER BY updated_at
+            LIMIT %(limit)s
+            FOR UPDATE SKIP LOCKED
+        ), moved_messages AS (
+            UPDATE messages SET archived = TRUE
+            WHERE chat_id IN (SELECT id FROM candidates) AND archived = FALSE
+        ), moved_history AS (
+            UPDATE chat_history SET archived = TRUE
+            WHERE chat_id IN (SELECT id FROM candidates) AND archived = FALSE
+        )
+        UPDATE chats SET archived_at = CURRENT_TIMESTAMP
+        WHERE id IN (SELECT id FROM candidates)
+    """, {'days': days, 'limit': limit})
+    return cur.rowcount
+
+@instrument.traced
+def archive_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Точка входа для периодического задания - архивирует закрытые чаты пачками по транзакции
+    Args: event - dict, опционально с days, limit и max_batches
+          context - объект с request_id
+    Returns: dict с количеством заархивированных чатов
+    '''
+    days = int(event.get('days') or ARCHIVE_AFTER_DAYS)
+    limit = int(event.get('limit') or ARCHIVE_BATCH_SIZE)
+    archived = 0
+    for _ in range(int(event.get('max_batches') or 20)):
+        with db.connection() as conn:
+            cur = conn.cursor()
+            batch = archive_chats(cur, days, limit)
+            conn.commit()
+            cur.close()
+        archived += batch
+        if batch < limit:
+            break
+    return {'archived_chats': archived}
+
+@instrument.traced
+def export_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Точка входа для выгрузки - чаты с сообщениями и историей в gzip NDJSON или CSV (export.py)
+    Args: event - dict, опционально с format (ndjson|csv), from и to (YYYY-MM-DD, по умолчанию прошлый месяц),
+                  after_id (продолжить выгрузку в тот же path), path, limit и max_batches
+          context - объект с request_id
+    Returns: dict с путём файла, числом чатов и строк, байтами до и после сжатия, last_chat_id и done
     '''
-    method: str = event.get('httpMethod', 'GET')
+    return export.export(
+        fmt=event.get('format') or 'ndjson',
+        created_from=date.fromisoformat(event['from']) if event.get('from') else None,
+        created_to=date.fromisoformat(event['to']) if event.get('to') else None,
+        after_id=int(event.get('after_id') or 0),
+        path=event.get('path'),
+        limit=int(event.get('limit') or export.BATCH_SIZE),
+        max_batches=int(event.get('max_batches') or 100)
+    )
+
+def chats_etag(cur: Any, session: sessions.Session) -> str:
+    '''
+    Business: ETag списка чатов - версия чатов и сотрудников (в списке имена операторов) плюс вызывающий сотрудник:
+              оператор видит только свои чаты, поэтому тег одного сотрудника не должен подходить другому
+    Returns: тег; справочник сверяется с той же версией сотрудников, чтобы новый тег не ушёл со старыми именами
+    '''
+    employees_version = db.list_version(cur, 'employees')
+    if directory.ENABLED:
+        directory.sync(employees_version)
+    return '"chats-%d-%d-%s-%d"' % (db.list_version(cur, 'chats'), employees_version, session.role, session.employee_id)
+
+router = runtime.Router('Content-Type, Authorization, If-None-Match, X-Read-After, Idempotency-Key')
+
+@router.route('GET')
+def list_chats(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    session = sessions.from_event(event)
+    if not session:
+        return runtime.UNAUTHORIZED
     
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
+    params = event.get('queryStringParameters') or {}
     
-    database_url = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(database_url)
-    cur = conn.cursor()
+    try:
+        filters = parse_list_filters(params, session)
+        wait = min(int(params.get('wait') or 0), MAX_WAIT_SECONDS)
+        limit = max(min(int(params.get('limit') or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE), 1)
+        cursor = decode_cursor(params['cursor']) if params.get('cursor') else None
+    except ValueError:
+        return runtime.error(400, 'Invalid filter or pagination parameters')
     
-    if method == 'GET':
-        params = event.get('queryStringParameters') or {}
-        operator_id = params.get('operator_id')
-        role = params.get('role')
-        include_closed = params.get('include_closed', 'false') == 'true'
-        
-        if operator_id and role == 'operator':
-            if include_closed:
-                cur.execute("""
-                    SELECT c.id, c.user_name, c.user_email, c.status, c.assigned_to, 
-                           c.created_at, e.name as operator_name, c.is_closed, c.resolution_status
-                    FROM chats c
-                    LEFT JOIN employees e ON c.assigned_to = e.id
-                    WHERE c.assigned_to = %s
-                    ORDER BY c.is_closed ASC, c.created_at DESC
-                """, (operator_id,))
+    updated_after = filters['updated_after']
+    operator_scope = filters['operator_id']
+    paged = not updated_after and ('limit' in params or cursor is not None)
+    page_limit = limit + 1 if paged else None
+    
+    if not updated_after and not paged:
+        with db.read_connection(event) as conn:
+            cur = conn.cursor()
+            etag = chats_etag(cur, session)
+            if db.if_none_match(event, etag):
+                body = None
             else:
-                cur.execute("""
-                    SELECT c.id, c.user_name, c.user_email, c.status, c.assigned_to, 
-                           c.created_at, e.name as operator_name, c.is_closed, c.resolution_status
-                    FROM chats c
-                    LEFT JOIN employees e ON c.assigned_to = e.id
-                    WHERE c.assigned_to = %s AND c.is_closed = FALSE
-                    ORDER BY c.created_at DESC
-                """, (operator_id,))
-        else:
-            cur.execute("""
-                SELECT c.id, c.user_name, c.user_email, c.status, c.assigned_to, 
-                       c.created_at, e.name as operator_name, c.is_closed, c.resolution_status
-                FROM chats c
-                LEFT JOIN employees e ON c.assigned_to = e.id
-                ORDER BY c.is_closed ASC, c.created_at DESC
-            """)
-        
-        chats = cur.fetchall()
-        result = []
-        for chat in chats:
-            result.append({
-                'id': chat[0],
-                'user_name': chat[1],
-                'user_email': chat[2],
-                'status': chat[3],
-                'assigned_to': chat[4],
-                'created_at': chat[5].isoformat() if chat[5] else None,
-                'operator_name': chat[6],
-                'is_closed': chat[7] if len(chat) > 7 else False,
-                'resolution_status': chat[8] if len(chat) > 8 else None
-            })
+                body = db.fetch_json(cur, *build_chats_query(filters, join_names=True))
+            cur.close()
         
-        cur.close()
-        conn.close()
+        if body is None:
+            return runtime.not_modified(etag)
         
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps(result),
-            'isBase64Encoded': False
-        }
+        return runtime.respond_raw(200, body, etag)
     
-    elif method == 'POST':
-        body_data = json.loads(event.get('body', '{}'))
-        user_name = body_data.get('user_name', '')
-        user_email = body_data.get('user_email', '')
-        message = body_data.get('message', '')
-        
-        if not user_name or not message:
+    if updated_after and wait > 0:
+        with db.listening('chat_events') as conn:
+            cur = conn.cursor()
+            etag = chats_etag(cur, session)
+            chats = fetch_chats(cur, filters)
+            fresh = any(chat[9] and chat[9] > updated_after for chat in chats)
+            if not fresh and db.wait_notify(
+                conn, wait, lambda notify: operator_scope is None or notify.payload == str(operator_scope)
+            ):
+                etag = chats_etag(cur, session)
+                chats = fetch_chats(cur, filters)
+            result = serialize_chats(cur, chats)
+            cur.close()
+    else:
+        with db.read_connection(event) as conn:
+            cur = conn.cursor()
+            etag = chats_etag(cur, session)
+            chats = None if db.if_none_match(event, etag) else fetch_chats(cur, filters, page_limit, cursor)
+            has_more = chats is not None and paged and len(chats) > limit
+            if has_more:
+                chats = chats[:limit]
+            result = None if chats is None else serialize_chats(cur, chats)
             cur.close()
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'User name and message required'}),
-                'isBase64Encoded': False
-            }
-        
-        cur.execute(
-            "SELECT id FROM chats WHERE user_email = %s AND is_closed = TRUE AND resolution_status = 'unsolved' ORDER BY updated_at DESC LIMIT 1",
-            (user_email,)
-        )
-        existing_chat = cur.fetchone()
-        
-        if existing_chat:
-            chat_id = existing_chat[0]
-            
-            cur.execute(
-                "SELECT id FROM employees WHERE status = 'online' AND role = 'operator' ORDER BY id LIMIT 1"
-            )
-            operator = cur.fetchone()
-            
-            if operator:
-                cur.execute(
-                    "UPDATE chats SET is_closed = FALSE, status = 'assigned', assigned_to = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s",
-                    (operator[0], chat_id)
-                )
-                cur.execute(
-                    "INSERT INTO chat_history (chat_id, action, details, employee_id) VALUES (%s, 'reopened', 'Chat reopened by client', %s)",
-                    (chat_id, operator[0])
-                )
-            else:
-                cur.execute(
-                    "UPDATE chats SET is_closed = FALSE, status = 'waiting', updated_at = CURRENT_TIMESTAMP WHERE id = %s",
-                    (chat_id,)
-                )
-                cur.execute(
-                    "INSERT INTO chat_history (chat_id, action, details) VALUES (%s, 'reopened', 'Chat reopened by client, waiting for operator')",
-                    (chat_id,)
-                )
-            
-            cur.execute(
-                "INSERT INTO messages (chat_id, sender_type, message) VALUES (%s, 'user', %s)",
-                (chat_id, message)
-            )
-        else:
-            cur.execute(
-                "SELECT id FROM employees WHERE status = 'online' AND role = 'operator' ORDER BY id LIMIT 1"
-            )
-            operator = cur.fetchone()
-            
-            if operator:
-                cur.execute(
-                    "INSERT INTO chats (user_name, user_email, status, assigned_to) VALUES (%s, %s, 'assigned', %s) RETURNING id",
-                    (user_name, user_email, operator[0])
-                )
-            else:
-                cur.execute(
-                    "INSERT INTO chats (user_name, user_email, status) VALUES (%s, %s, 'waiting') RETURNING id",
-                    (user_name, user_email)
-                )
-            
-            chat_id = cur.fetchone()[0]
-            
-            cur.execute(
-                "INSERT INTO messages (chat_id, sender_type, message) VALUES (%s, 'user', %s)",
-                (chat_id, message)
-            )
-            
-            cur.execute(
-                "INSERT INTO chat_history (chat_id, action, details, employee_id) VALUES (%s, 'created', 'New chat created', %s)",
-                (chat_id, operator[0] if operator else None)
-            )
         
+        if chats is None:
+            return runtime.not_modified(etag)
+    
+    if updated_after:
+        cursor = max([chat[9] for chat in chats if chat[9]], default=updated_after)
+        result = {'chats': result, 'cursor': cursor.isoformat()}
+    else:
+        result = {'chats': result, 'next_cursor': encode_cursor(chats[-1]) if has_more else None}
+    
+    return runtime.respond_raw(200, runtime.dumps(result), etag)
+
+@router.route('POST')
+def create_chat(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    body_data = runtime.body(event)
+    user_name = body_data.get('user_name', '')
+    user_email = body_data.get('user_email', '')
+    message = body_data.get('message', '')
+    
+    if not user_name or not message:
+        return runtime.error(400, 'User name and message required')
+    
+    idempotency_key = idempotency.key(event)
+    with db.connection() as conn:
+        cur = conn.cursor()
+        if idempotency_key:
+            stored = idempotency.claim(cur, 'chats', idempotency_key, event)
+            if stored is not None:
+                cur.close()
+                return stored
+        chat_id, operator_id = reopen_or_create_chat(cur, user_name, user_email, message)
+        response = runtime.respond(201, {'chat_id': chat_id, 'status': 'assigned' if operator_id else 'waiting'})
+        if idempotency_key:
+            idempotency.store(cur, 'chats', idempotency_key, response)
         conn.commit()
+        token = db.write_token(cur)
         cur.close()
-        conn.close()
-        
-        return {
-            'statusCode': 201,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'chat_id': chat_id, 'status': 'assigned' if existing_chat or operator else 'waiting'}),
-            'isBase64Encoded': False
-        }
     
-    elif method == 'PUT':
-        body_data = json.loads(event.get('body', '{}'))
-        chat_id = body_data.get('chat_id')
-        action = body_data.get('action')
-        resolution_status = body_data.get('resolution_status')
-        employee_id = body_data.get('employee_id')
-        
-        if action == 'close' and chat_id and resolution_status:
-            cur.execute(
-                "UPDATE chats SET is_closed = TRUE, status = 'closed', resolution_status = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s",
-                (resolution_status, chat_id)
-            )
-            
-            details = f"Chat closed as {resolution_status}"
-            cur.execute(
-                "INSERT INTO chat_history (chat_id, action, details, employee_id) VALUES (%s, 'closed', %s, %s)",
-                (chat_id, details, employee_id)
-            )
-            conn.commit()
-        
-        cur.close()
-        conn.close()
-        
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'success': True}),
-            'isBase64Encoded': False
-        }
+    return runtime.with_read_token(response, token)
+
+@router.route('PUT')
+def update_chat(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    session = sessions.from_event(event)
+    if not session:
+        return runtime.UNAUTHORIZED
+    
+    body_data = runtime.body(event)
+    chat_id = body_data.get('chat_id')
+    action = body_data.get('action')
+    resolution_status = body_data.get('resolution_status')
+    employee_id = session.employee_id
+    token = None
     
-    cur.close()
-    conn.close()
+    if action == 'close' and chat_id and resolution_status:
+        with db.connection() as conn:
+            cur = conn.cursor()
+            close_chat(cur, chat_id, resolution_status, employee_id)
+            outbox.enqueue(cur, 'chat.closed', chat_id, {'resolution_status': resolution_status, 'employee_id': employee_id})
+            conn.commit()
+            token = db.write_token(cur)
+            cur.close()
     
-    return {
-        'statusCode': 405,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'error': 'Method not allowed'}),
-        'isBase64Encoded': False
-    }
\ No newline at end of file
+    return runtime.with_read_token(runtime.respond(200, {'success': True}), token)
+
+@instrument.traced
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Управление чатами - создание, получение списка, назначение оператору
+    Args: event - dict с httpMethod, body, queryStringParameters
+                  (POST: оператор выбирается стратегией ASSIGNMENT_STRATEGY - least_open | round_robin;
+                   GET и PUT требуют сессионного токена сотрудника)
+                  (GET: фильтры status, resolution_status, assigned_to, created_from, created_to, open_only;
+                   limit + cursor - постраничная выдача; updated_after + wait - long-poll изменений,
+                   чаты из окна UPDATED_OVERLAP_SECONDS до курсора приходят повторно - клиент сливает их по id)
+          context - объект с request_id
+    Returns: HTTP response с данными чатов
+    '''
+    return router.dispatch(event, context)
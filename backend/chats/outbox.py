@@ -0,0 +1,189 @@
+'''
+Транзакционный outbox событий чатов: запись в той же транзакции, что и изменение, и асинхронный разбор воркером.
+Файл лежит копией в backend/chats и backend/messages и должен оставаться одинаковым.
+'''
+import json
+import os
+import random
+from typing import Any, Callable, Dict, List, Optional
+
+import db
+import runtime
+
+futures = runtime.lazy('concurrent.futures')
+urllib_request = runtime.lazy('urllib.request')
+
+BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', '100'))
+WORKERS = int(os.environ.get('OUTBOX_WORKERS', '8'))
+MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', '8'))
+LEASE_SECONDS = float(os.environ.get('OUTBOX_LEASE_SECONDS', '60'))
+BACKOFF_BASE = float(os.environ.get('OUTBOX_BACKOFF_BASE', '2'))
+BACKOFF_MAX = float(os.environ.get('OUTBOX_BACKOFF_MAX', '900'))
+WEBHOOK_URL = os.environ.get('OUTBOX_WEBHOOK_URL')
+WEBHOOK_TIMEOUT = float(os.environ.get('OUTBOX_WEBHOOK_TIMEOUT', '5'))
+RETENTION_HOURS = float(os.environ.get('OUTBOX_RETENTION_HOURS', '72'))
+
+HANDLERS: Dict[str, List[Callable[[Dict[str, Any]], None]]] = {}
+
+
+def enqueue(cur: Any, event_type: str, chat_id: Optional[int], payload: Optional[Dict[str, Any]] = None) -> None:
+    '''
+    Business: Записывает событие в outbox; вызывать внутри транзакции изменения, до commit
+    Args: event_type - например 'chat.created', chat_id - чат события, payload - данные для обработчиков
+    '''
+    cur.execute(
+        "INSERT INTO chat_outbox (event_type, chat_id, payload) VALUES (%s, %s, %s)",
+        (event_type, chat_id, json.dumps(payload or {}))
+    )
+
+
+def enqueue_messages(cur: Any, message_ids: List[int]) -> None:
+    '''
+    Business: События message.created для уже вставленных сообщений одним запросом (одиночная и пакетная отправка)
+    '''
+    cur.execute("""
+        INSERT INTO chat_outbox (event_type, chat_id, payload)
+        SELECT 'message.created', chat_id, jsonb_build_object('message_id', id, 'sender_type', sender_type)
+        FROM messages
+        WHERE id = ANY(%s) AND archived = FALSE
+        ORDER BY id
+    """, (message_ids,))
+
+
+def register(event_type: str, handler: Callable[[Dict[str, Any]], None]) -> None:
+    '''
+    Business: Подписывает обработчик на тип события ('*' - на все типы)
+    Args: handler - получает dict (id, type, chat_id, payload, attempt); исключение означает повтор позже
+    '''
+    HANDLERS.setdefault(event_type, []).append(handler)
+
+
+def deliver_webhook(event: Dict[str, Any]) -> None:
+    request = urllib_request.Request(
+        WEBHOOK_URL,
+        data=json.dumps(event, default=str).encode('utf-8'),
+        headers={'Content-Type': 'application/json', 'Idempotency-Key': f"chat-outbox-{event['id']}"},
+        method='POST'
+    )
+    with urllib_request.urlopen(request, timeout=WEBHOOK_TIMEOUT):
+        pass
+
+
+if WEBHOOK_URL:
+    register('*', deliver_webhook)
+
+
+def backoff(attempt: int) -> float:
+    '''
+    Business: Пауза перед повтором - экспонента от номера попытки с полным джиттером
+    '''
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1)))
+
+
+def claim(cur: Any, limit: int = BATCH_SIZE) -> List[Dict[str, Any]]:
+    '''
+    Business: Забирает пачку готовых событий под аренду; параллельные воркеры пропускают чужие строки (SKIP LOCKED)
+    Returns: события; если воркер упадёт, аренда истечёт через LEASE_SECONDS и событие заберут снова
+    '''
+    cur.execute("""
+        UPDATE chat_outbox o
+        SET attempts = o.attempts + 1, available_at = CURRENT_TIMESTAMP + make_interval(secs => %s)
+        FROM (
+            SELECT id FROM chat_outbox
+            WHERE processed_at IS NULL AND failed_at IS NULL AND available_at <= CURRENT_TIMESTAMP
+            ORDER BY available_at, id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        ) ready
+        WHERE o.id = ready.id
+        RETURNING o.id, o.event_type, o.chat_id, o.payload, o.attempts
+    """, (LEASE_SECONDS, limit))
+    return [
+        {'id': row[0], 'type': row[1], 'chat_id': row[2], 'payload': row[3], 'attempt': row[4]}
+        for row in sorted(cur.fetchall())
+    ]
+
+
+def dispatch(event: Dict[str, Any]) -> Optional[str]:
+    '''
+    Business: Вызывает все обработчики события
+    Returns: None при успехе или текст первой ошибки
+    '''
+    for handler in HANDLERS.get(event['type'], []) + HANDLERS.get('*', []):
+        try:
+            handler(event)
+        except Exception as error:
+            return f'{type(error).__name__}: {error}'[:1000]
+    return None
+
+
+def process_batch(limit: int = BATCH_SIZE) -> Dict[str, int]:
+    '''
+    Business: Один проход воркера - аренда пачки, параллельный запуск обработчиков, фиксация результатов
+    Returns: dict processed, retried, failed (failed - исчерпали MAX_ATTEMPTS и больше не берутся)
+    '''
+    with db.connection() as conn:
+        cur = conn.cursor()
+        events = claim(cur, limit)
+        conn.commit()
+        cur.close()
+
+    result = {'processed': 0, 'retried': 0, 'failed': 0}
+    if not events:
+        return result
+
+    with futures.ThreadPoolExecutor(max_workers=min(WORKERS, len(events))) as executor:
+        errors = list(executor.map(dispatch, events))
+
+    done = [event['id'] for event, error in zip(events, errors) if error is None]
+    with db.connection() as conn:
+        cur = conn.cursor()
+        if done:
+            cur.execute(
+                "UPDATE chat_outbox SET processed_at = CURRENT_TIMESTAMP, last_error = NULL WHERE id = ANY(%s)",
+                (done,)
+            )
+        for event, error in zip(events, errors):
+            if error is None:
+                continue
+            if event['attempt'] >= MAX_ATTEMPTS:
+                cur.execute(
+                    "UPDATE chat_outbox SET failed_at = CURRENT_TIMESTAMP, last_error = %s WHERE id = %s",
+                    (error, event['id'])
+                )
+                result['failed'] += 1
+            else:
+                cur.execute(
+                    "UPDATE chat_outbox SET available_at = CURRENT_TIMESTAMP + make_interval(secs => %s), last_error = %s WHERE id = %s",
+                    (backoff(event['attempt']), error, event['id'])
+                )
+                result['retried'] += 1
+        conn.commit()
+        cur.close()
+
+    result['processed'] = len(done)
+    return result
+
+
+def drain(max_batches: int = 10, limit: int = BATCH_SIZE) -> Dict[str, int]:
+    '''
+    Business: Разбирает outbox пачками, пока есть готовые события или не исчерпан max_batches;
+              обработанные события старше RETENTION_HOURS удаляются
+    '''
+    totals = {'processed': 0, 'retried': 0, 'failed': 0}
+    for _ in range(max_batches):
+        result = process_batch(limit)
+        for key in totals:
+            totals[key] += result[key]
+        if sum(result.values()) < limit:
+            break
+
+    with db.connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "DELETE FROM chat_outbox WHERE processed_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 hour'",
+            (RETENTION_HOURS,)
+        )
+        conn.commit()
+        cur.close()
+    return totals
@@ -0,0 +1,119 @@
+'''
+Подписанные сессионные токены сотрудников: HMAC-SHA256 над id, ролью и сроком действия.
+Проверка не ходит в базу; отозванные токены берутся из кэша, который обновляется раз в SESSION_DENYLIST_REFRESH секунд.
+Файл лежит копией в каждой папке backend/* и должен оставаться одинаковым.
+'''
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from typing import Any, Dict, NamedTuple, Optional, Set
+
+import db
+
+SESSION_TTL = int(os.environ.get('SESSION_TTL', str(12 * 3600)))
+DENYLIST_REFRESH = float(os.environ.get('SESSION_DENYLIST_REFRESH', '30'))
+
+
+class Session(NamedTuple):
+    employee_id: int
+    role: str
+    expires_at: int
+    token_id: str
+
+
+def _secret() -> bytes:
+    secret = os.environ.get('SESSION_SECRET')
+    if not secret:
+        raise RuntimeError('SESSION_SECRET is not configured')
+    return secret.encode('utf-8')
+
+
+def _sign(payload: bytes) -> str:
+    digest = hmac.new(_secret(), payload, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).decode('ascii').rstrip('=')
+
+
+def new_session(employee_id: int, role: str, ttl: int = SESSION_TTL) -> Session:
+    expires_at = int(time.time()) + ttl
+    return Session(employee_id, role, expires_at, secrets.token_hex(8))
+
+
+def encode_token(session: Session) -> str:
+    payload = f'{session.employee_id}:{session.role}:{session.expires_at}:{session.token_id}'.encode('ascii')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=') + '.' + _sign(payload)
+
+
+def decode_token(token: str) -> Optional[Session]:
+    '''
+    Business: Проверяет подпись, срок действия и отзыв токена без обращения к базе на каждый запрос
+    Returns: Session или None для поддельного, просроченного или отозванного токена
+    '''
+    try:
+        encoded, signature = token.split('.')
+        payload = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+        if not hmac.compare_digest(signature.encode(), _sign(payload).encode()):
+            return None
+        employee_id, role, expires_at, token_id = payload.decode('ascii').split(':')
+        session = Session(int(employee_id), role, int(expires_at), token_id)
+    except (ValueError, TypeError):
+        return None
+    if session.expires_at < time.time() or denylist.contains(session.token_id):
+        return None
+    return session
+
+
+def from_event(event: Dict[str, Any]) -> Optional[Session]:
+    headers = event.get('headers') or {}
+    value = next((v for k, v in headers.items() if k.lower() in ('authorization', 'x-auth-token')), None)
+    if not value:
+        return None
+    if value.lower().startswith('bearer '):
+        value = value[7:]
+    return decode_token(value.strip())
+
+
+class Denylist:
+    '''
+    Business: Кэш отозванных token_id; в базу ходит не чаще раза в refresh секунд на экземпляр функции
+    '''
+
+    def __init__(self, refresh: float = DENYLIST_REFRESH) -> None:
+        self.refresh = refresh
+        self._token_ids: Set[str] = set()
+        self._loaded_at = float('-inf')
+        self._lock = threading.Lock()
+
+    def contains(self, token_id: str) -> bool:
+        if time.monotonic() - self._loaded_at > self.refresh:
+            self._reload()
+        return token_id in self._token_ids
+
+    def _reload(self) -> None:
+        with self._lock:
+            if time.monotonic() - self._loaded_at <= self.refresh:
+                return
+            with db.connection() as conn:
+                cur = conn.cursor()
+                cur.execute("SELECT token_id FROM revoked_sessions WHERE expires_at > CURRENT_TIMESTAMP")
+                self._token_ids = {row[0] for row in cur.fetchall()}
+                cur.close()
+            self._loaded_at = time.monotonic()
+
+    def add(self, token_id: str) -> None:
+        self._token_ids = self._token_ids | {token_id}
+
+
+denylist = Denylist()
+
+
+def revoke(cur: Any, session: Session) -> None:
+    cur.execute("DELETE FROM revoked_sessions WHERE expires_at < CURRENT_TIMESTAMP")
+    cur.execute(
+        "INSERT INTO revoked_sessions (token_id, expires_at) VALUES (%s, to_timestamp(%s)) ON CONFLICT (token_id) DO NOTHING",
+        (session.token_id, session.expires_at)
+    )
+    denylist.add(session.token_id)
@@ -1,134 +1,420 @@
-import json
 import os
-import psycopg2
-from typing import Dict, Any
+import db
+import directory
+import instrument
+import passwords
+import runtime
+import sessions
+from datetime import date, timedelta
+from typing import Dict, Any, List, Optional
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+DRAIN_BATCH_SIZE = int(os.environ.get('DRAIN_BATCH_SIZE', '20'))
+REHASH_BATCH_SIZE = int(os.environ.get('PASSWORD_REHASH_BATCH_SIZE', '100'))
+MAX_STATS_DAYS = 366
+
+def drain_waiting_queue(cur: Any, employee_id: Optional[int] = None, limit: int = DRAIN_BATCH_SIZE) -> int:
     '''
-    Business: Управление сотрудниками - список, создание, обновление статуса
-    Args: event - dict с httpMethod, body, queryStringParameters
+    Business: Назначает ожидающие чаты онлайн-операторам одним set-based запросом
+    Args: cur - курсор внутри транзакции
+          employee_id - назначать только этому оператору (None - распределить между всеми онлайн)
+          limit - максимум чатов за один проход, в порядке created_at
+    Returns: количество назначенных чатов
+    '''
+    cur.execute("""
+        WITH operators AS (
+            SELECT e.id,
+                   row_number() OVER (ORDER BY COALESCE(l.open_chats, 0), e.last_assigned_at NULLS FIRST, e.id) - 1 AS slot,
+                   count(*) OVER () AS total
+            FROM employees e
+            LEFT JOIN operator_load l ON l.employee_id = e.id
+            WHERE e.status = 'online' AND e.role = 'operator' AND (%(employee_id)s::int IS NULL OR e.id = %(employee_id)s)
+        ), claimed AS (
+            SELECT w.id, row_number() OVER (ORDER BY w.created_at, w.id) - 1 AS position
+            FROM (
+                SELECT id, created_at FROM chats
+                WHERE status = 'waiting' AND is_closed = FALSE
+                ORDER BY created_at, id
+                LIMIT %(limit)s
+                FOR UPDATE SKIP LOCKED
+            ) w
+        ), assigned AS (
+            UPDATE chats c
+            SET status = 'assigned', assigned_to = o.id, updated_at = CURRENT_TIMESTAMP
+            FROM claimed w
+            JOIN operators o ON o.slot = w.position %% o.total
+            WHERE c.id = w.id
+            RETURNING c.id, c.assigned_to
+        ), touched AS (
+            UPDATE employees SET last_assigned_at = CURRENT_TIMESTAMP
+            WHERE id IN (SELECT assigned_to FROM assigned)
+        ), queued AS (
+            INSERT INTO chat_outbox (event_type, chat_id, payload)
+            SELECT 'chat.assigned', id, jsonb_build_object('assigned_to', assigned_to) FROM assigned
+        )
+        INSERT INTO chat_history (chat_id, action, details, employee_id)
+        SELECT id, 'assigned', 'Assigned from waiting queue', assigned_to FROM assigned
+    """, {'employee_id': employee_id, 'limit': limit})
+    return cur.rowcount
+
+@instrument.traced
+def drain_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Точка входа для периодического задания - разбирает очередь ожидающих чатов
+    Args: event - dict, опционально с limit
           context - объект с request_id
-    Returns: HTTP response с данными сотрудников
+    Returns: dict с количеством назначенных чатов
     '''
-    method: str = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
+    limit = int(event.get('limit') or DRAIN_BATCH_SIZE)
+    with db.connection() as conn:
+        cur = conn.cursor()
+        assigned = drain_waiting_queue(cur, limit=limit)
+        conn.commit()
+        cur.close()
+    return {'assigned_chats': assigned}
+
+
+def fetch_daily_stats(cur: Any, day_from: date, day_to: date, employee_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    '''
+    Business: Читает готовые дневные срезы operator_daily_stats - стоимость зависит только от числа дней и операторов
+    Args: day_from, day_to - включительный диапазон дней, employee_id - только этот оператор (None - все)
+    Returns: строки по (день, оператор) с долями решённых и средними временами в секундах
+    '''
+    cur.execute("""
+        SELECT s.day, s.employee_id, e.name, s.chats_created, s.chats_closed, s.solved, s.unsolved,
+               s.first_responses, s.first_response_seconds, s.handle_seconds
+        FROM operator_daily_stats s
+        LEFT JOIN employees e ON e.id = s.employee_id
+        WHERE s.day BETWEEN %s AND %s AND (%s::int IS NULL OR s.employee_id = %s)
+        ORDER BY s.day, s.employee_id
+    """, (day_from, day_to, employee_id, employee_id))
+    return [
+        {
+            'day': row[0].isoformat(),
+            'employee_id': row[1] or None,
+            'operator_name': row[2],
+            'chats_created': row[3],
+            'chats_closed': row[4],
+            'solved': row[5],
+            'unsolved': row[6],
+            'solved_rate': row[5] / row[4] if row[4] else None,
+            'first_responses': row[7],
+            'avg_first_response_seconds': row[8] / row[7] if row[7] else None,
+            'avg_handle_seconds': row[9] / row[4] if row[4] else None
         }
+        for row in cur.fetchall()
+    ]
+
+def backfill_first_responses(cur: Any) -> int:
+    '''
+    Business: Отмечает first_response_at у чатов без отметки - первое по id сообщение оператора, как в живом пути
+              messages POST (record_first_responses), а не самое раннее по created_at
+    Returns: количество отмеченных чатов; смотрит только неотмеченные чаты, по индексу messages (chat_id, id)
+    '''
+    cur.execute("""
+        UPDATE chats c SET first_response_at = f.first_at
+        FROM (
+            SELECT u.id, (
+                SELECT m.created_at FROM messages m
+                WHERE m.chat_id = u.id AND m.sender_type = 'operator' AND m.sender_id IS NOT NULL
+                ORDER BY m.id
+                LIMIT 1
+            ) AS first_at
+            FROM chats u
+            WHERE u.first_response_at IS NULL
+        ) f
+        WHERE c.id = f.id AND f.first_at IS NOT NULL AND c.first_response_at IS NULL
+    """)
+    return cur.rowcount
+
+def backfill_daily_stats(cur: Any, day_from: Optional[date] = None, day_to: Optional[date] = None) -> int:
+    '''
+    Business: Пересчитывает operator_daily_stats за прошедшие дни диапазона из chats, messages и chat_history
+    Args: cur - курсор внутри транзакции, first_response_at уже отмечены (backfill_first_responses)
+          day_from/day_to - включительно (None - без границы); сегодняшний день не пересчитывается - его ведут
+          инкременты функций, которые пишут только в строки CURRENT_DATE
+    Returns: количество записанных строк срезов; пересчёт идёт во временную таблицу без блокировок,
+             operator_daily_stats блокируется только на замену строк диапазона
+    '''
+    bounds = {'day_from': day_from, 'day_to': day_to}
+    cur.execute("""
+        CREATE TEMP TABLE backfilled_stats ON COMMIT DROP AS
+        WITH bounds AS (
+            SELECT %(day_from)s::date AS day_from, LEAST(%(day_to)s::date + 1, CURRENT_DATE) AS day_end
+        ), created AS (
+            SELECT c.created_at::date AS day, COALESCE(h.employee_id, 0) AS employee_id, count(*) AS chats_created
+            FROM chats c
+            CROSS JOIN bounds b
+            LEFT JOIN LATERAL (
+                SELECT employee_id FROM chat_history
+                WHERE chat_id = c.id AND action = 'created'
+                ORDER BY id
+                LIMIT 1
+            ) h ON TRUE
+            WHERE (b.day_from IS NULL OR c.created_at >= b.day_from) AND c.created_at < b.day_end
+            GROUP BY 1, 2
+        ), responded AS (
+            SELECT c.first_response_at::date AS day, f.sender_id AS employee_id,
+                   EXTRACT(EPOCH FROM c.first_response_at - c.created_at) AS seconds
+            FROM chats c
+            CROSS JOIN bounds b
+            JOIN LATERAL (
+                SELECT sender_id FROM messages
+                WHERE chat_id = c.id AND sender_type = 'operator' AND sender_id IS NOT NULL
+                ORDER BY id
+                LIMIT 1
+            ) f ON TRUE
+            WHERE (b.day_from IS NULL OR c.first_response_at >= b.day_from) AND c.first_response_at < b.day_end
+        ), closed AS (
+            SELECT h.created_at::date AS day, COALESCE(c.assigned_to, h.employee_id, 0) AS employee_id,
+                   count(*) AS chats_closed,
+                   count(*) FILTER (WHERE h.details LIKE '%%as solved') AS solved,
+                   count(*) FILTER (WHERE h.details LIKE '%%as unsolved') AS unsolved,
+                   sum(EXTRACT(EPOCH FROM h.created_at - c.created_at)) AS handle_seconds
+            FROM chat_history h
+            CROSS JOIN bounds b
+            JOIN chats c ON c.id = h.chat_id
+            WHERE h.action = 'closed'
+              AND (b.day_from IS NULL OR h.created_at >= b.day_from) AND h.created_at < b.day_end
+            GROUP BY 1, 2
+        ), combined AS (
+            SELECT day, employee_id, chats_created, 0 AS chats_closed, 0 AS solved, 0 AS unsolved,
+                   0 AS first_responses, 0 AS first_response_seconds, 0 AS handle_seconds
+            FROM created
+            UNION ALL
+            SELECT day, employee_id, 0, 0, 0, 0, count(*), sum(seconds), 0 FROM responded GROUP BY 1, 2
+            UNION ALL
+            SELECT day, employee_id, 0, chats_closed, solved, unsolved, 0, 0, handle_seconds FROM closed
+        )
+        SELECT day, employee_id, sum(chats_created) AS chats_created, sum(chats_closed) AS chats_closed,
+               sum(solved) AS solved, sum(unsolved) AS unsolved, sum(first_responses) AS first_responses,
+               sum(first_response_seconds) AS first_response_seconds, sum(handle_seconds) AS handle_seconds
+        FROM combined
+        GROUP BY day, employee_id
+    """, bounds)
+    cur.execute("LOCK TABLE operator_daily_stats IN SHARE ROW EXCLUSIVE MODE")
+    cur.execute("""
+        DELETE FROM operator_daily_stats
+        WHERE (%(day_from)s::date IS NULL OR day >= %(day_from)s) AND day < LEAST(%(day_to)s::date + 1, CURRENT_DATE)
+    """, bounds)
+    cur.execute("""
+        INSERT INTO operator_daily_stats (day, employee_id, chats_created, chats_closed, solved, unsolved,
+                                          first_responses, first_response_seconds, handle_seconds)
+        SELECT day, employee_id, chats_created, chats_closed, solved, unsolved,
+               first_responses, first_response_seconds, handle_seconds
+        FROM backfilled_stats
+    """)
+    return cur.rowcount
+
+@instrument.traced
+def stats_backfill_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Точка входа для разового или периодического пересчёта аналитики по существующим данным
+    Args: event - dict, опционально с from и to (YYYY-MM-DD, включительно)
+          context - объект с request_id
+    Returns: dict с количеством отмеченных первых ответов и строк дневных срезов
+    '''
+    day_from = date.fromisoformat(event['from']) if event.get('from') else None
+    day_to = date.fromisoformat(event['to']) if event.get('to') else None
+    with db.connection() as conn:
+        cur = conn.cursor()
+        first_responses = backfill_first_responses(cur)
+        conn.commit()
+        rows = backfill_daily_stats(cur, day_from, day_to)
+        conn.commit()
+        cur.close()
+    return {'first_responses_marked': first_responses, 'stats_rows': rows}
+
+def rehash_plaintext_passwords(cur: Any, limit: int = REHASH_BATCH_SIZE) -> int:
+    '''
+    Business: Хеширует пачку открытых паролей старых записей, не дожидаясь входа сотрудника
+    Args: cur - курсор внутри транзакции, limit - максимум сотрудников за пачку
+    Returns: количество открытых паролей в пачке (0 - их больше нет); если пароль успели перехешировать при входе,
+             UPDATE его не трогает
+    '''
+    cur.execute(
+        "SELECT id, password FROM employees WHERE left(password, %s) <> %s ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED",
+        (len(passwords.ALGORITHM) + 1, passwords.ALGORITHM + '$', limit)
+    )
+    rows = [(employee_id, stored) for employee_id, stored in cur.fetchall() if not passwords.is_hashed(stored)]
+    for employee_id, stored in rows:
+        cur.execute(
+            "UPDATE employees SET password = %s WHERE id = %s AND password = %s",
+            (passwords.hash_password(stored), employee_id, stored)
+        )
+    return len(rows)
+
+@instrument.traced
+def password_rehash_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Разовая точка входа после деплоя хеширования - переводит все открытые пароли (включая засеянного
+              админа) в PBKDF2 пачками по транзакции; повторный запуск ничего не меняет
+    Args: event - dict, опционально с limit (размер пачки)
+          context - объект с request_id
+    Returns: dict с количеством перехешированных паролей
+    '''
+    limit = int(event.get('limit') or REHASH_BATCH_SIZE)
+    total = 0
+    with db.connection() as conn:
+        cur = conn.cursor()
+        while True:
+            batch = rehash_plaintext_passwords(cur, limit)
+            conn.commit()
+            if batch == 0:
+                break
+            total += batch
+        cur.close()
+    return {'rehashed': total}
+
+router = runtime.Router('Content-Type, Authorization, If-None-Match, X-Read-After')
+
+@router.route('GET')
+def list_employees(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    session = sessions.from_event(event)
+    if not session:
+        return runtime.UNAUTHORIZED
     
-    database_url = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(database_url)
-    cur = conn.cursor()
+    params = event.get('queryStringParameters') or {}
     
-    if method == 'GET':
-        cur.execute("""
-            SELECT id, login, name, role, status, created_at
-            FROM employees
-            ORDER BY created_at DESC
-        """)
+    if params.get('view') == 'stats':
+        try:
+            day_to = date.fromisoformat(params['to']) if params.get('to') else date.today()
+            day_from = date.fromisoformat(params['from']) if params.get('from') else day_to - timedelta(days=29)
+            employee_id = int(params['employee_id']) if params.get('employee_id') else None
+        except ValueError:
+            day_from = day_to = None
         
-        employees = cur.fetchall()
-        result = []
-        for emp in employees:
-            result.append({
-                'id': emp[0],
-                'login': emp[1],
-                'name': emp[2],
-                'role': emp[3],
-                'status': emp[4],
-                'created_at': emp[5].isoformat() if emp[5] else None
-            })
+        if day_from is None or day_from > day_to or (day_to - day_from).days >= MAX_STATS_DAYS:
+            return runtime.error(400, f'from/to must be dates at most {MAX_STATS_DAYS} days apart')
         
-        cur.close()
-        conn.close()
+        if session.role != 'admin':
+            employee_id = session.employee_id
         
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps(result),
-            'isBase64Encoded': False
-        }
-    
-    elif method == 'POST':
-        body_data = json.loads(event.get('body', '{}'))
-        login = body_data.get('login', '')
-        password = body_data.get('password', '')
-        name = body_data.get('name', '')
-        role = body_data.get('role', 'operator')
+        with db.read_connection(event) as conn:
+            cur = conn.cursor()
+            days = fetch_daily_stats(cur, day_from, day_to, employee_id)
+            cur.close()
         
-        if not login or not password or not name:
+        return runtime.respond(200, {'from': day_from.isoformat(), 'to': day_to.isoformat(), 'days': days})
+    
+    if params.get('view') == 'load':
+        with db.read_connection(event) as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT e.id, e.name, e.status, COALESCE(l.open_chats, 0)
+                FROM employees e
+                LEFT JOIN operator_load l ON l.employee_id = e.id
+                WHERE e.role = 'operator'
+                ORDER BY e.id
+            """)
+            operators = cur.fetchall()
+            cur.execute("SELECT waiting_chats FROM chat_queue")
+            queue = cur.fetchone()
             cur.close()
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Login, password and name required'}),
-                'isBase64Encoded': False
-            }
         
+        result = {
+            'waiting_chats': queue[0] if queue else 0,
+            'operators': [
+                {'id': op[0], 'name': op[1], 'status': op[2], 'open_chats': op[3]}
+                for op in operators
+            ]
+        }
+        
+        return runtime.respond(200, result)
+    
+    with db.read_connection(event) as conn:
+        cur = conn.cursor()
+        version = db.list_version(cur, 'employees')
+        etag = '"employees-%d-%s-%d"' % (version, session.role, session.employee_id)
+        if db.if_none_match(event, etag):
+            body = None
+        elif directory.ENABLED:
+            body = runtime.dumps(directory.all_employees(cur, version))
+        else:
+            body = db.fetch_json(cur, """
+                SELECT id, login, name, role, status, created_at
+                FROM employees
+                ORDER BY created_at DESC
+            """)
+        cur.close()
+    
+    if body is None:
+        return runtime.not_modified(etag)
+    
+    return runtime.respond_raw(200, body, etag)
+
+@router.route('POST')
+def create_employee(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    session = sessions.from_event(event)
+    if not session:
+        return runtime.UNAUTHORIZED
+    
+    body_data = runtime.body(event)
+    login = body_data.get('login', '')
+    password = body_data.get('password', '')
+    name = body_data.get('name', '')
+    role = body_data.get('role', 'operator')
+    
+    if session.role != 'admin':
+        return runtime.FORBIDDEN
+    
+    if not login or not password or not name:
+        return runtime.error(400, 'Login, password and name required')
+    
+    password_hash = passwords.new_hash(password)
+    
+    with db.connection() as conn:
+        cur = conn.cursor()
         cur.execute(
             "INSERT INTO employees (login, password, name, role) VALUES (%s, %s, %s, %s) RETURNING id",
-            (login, password, name, role)
+            (login, password_hash, name, role)
         )
-        
         employee_id = cur.fetchone()[0]
         conn.commit()
+        token = db.write_token(cur)
         cur.close()
-        conn.close()
-        
-        return {
-            'statusCode': 201,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'id': employee_id}),
-            'isBase64Encoded': False
-        }
+    directory.invalidate()
     
-    elif method == 'PUT':
-        body_data = json.loads(event.get('body', '{}'))
-        employee_id = body_data.get('id')
-        status = body_data.get('status')
-        
-        if not employee_id or not status:
-            cur.close()
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Employee id and status required'}),
-                'isBase64Encoded': False
-            }
-        
+    return runtime.with_read_token(runtime.respond(201, {'id': employee_id}), token)
+
+@router.route('PUT')
+def update_employee(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    session = sessions.from_event(event)
+    if not session:
+        return runtime.UNAUTHORIZED
+    
+    body_data = runtime.body(event)
+    employee_id = body_data.get('id')
+    status = body_data.get('status')
+    
+    if session.role != 'admin' and str(session.employee_id) != str(employee_id):
+        return runtime.FORBIDDEN
+    
+    if not employee_id or not status:
+        return runtime.error(400, 'Employee id and status required')
+    
+    with db.connection() as conn:
+        cur = conn.cursor()
         cur.execute(
             "UPDATE employees SET status = %s WHERE id = %s",
             (status, employee_id)
         )
-        
+        assigned = drain_waiting_queue(cur, employee_id=int(employee_id)) if status == 'online' else 0
         conn.commit()
+        token = db.write_token(cur)
         cur.close()
-        conn.close()
-        
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'success': True}),
-            'isBase64Encoded': False
-        }
-    
-    cur.close()
-    conn.close()
+    directory.invalidate()
     
-    return {
-        'statusCode': 405,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'error': 'Method not allowed'}),
-        'isBase64Encoded': False
-    }
+    return runtime.with_read_token(runtime.respond(200, {'success': True, 'assigned_chats': assigned}), token)
+
+@instrument.traced
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Управление сотрудниками - список, создание, обновление статуса
+    Args: event - dict с httpMethod, body, queryStringParameters
+                  (GET view=load - открытые чаты по операторам и длина очереди из счётчиков;
+                   GET view=stats&from&to[&employee_id] - дневная аналитика из operator_daily_stats;
+                   PUT status=online сразу разбирает очередь ожидающих чатов)
+          context - объект с request_id
+    Returns: HTTP response с данными сотрудников
+    '''
+    return router.dispatch(event, context)
@@ -0,0 +1,117 @@
+'''
+Трассировка вызова функции: фазы (пул, SQL, выборка строк, код функции), запросы, строки, размер ответа
+и холодный старт. Включается REQUEST_TRACE=header|log|both; при off обёртка не ставится вовсе.
+Файл лежит копией в каждой папке backend/* и должен оставаться одинаковым.
+'''
+import contextvars
+import functools
+import json
+import os
+import re
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+MODE = os.environ.get('REQUEST_TRACE', 'off')
+ENABLED = MODE in ('header', 'log', 'both')
+MAX_LOGGED_QUERIES = int(os.environ.get('REQUEST_TRACE_MAX_QUERIES', '50'))
+
+_imported_at = time.perf_counter()
+_cold = True
+_current: contextvars.ContextVar[Optional['Trace']] = contextvars.ContextVar('trace', default=None)
+
+
+class Trace:
+    '''
+    Business: Счётчики одного вызова; db.py пишет сюда через current()
+    '''
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {'db-connect': 0.0, 'sql': 0.0, 'fetch': 0.0}
+        self.queries: List[Dict[str, Any]] = []
+        self.query_count = 0
+        self.rows = 0
+        self.handshakes = 0
+
+    def add(self, phase: str, seconds: float) -> None:
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def query(self, sql: Any, seconds: float, rowcount: int) -> None:
+        self.phases['sql'] += seconds
+        self.query_count += 1
+        if rowcount > 0:
+            self.rows += rowcount
+        if len(self.queries) < MAX_LOGGED_QUERIES:
+            text = sql.decode('utf-8', 'replace') if isinstance(sql, bytes) else str(sql)
+            self.queries.append({'sql': re.sub(r'\s+', ' ', text).strip()[:120], 'ms': round(seconds * 1000, 3),
+                                 'rows': rowcount})
+
+
+def current() -> Optional[Trace]:
+    return _current.get()
+
+
+def server_timing(phases: Dict[str, float], query_count: int) -> str:
+    parts = []
+    for name, seconds in phases.items():
+        part = f'{name};dur={seconds * 1000:.2f}'
+        if name == 'sql':
+            part += f';desc="{query_count} queries"'
+        parts.append(part)
+    return ', '.join(parts)
+
+
+def traced(handler: Callable[[Dict[str, Any], Any], Any]) -> Callable[[Dict[str, Any], Any], Any]:
+    '''
+    Business: Оборачивает точку входа функции; при выключенном REQUEST_TRACE возвращает её без изменений
+    Returns: handler, который добавляет Server-Timing в ответ и/или печатает JSON-строку лога на вызов
+    '''
+    if not ENABLED:
+        return handler
+    function = os.path.basename(os.path.dirname(os.path.abspath(handler.__code__.co_filename)))
+
+    @functools.wraps(handler)
+    def wrapper(event: Dict[str, Any], context: Any) -> Any:
+        global _cold
+        cold, _cold = _cold, False
+        trace = Trace()
+        token = _current.set(trace)
+        try:
+            response = handler(event, context)
+        finally:
+            _current.reset(token)
+        total = time.perf_counter() - trace.started
+        phases = dict(trace.phases)
+        phases['app'] = max(0.0, total - sum(phases.values()))
+        phases['total'] = total
+        body = response.get('body') if isinstance(response, dict) else None
+        headers = response.get('headers') if isinstance(response, dict) else None
+
+        if MODE in ('header', 'both') and isinstance(headers, dict):
+            # заголовки и статические ответы из runtime общие для всех вызовов - дополняем копию
+            exposed = headers.get('Access-Control-Expose-Headers')
+            response = dict(response, headers=dict(headers, **{
+                'Server-Timing': server_timing(phases, trace.query_count),
+                'Timing-Allow-Origin': '*',
+                'Access-Control-Expose-Headers': f'{exposed}, Server-Timing' if exposed else 'Server-Timing'
+            }))
+
+        if MODE in ('log', 'both'):
+            print(json.dumps({
+                'trace': function,
+                'entry': handler.__name__,
+                'request_id': getattr(context, 'request_id', None),
+                'method': event.get('httpMethod') if isinstance(event, dict) else None,
+                'status': response.get('statusCode') if isinstance(response, dict) else None,
+                'cold': cold,
+                'init_ms': round((trace.started - _imported_at) * 1000, 3) if cold else None,
+                'phases_ms': {name: round(seconds * 1000, 3) for name, seconds in phases.items()},
+                'query_count': trace.query_count,
+                'rows': trace.rows,
+                'handshakes': trace.handshakes,
+                'response_bytes': len(body.encode('utf-8')) if isinstance(body, str) else None,
+                'queries': trace.queries
+            }, ensure_ascii=False), flush=True)
+        return response
+
+    return wrapper
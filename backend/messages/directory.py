@@ -0,0 +1,122 @@
+'''
+Справочник сотрудников в памяти процесса (id -> login, name, role, status, created_at), чтобы страницы и long-poll
+списков чатов и сообщений и поиск не делали LEFT JOIN employees ради имени. Кэш версионирован счётчиком list_versions
+'employees', который триггер увеличивает при добавлении сотрудника и смене login, name, role или status;
+версия перечитывается не чаще раза в EMPLOYEE_DIRECTORY_REFRESH секунд. EMPLOYEE_DIRECTORY=off возвращает JOIN.
+Файл лежит копией в backend/chats, messages и employees и должен оставаться одинаковым.
+'''
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+import db
+
+ENABLED = os.environ.get('EMPLOYEE_DIRECTORY', 'on') != 'off'
+REFRESH_SECONDS = float(os.environ.get('EMPLOYEE_DIRECTORY_REFRESH', '2'))
+MAX_SIZE = int(os.environ.get('EMPLOYEE_DIRECTORY_SIZE', '5000'))
+
+COLUMNS = ('id', 'login', 'name', 'role', 'status', 'created_at')
+
+_lock = threading.Lock()
+_entries: 'OrderedDict[int, Dict[str, Any]]' = OrderedDict()
+_complete = False
+_version: Optional[int] = None
+_checked_at = float('-inf')
+
+
+def _reset(version: Optional[int]) -> None:
+    global _complete, _version
+    _entries.clear()
+    _complete = False
+    _version = version
+
+
+def _entry(row: tuple) -> Dict[str, Any]:
+    entry = dict(zip(COLUMNS, row))
+    entry['created_at'] = entry['created_at'].isoformat() if entry['created_at'] else None
+    return entry
+
+
+def _store(rows: Iterable[tuple]) -> None:
+    for row in rows:
+        _entries[row[0]] = _entry(row)
+    while len(_entries) > MAX_SIZE:
+        _entries.popitem(last=False)
+
+
+def sync(version: int) -> None:
+    '''
+    Business: Сверяет кэш с уже прочитанной версией list_versions 'employees' (например, из ETag-запроса)
+    '''
+    global _checked_at
+    with _lock:
+        if version != _version:
+            _reset(version)
+        _checked_at = time.monotonic()
+
+
+def refresh(cur: Any) -> None:
+    '''
+    Business: Перечитывает версию справочника, если с прошлой проверки прошло REFRESH_SECONDS
+    '''
+    if time.monotonic() - _checked_at < REFRESH_SECONDS:
+        return
+    sync(db.list_version(cur, 'employees'))
+
+
+def invalidate() -> None:
+    '''
+    Business: Сбрасывает кэш после записи сотрудника в этом процессе, не дожидаясь проверки версии
+    '''
+    global _checked_at
+    with _lock:
+        _reset(None)
+        _checked_at = float('-inf')
+
+
+def lookup(cur: Any, ids: Iterable[Optional[int]]) -> Dict[int, Dict[str, Any]]:
+    '''
+    Business: Сотрудники по id из кэша; недостающие дочитываются одним запросом по первичному ключу
+    Returns: dict id -> запись справочника (неизвестные id отсутствуют)
+    '''
+    refresh(cur)
+    wanted = {employee_id for employee_id in ids if employee_id is not None}
+    with _lock:
+        found = {employee_id: _entries[employee_id] for employee_id in wanted if employee_id in _entries}
+        version = _version
+    missing = wanted - found.keys()
+    if missing:
+        cur.execute(f"SELECT {', '.join(COLUMNS)} FROM employees WHERE id = ANY(%s)", (sorted(missing),))
+        rows = cur.fetchall()
+        with _lock:
+            if version == _version and not _complete:
+                _store(rows)
+        found.update((row[0], _entry(row)) for row in rows)
+    return found
+
+
+def names(cur: Any, ids: Iterable[Optional[int]]) -> Dict[int, str]:
+    return {employee_id: entry['name'] for employee_id, entry in lookup(cur, ids).items()}
+
+
+def all_employees(cur: Any, version: int) -> List[Dict[str, Any]]:
+    '''
+    Business: Полный справочник для employees GET; при неизменной версии - без запроса к таблице
+    Args: version - версия list_versions 'employees', прочитанная для ETag
+    Returns: записи в порядке created_at DESC, id DESC
+    '''
+    global _complete
+    sync(version)
+    with _lock:
+        if _complete:
+            return list(_entries.values())
+    cur.execute(f"SELECT {', '.join(COLUMNS)} FROM employees ORDER BY created_at DESC, id DESC")
+    rows = cur.fetchall()
+    with _lock:
+        if version == _version and len(rows) <= MAX_SIZE:
+            _entries.clear()
+            _store(rows)
+            _complete = True
+    return [_entry(row) for row in rows]
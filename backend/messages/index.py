@@ -1,94 +1,386 @@
-import json
-import os
-import psycopg2
-from typing import Dict, Any
+import db
+import directory
+import idempotency
+import instrument
+import outbox
+import runtime
+import sessions
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+MAX_WAIT_SECONDS = 25
+MAX_BATCH_SIZE = 5000
+BATCH_PAGE_SIZE = 1000
+SENDER_TYPES = ('user', 'operator')
+RESOLUTION_STATUSES = ('solved', 'unsolved')
+SEARCH_SORTS = ('rank', 'recent')
+# Сообщения открытого чата лежат только в messages_hot: условие на ключ секции из подзапроса отсекает messages_cold
+# при выполнении (pruning по initplan) без отдельного обращения к базе. У заархивированного чата читаются обе
+# секции - новое сообщение в него вставляется в hot
+CHAT_PARTITION = 'm.archived IN (FALSE, (SELECT c.archived_at IS NOT NULL FROM chats c WHERE c.id = %s))'
+
+extras = runtime.lazy('psycopg2.extras')
+
+if directory.ENABLED:
+    SENDER_NAME, SENDER_JOIN = 'NULL::text', ''
+else:
+    SENDER_NAME, SENDER_JOIN = 'e.name', 'LEFT JOIN employees e ON m.sender_id = e.id'
+
+def fetch_messages(cur: Any, chat_id: str, after_id: Optional[int], before_id: Optional[int],
+                   limit: int) -> List[Tuple]:
     '''
-    Business: Управление сообщениями в чатах - получение и отправка
-    Args: event - dict с httpMethod, body, queryStringParameters
-          context - объект с request_id
-    Returns: HTTP response с сообщениями
+    Business: Выбирает страницу сообщений чата по курсору id
+    Returns: строки (id, sender_type, message, created_at, sender_name, sender_id), максимум limit + 1;
+             sender_name = NULL, если имена берутся из directory
     '''
-    method: str = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    database_url = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(database_url)
-    cur = conn.cursor()
-    
-    if method == 'GET':
-        params = event.get('queryStringParameters') or {}
-        chat_id = params.get('chat_id')
+    if after_id is not None:
+        cur.execute(f"""
+            SELECT m.id, m.sender_type, m.message, m.created_at, {SENDER_NAME} as sender_name, m.sender_id
+            FROM messages m
+            {SENDER_JOIN}
+            WHERE m.chat_id = %s AND {CHAT_PARTITION} AND m.id > %s
+            ORDER BY m.id ASC
+            LIMIT %s
+        """, (chat_id, chat_id, after_id, limit + 1))
+    else:
+        cur.execute(f"""
+            SELECT m.id, m.sender_type, m.message, m.created_at, {SENDER_NAME} as sender_name, m.sender_id
+            FROM messages m
+            {SENDER_JOIN}
+            WHERE m.chat_id = %s AND {CHAT_PARTITION} AND (%s::int IS NULL OR m.id < %s)
+            ORDER BY m.id DESC
+            LIMIT %s
+        """, (chat_id, chat_id, before_id, before_id, limit + 1))
+    return cur.fetchall()
+
+def sender_names(cur: Any, messages: List[Tuple]) -> Dict[int, str]:
+    return directory.names(cur, [msg[5] for msg in messages]) if directory.ENABLED else {}
+
+def serialize_messages(messages: List[Tuple], names: Dict[int, str]) -> List[Dict[str, Any]]:
+    '''
+    Business: Строки fetch_messages в dict ответа; при включённом справочнике имя отправителя - из names
+    '''
+    return [{
+        'id': msg[0],
+        'sender_type': msg[1],
+        'message': msg[2],
+        'created_at': msg[3].isoformat() if msg[3] else None,
+        'sender_name': names.get(msg[5]) if directory.ENABLED else msg[4]
+    } for msg in messages]
+
+def parse_search(params: Dict[str, Any], session: sessions.Session) -> Dict[str, Any]:
+    '''
+    Business: Разбирает параметры поиска по сообщениям из query string
+    Args: params - queryStringParameters (q, sort, assigned_to, resolution_status, created_from, created_to, limit, cursor)
+          session - сессия сотрудника; оператор ищет только в своих чатах
+    Returns: dict для search_messages; ValueError при некорректных значениях
+    '''
+    search = {
+        'q': params['q'].strip(),
+        'sort': params.get('sort') or 'rank',
+        'assigned_to': int(params['assigned_to']) if params.get('assigned_to') else None,
+        'resolution_status': params.get('resolution_status') or None,
+        'created_from': datetime.fromisoformat(params['created_from']) if params.get('created_from') else None,
+        'created_to': datetime.fromisoformat(params['created_to']) if params.get('created_to') else None,
+        'limit': min(int(params.get('limit') or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE),
+        'cursor': None
+    }
+    if session.role == 'operator':
+        search['assigned_to'] = session.employee_id
+    if not search['q'] or search['limit'] < 1 or search['sort'] not in SEARCH_SORTS:
+        raise ValueError('q')
+    if search['resolution_status'] and search['resolution_status'] not in RESOLUTION_STATUSES:
+        raise ValueError('resolution_status')
+    if params.get('cursor'):
+        rank, _, message_id = params['cursor'].rpartition('_')
+        search['cursor'] = (float(rank) if search['sort'] == 'rank' else None, int(message_id))
+    return search
+
+def search_messages(cur: Any, search: Dict[str, Any]) -> Tuple[List[Tuple], Optional[str]]:
+    '''
+    Business: Полнотекстовый поиск по messages.search_vector (GIN) с фильтрами по чату и keyset-пагинацией
+    Args: search - результат parse_search; sort=rank - по ts_rank, sort=recent - по id без ранжирования
+    Returns: строки (id, chat_id, created_at, rank, user_name, user_email, status, is_closed,
+             resolution_status, operator_name, snippet, assigned_to) и курсор следующей страницы или None
+    '''
+    conditions = ['m.search_vector @@ q']
+    args: List[Any] = [search['q']]
+    for column in ('assigned_to', 'resolution_status'):
+        if search[column] is not None:
+            conditions.append(f'c.{column} = %s')
+            args.append(search[column])
+    if search['created_from']:
+        conditions.append('m.created_at >= %s')
+        args.append(search['created_from'])
+    if search['created_to']:
+        conditions.append('m.created_at < %s')
+        args.append(search['created_to'])
+    
+    chat_join = 'JOIN chats c ON c.id = m.chat_id' if any(c.startswith('c.') for c in conditions) else ''
+    rank = 'ts_rank(m.search_vector, q)' if search['sort'] == 'rank' else '0::real'
+    page_condition = ''
+    if search['cursor']:
+        if search['sort'] == 'rank':
+            page_condition = 'WHERE (hits.rank, hits.id) < (%s::real, %s)'
+            args.extend(search['cursor'])
+        else:
+            conditions.append('m.id < %s')
+            args.append(search['cursor'][1])
+    args.append(search['limit'] + 1)
+    operator_name, operator_join = 'e.name', 'LEFT JOIN employees e ON c.assigned_to = e.id'
+    if directory.ENABLED:
+        operator_name, operator_join = 'NULL::text', ''
+    
+    cur.execute(f"""
+        SELECT hits.id, hits.chat_id, hits.created_at, hits.rank, c.user_name, c.user_email, c.status,
+               c.is_closed, c.resolution_status, {operator_name},
+               ts_headline('simple', hits.message, hits.q, 'MaxFragments=2, MaxWords=20, MinWords=5'),
+               c.assigned_to
+        FROM (
+            SELECT m.id, m.chat_id, m.message, m.created_at, q, {rank} AS rank
+            FROM messages m
+            {chat_join}
+            CROSS JOIN websearch_to_tsquery('simple', %s) q
+            WHERE {' AND '.join(conditions)}
+        ) hits
+        JOIN chats c ON c.id = hits.chat_id
+        {operator_join}
+        {page_condition}
+        ORDER BY hits.rank DESC, hits.id DESC
+        LIMIT %s
+    """, args)
+    rows = cur.fetchall()
+    if len(rows) <= search['limit']:
+        return rows, None
+    rows = rows[:search['limit']]
+    return rows, f'{rows[-1][3]!r}_{rows[-1][0]}' if search['sort'] == 'rank' else f'_{rows[-1][0]}'
+
+def messages_etag(cur: Any, chat_id: str) -> str:
+    '''
+    Business: ETag сообщений чата - сообщения только добавляются, поэтому хватает count и max(id)
+    Returns: тег для полного списка и последней страницы; дельты по after_id и long-poll его не считают -
+             они и так возвращают только новое, а count по чату на каждом опросе стоит дороже самой выборки
+    '''
+    cur.execute(f"SELECT count(*), COALESCE(max(m.id), 0) FROM messages m WHERE m.chat_id = %s AND {CHAT_PARTITION}",
+                (chat_id, chat_id))
+    return '"messages-%s-%d-%d"' % ((chat_id,) + cur.fetchone())
+
+def record_first_responses(cur: Any, message_ids: List[int]) -> None:
+    '''
+    Business: Отмечает первый ответ оператора в чате и добавляет его в дневную аналитику оператора
+    Args: message_ids - только что вставленные сообщения операторов; чаты с уже отмеченным ответом пропускаются
+    '''
+    cur.execute("""
+        WITH firsts AS (
+            SELECT DISTINCT ON (chat_id) chat_id, sender_id, created_at
+            FROM messages
+            WHERE id = ANY(%s) AND archived = FALSE AND sender_type = 'operator' AND sender_id IS NOT NULL
+            ORDER BY chat_id, id
+        ), marked AS (
+            UPDATE chats c SET first_response_at = f.created_at
+            FROM firsts f
+            WHERE c.id = f.chat_id AND c.first_response_at IS NULL
+            RETURNING f.sender_id, EXTRACT(EPOCH FROM f.created_at - c.created_at) AS seconds
+        )
+        INSERT INTO operator_daily_stats (day, employee_id, first_responses, first_response_seconds)
+        SELECT CURRENT_DATE, sender_id, count(*), sum(seconds) FROM marked GROUP BY sender_id
+        ON CONFLICT (day, employee_id) DO UPDATE
+        SET first_responses = operator_daily_stats.first_responses + EXCLUDED.first_responses,
+            first_response_seconds = operator_daily_stats.first_response_seconds + EXCLUDED.first_response_seconds
+    """, (message_ids,))
+
+router = runtime.Router('Content-Type, Authorization, If-None-Match, X-Read-After, Idempotency-Key')
+
+@router.route('GET')
+def list_messages(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    session = sessions.from_event(event)
+    if not session:
+        return runtime.UNAUTHORIZED
+    
+    params = event.get('queryStringParameters') or {}
+    chat_id = params.get('chat_id')
+    
+    if params.get('q'):
+        try:
+            search = parse_search(params, session)
+        except ValueError:
+            return runtime.error(400, 'Invalid search parameters')
         
-        if not chat_id:
+        with db.read_connection(event) as conn:
+            cur = conn.cursor()
+            rows, next_cursor = search_messages(cur, search)
+            operator_names = directory.names(cur, [row[11] for row in rows]) if directory.ENABLED else {}
             cur.close()
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'chat_id required'}),
-                'isBase64Encoded': False
-            }
-        
-        cur.execute("""
-            SELECT m.id, m.sender_type, m.message, m.created_at, e.name as sender_name
-            FROM messages m
-            LEFT JOIN employees e ON m.sender_id = e.id
-            WHERE m.chat_id = %s
-            ORDER BY m.created_at ASC
-        """, (chat_id,))
         
-        messages = cur.fetchall()
-        result = []
-        for msg in messages:
-            result.append({
-                'id': msg[0],
-                'sender_type': msg[1],
-                'message': msg[2],
-                'created_at': msg[3].isoformat() if msg[3] else None,
-                'sender_name': msg[4]
+        results = []
+        for row in rows:
+            results.append({
+                'message_id': row[0],
+                'chat_id': row[1],
+                'created_at': row[2].isoformat() if row[2] else None,
+                'rank': row[3],
+                'user_name': row[4],
+                'user_email': row[5],
+                'status': row[6],
+                'is_closed': row[7],
+                'resolution_status': row[8],
+                'operator_name': operator_names.get(row[11]) if directory.ENABLED else row[9],
+                'snippet': row[10]
             })
         
-        cur.close()
-        conn.close()
+        return runtime.respond(200, {'results': results, 'next_cursor': next_cursor})
+    
+    if not chat_id:
+        return runtime.error(400, 'chat_id required')
+    
+    after_id = before_id = None
+    wait = 0
+    try:
+        after_id = int(params['after_id']) if params.get('after_id') else None
+        before_id = int(params['before_id']) if params.get('before_id') else None
+        limit = min(int(params.get('limit') or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE)
+        wait = min(int(params.get('wait') or 0), MAX_WAIT_SECONDS)
+    except ValueError:
+        limit = 0
+    
+    if limit < 1 or (after_id is not None and before_id is not None):
+        return runtime.error(400, 'Invalid pagination parameters')
+    
+    paged = after_id is not None or before_id is not None or 'limit' in params
+    
+    if not paged:
+        with db.read_connection(event) as conn:
+            cur = conn.cursor()
+            etag = messages_etag(cur, chat_id)
+            if db.if_none_match(event, etag):
+                body = None
+            else:
+                body = db.fetch_json(cur, f"""
+                    SELECT m.id, m.sender_type, m.message, m.created_at, e.name as sender_name
+                    FROM messages m
+                    LEFT JOIN employees e ON m.sender_id = e.id
+                    WHERE m.chat_id = %s AND {CHAT_PARTITION}
+                    ORDER BY m.id ASC
+                """, (chat_id, chat_id))
+            cur.close()
         
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps(result),
-            'isBase64Encoded': False
-        }
-    
-    elif method == 'POST':
-        body_data = json.loads(event.get('body', '{}'))
-        chat_id = body_data.get('chat_id')
-        sender_type = body_data.get('sender_type', 'user')
-        sender_id = body_data.get('sender_id')
-        message = body_data.get('message', '')
+        if body is None:
+            return runtime.not_modified(etag)
         
-        if not chat_id or not message:
+        return runtime.respond_raw(200, body, etag)
+    
+    etag = None
+    if wait > 0 and after_id is not None:
+        with db.listening('chat_messages') as conn:
+            cur = conn.cursor()
+            messages = fetch_messages(cur, chat_id, after_id, before_id, limit)
+            if not messages and db.wait_notify(conn, wait, lambda notify: notify.payload == str(chat_id)):
+                messages = fetch_messages(cur, chat_id, after_id, before_id, limit)
+            names = sender_names(cur, messages)
+            cur.close()
+    else:
+        with db.read_connection(event) as conn:
+            cur = conn.cursor()
+            if after_id is None and before_id is None and not wait:
+                etag = messages_etag(cur, chat_id)
+            messages = (None if etag and db.if_none_match(event, etag)
+                        else fetch_messages(cur, chat_id, after_id, before_id, limit))
+            names = None if messages is None else sender_names(cur, messages)
             cur.close()
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'chat_id and message required'}),
-                'isBase64Encoded': False
-            }
         
+        if messages is None:
+            return runtime.not_modified(etag)
+    
+    has_more = len(messages) > limit
+    if has_more:
+        messages = messages[:limit]
+    if after_id is None:
+        messages.reverse()
+    
+    result = serialize_messages(messages, names)
+    
+    if after_id is not None:
+        next_cursor = result[-1]['id'] if result else after_id
+    else:
+        next_cursor = result[0]['id'] if has_more else None
+    
+    body = runtime.dumps({'messages': result, 'next_cursor': next_cursor, 'has_more': has_more})
+    return runtime.respond_raw(200, body, etag)
+
+@router.route('POST')
+def send_messages(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    body_data = runtime.body(event)
+    session = sessions.from_event(event)
+    idempotency_key = idempotency.key(event)
+    
+    if 'messages' in body_data:
+        if not session:
+            return runtime.UNAUTHORIZED
+        
+        items = body_data['messages']
+        if not isinstance(items, list) or not items or len(items) > MAX_BATCH_SIZE:
+            return runtime.error(400, f'messages must be a non-empty array of at most {MAX_BATCH_SIZE} items')
+        
+        rows = []
+        for index, item in enumerate(items):
+            if (not isinstance(item, dict) or not item.get('chat_id') or not item.get('message')
+                    or item.get('sender_type', 'user') not in SENDER_TYPES):
+                return runtime.error(400, f'messages[{index}]: chat_id, message and valid sender_type required')
+            sender_type = item.get('sender_type', 'user')
+            sender_id = item.get('sender_id') if session.role == 'admin' else None
+            if sender_type == 'operator' and session.role != 'admin':
+                sender_id = session.employee_id
+            rows.append((item['chat_id'], sender_type, sender_id, item['message']))
+        
+        with db.connection() as conn:
+            cur = conn.cursor()
+            if idempotency_key:
+                stored = idempotency.claim(cur, 'messages', idempotency_key, event)
+                if stored is not None:
+                    cur.close()
+                    return stored
+            inserted = extras.execute_values(
+                cur,
+                "INSERT INTO messages (chat_id, sender_type, sender_id, message) VALUES %s RETURNING id",
+                rows,
+                page_size=BATCH_PAGE_SIZE,
+                fetch=True
+            )
+            outbox.enqueue_messages(cur, [row[0] for row in inserted])
+            replies = [row[0] for row, item in zip(inserted, rows) if item[1] == 'operator' and item[2]]
+            if replies:
+                record_first_responses(cur, replies)
+            response = runtime.respond(201, {'message_ids': [row[0] for row in inserted]})
+            if idempotency_key:
+                idempotency.store(cur, 'messages', idempotency_key, response)
+            conn.commit()
+            token = db.write_token(cur)
+            cur.close()
+        
+        return runtime.with_read_token(response, token)
+    
+    chat_id = body_data.get('chat_id')
+    sender_type = body_data.get('sender_type', 'user')
+    sender_id = None
+    message = body_data.get('message', '')
+    
+    if sender_type == 'operator':
+        if not session:
+            return runtime.UNAUTHORIZED
+        sender_id = session.employee_id
+    
+    if not chat_id or not message:
+        return runtime.error(400, 'chat_id and message required')
+    
+    with db.connection() as conn:
+        cur = conn.cursor()
+        if idempotency_key:
+            stored = idempotency.claim(cur, 'messages', idempotency_key, event)
+            if stored is not None:
+                cur.close()
+                return stored
         if sender_id:
             cur.execute(
                 "INSERT INTO messages (chat_id, sender_type, sender_id, message) VALUES (%s, %s, %s, %s) RETURNING id",
@@ -101,23 +393,29 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             )
         
         message_id = cur.fetchone()[0]
+        outbox.enqueue_messages(cur, [message_id])
+        if sender_id:
+            record_first_responses(cur, [message_id])
+        response = runtime.respond(201, {'message_id': message_id})
+        if idempotency_key:
+            idempotency.store(cur, 'messages', idempotency_key, response)
         conn.commit()
+        token = db.write_token(cur)
         cur.close()
-        conn.close()
-        
-        return {
-            'statusCode': 201,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'message_id': message_id}),
-            'isBase64Encoded': False
-        }
-    
-    cur.close()
-    conn.close()
-    
-    return {
-        'statusCode': 405,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'error': 'Method not allowed'}),
-        'isBase64Encoded': False
-    }
+    
+    return runtime.with_read_token(response, token)
+
+@instrument.traced
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Управление сообщениями в чатах - получение и отправка
+    Args: event - dict с httpMethod, body, queryStringParameters
+                  (chat_id, after_id | before_id, limit - постраничная выдача по id,
+                   q - полнотекстовый поиск по всем доступным чатам, см. parse_search,
+                   wait - секунды long-poll ожидания новых сообщений после after_id;
+                   POST с массивом messages - пакетная вставка в одной транзакции;
+                   чтение, пакеты и ответы операторов требуют сессионного токена)
+          context - объект с request_id
+    Returns: HTTP response с сообщениями
+    '''
+    return router.dispatch(event, context)
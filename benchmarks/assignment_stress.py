@@ -0,0 +1,78 @@
+'''
+Стресс-тест назначения операторов: параллельные chats POST, распределение и пропускная способность.
+Запуск: DATABASE_URL=postgresql://localhost/chat_bench python benchmarks/assignment_stress.py
+'''
+import argparse
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+from common import load_handler, reset_schema
+
+
+def seed_operators(count: int) -> None:
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO employees (login, password, name, role, status)
+        SELECT 'operator' || g, 'x', 'Operator ' || g, 'operator', 'online' FROM generate_series(1, %s) AS g
+    """, (count,))
+    cur.close()
+    conn.close()
+
+
+def assignment_counts() -> Counter:
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cur = conn.cursor()
+    cur.execute('SELECT assigned_to, count(*) FROM chats GROUP BY assigned_to')
+    counts = Counter(dict(cur.fetchall()))
+    cur.close()
+    conn.close()
+    return counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--operators', type=int, default=20)
+    parser.add_argument('--chats', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--strategies', default='least_open,round_robin')
+    args = parser.parse_args()
+
+    handler = load_handler('chats')
+
+    def create_chat(index: int) -> int:
+        response = handler({
+            'httpMethod': 'POST',
+            'body': json.dumps({'user_name': f'User {index}', 'user_email': f'user{index}@example.com',
+                                'message': 'Hello'})
+        }, None)
+        assert response['statusCode'] == 201, response
+        return index
+
+    for strategy in args.strategies.split(','):
+        os.environ['ASSIGNMENT_STRATEGY'] = strategy
+        reset_schema()
+        seed_operators(args.operators)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.threads) as executor:
+            list(executor.map(create_chat, range(args.chats)))
+        elapsed = time.perf_counter() - started
+
+        counts = assignment_counts()
+        waiting = counts.pop(None, 0)
+        per_operator = sorted(counts.values())
+        print(f'{strategy}: {args.chats / elapsed:.1f} chats/s with {args.threads} threads')
+        print(f'   operators used {len(per_operator)}/{args.operators}, waiting {waiting}, '
+              f'min {per_operator[0] if per_operator else 0}, max {per_operator[-1] if per_operator else 0}')
+        print(f'   distribution: {per_operator}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+'''
+Пропускная способность входа при разной стоимости PBKDF2, с кэшем проверок и без. В конце - вход при
+перегруженном пуле KDF (503 с Retry-After, а не зависший вызов), время ответа на неизвестный логин против неверного
+пароля и разовый перехеш открытых паролей employees.password_rehash_handler.
+Запуск: DATABASE_URL=postgresql://localhost/chat_bench python benchmarks/auth_bench.py
+'''
+import argparse
+import json
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+from common import load_handler, reset_schema
+
+
+def check_busy(handler, passwords) -> None:
+    '''
+    Business: Проверка не укладывается в VERIFY_TIMEOUT - вход отвечает 503 с Retry-After
+    '''
+    timeout = passwords.VERIFY_TIMEOUT
+    passwords.cache = passwords.VerificationCache(ttl=0)
+    passwords.VERIFY_TIMEOUT = 0.0001
+    try:
+        response = handler({'httpMethod': 'POST', 'body': json.dumps({'login': 'operator0', 'password': 'password'})},
+                           None)
+    finally:
+        passwords.VERIFY_TIMEOUT = timeout
+    assert response['statusCode'] == 503 and response['headers']['Retry-After'], response
+    print(f"busy KDF pool: 503, Retry-After {response['headers']['Retry-After']}")
+
+
+def check_unknown_login(handler, passwords, cost: int, samples: int = 20) -> None:
+    '''
+    Business: Неизвестный логин проверяется против DUMMY_HASH той же стоимости - медианы времени ответа близки
+    '''
+    passwords.cache = passwords.VerificationCache(ttl=0)
+    passwords.DUMMY_HASH = passwords.hash_password('dummy', cost)
+
+    def median_ms(login: str) -> float:
+        timings = []
+        for _ in range(samples):
+            started = time.perf_counter()
+            response = handler({'httpMethod': 'POST', 'body': json.dumps({'login': login, 'password': 'wrong'})}, None)
+            timings.append(time.perf_counter() - started)
+            assert response['statusCode'] == 401, response
+        return statistics.median(timings) * 1000
+
+    known, unknown = median_ms('operator0'), median_ms('no-such-login')
+    assert 0.5 < unknown / known < 2, (known, unknown)
+    print(f'wrong password {known:.1f} ms, unknown login {unknown:.1f} ms')
+
+
+def check_rehash(handler, passwords) -> None:
+    '''
+    Business: password_rehash_handler переводит открытые пароли в хеши без входа; вход после этого работает
+    '''
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute("INSERT INTO employees (login, password, name, role) VALUES ('legacy', 'plain', 'Legacy', 'operator')")
+    result = load_handler('employees', 'password_rehash_handler')({'limit': 10}, None)
+    cur.execute("SELECT count(*) FROM employees WHERE left(password, %s) <> %s",
+                (len(passwords.ALGORITHM) + 1, passwords.ALGORITHM + '$'))
+    assert cur.fetchone()[0] == 0 and result['rehashed'] >= 1, result
+    assert load_handler('employees', 'password_rehash_handler')({}, None) == {'rehashed': 0}
+    response = handler({'httpMethod': 'POST', 'body': json.dumps({'login': 'legacy', 'password': 'plain'})}, None)
+    assert response['statusCode'] == 200, response
+    cur.close()
+    conn.close()
+    print(f"plaintext rehash: {result['rehashed']} passwords hashed, login still works")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--costs', default='50000,200000,600000')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--logins', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    os.environ.setdefault('SESSION_SECRET', 'benchmark-secret')
+    handler = load_handler('auth')
+    import passwords
+
+    def login(index: int) -> None:
+        body = json.dumps({'login': f'operator{index % args.users}', 'password': 'password'})
+        response = handler({'httpMethod': 'POST', 'body': body}, None)
+        assert response['statusCode'] == 200, response
+
+    for cost in (int(value) for value in args.costs.split(',')):
+        reset_schema()
+        passwords.ITERATIONS = cost
+        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        cur = conn.cursor()
+        for index in range(args.users):
+            cur.execute(
+                "INSERT INTO employees (login, password, name, role) VALUES (%s, %s, %s, 'operator')",
+                (f'operator{index}', passwords.hash_password('password', cost), f'Operator {index}')
+            )
+        conn.commit()
+        cur.close()
+        conn.close()
+
+        for title, ttl in (('no cache', 0), ('cache', 300)):
+            passwords.cache = passwords.VerificationCache(ttl=ttl)
+            started = time.perf_counter()
+            with ThreadPoolExecutor(args.threads) as executor:
+                list(executor.map(login, range(args.logins)))
+            elapsed = time.perf_counter() - started
+            print(f'{cost:>8} iterations, {title:<8}: {args.logins / elapsed:>9.1f} logins/s')
+
+    check_busy(handler, passwords)
+    check_unknown_login(handler, passwords, cost)
+    check_rehash(handler, passwords)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+'''
+Пакетная вставка сообщений против N одиночных messages POST.
+Запуск: DATABASE_URL=postgresql://localhost/chat_bench python benchmarks/bulk_messages_bench.py
+'''
+import argparse
+import json
+import time
+
+from common import load_handler, reset_schema, staff_headers
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--chats', type=int, default=50)
+    args = parser.parse_args()
+
+    reset_schema()
+    chats = load_handler('chats')
+    messages = load_handler('messages')
+    chat_ids = [
+        json.loads(chats({
+            'httpMethod': 'POST',
+            'body': json.dumps({'user_name': f'User {i}', 'user_email': f'user{i}@example.com', 'message': 'Hi'})
+        }, None)['body'])['chat_id']
+        for i in range(args.chats)
+    ]
+    items = [
+        {'chat_id': chat_ids[i % len(chat_ids)], 'sender_type': 'user', 'message': f'Imported message {i}'}
+        for i in range(args.messages)
+    ]
+
+    started = time.perf_counter()
+    for item in items:
+        response = messages({'httpMethod': 'POST', 'body': json.dumps(item)}, None)
+        assert response['statusCode'] == 201, response
+    single = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for offset in range(0, len(items), 5000):
+        response = messages({'httpMethod': 'POST', 'headers': staff_headers(),
+                             'body': json.dumps({'messages': items[offset:offset + 5000]})}, None)
+        assert response['statusCode'] == 201, response
+    batch = time.perf_counter() - started
+
+    print(f'single POSTs: {args.messages / single:>10.1f} msg/s ({single:.2f} s)')
+    print(f'batch POST:   {args.messages / batch:>10.1f} msg/s ({batch:.2f} s), x{single / batch:.1f}')
+
+
+if __name__ == '__main__':
+    main()
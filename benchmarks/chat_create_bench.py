@@ -0,0 +1,109 @@
+'''
+Латентность chats POST: прежние пять запросов без индекса по user_email против одного CTE с частичным индексом.
+Запуск: DATABASE_URL=postgresql://localhost/chat_bench python benchmarks/chat_create_bench.py
+'''
+import argparse
+import json
+import os
+import time
+
+import psycopg2
+
+from common import load_handler, percentile, reset_schema
+
+OPERATORS = 20
+
+
+def seed(cur, chats: int) -> None:
+    cur.execute("""
+        INSERT INTO employees (login, password, name, role, status)
+        SELECT 'operator' || g, 'x', 'Operator ' || g, 'operator', 'online' FROM generate_series(1, %s) AS g
+    """, (OPERATORS,))
+    cur.execute("""
+        INSERT INTO chats (user_name, user_email, status, created_at, updated_at, is_closed, resolution_status)
+        SELECT 'user ' || g, 'user' || (g %% (%s / 4)) || '@example.com', 'closed',
+               TIMESTAMP '2022-01-01' + g * INTERVAL '1 minute', TIMESTAMP '2022-01-01' + g * INTERVAL '1 minute',
+               TRUE, CASE WHEN g %% 2 = 0 THEN 'solved' ELSE 'unsolved' END
+        FROM generate_series(1, %s) AS g
+    """, (chats, chats))
+    cur.execute('ANALYZE')
+
+
+def legacy_create(db, user_name: str, user_email: str, message: str) -> None:
+    with db.connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT id FROM chats WHERE user_email = %s AND is_closed = TRUE AND resolution_status = 'unsolved' ORDER BY updated_at DESC LIMIT 1",
+            (user_email,)
+        )
+        existing = cur.fetchone()
+        cur.execute("""
+            SELECT e.id FROM employees e WHERE e.status = 'online' AND e.role = 'operator'
+            ORDER BY e.last_assigned_at NULLS FIRST, e.id LIMIT 1 FOR UPDATE OF e SKIP LOCKED
+        """)
+        operator_id = cur.fetchone()[0]
+        cur.execute("UPDATE employees SET last_assigned_at = CURRENT_TIMESTAMP WHERE id = %s", (operator_id,))
+        if existing:
+            chat_id = existing[0]
+            cur.execute(
+                "UPDATE chats SET is_closed = FALSE, status = 'assigned', assigned_to = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s",
+                (operator_id, chat_id)
+            )
+        else:
+            cur.execute(
+                "INSERT INTO chats (user_name, user_email, status, assigned_to) VALUES (%s, %s, 'assigned', %s) RETURNING id",
+                (user_name, user_email, operator_id)
+            )
+            chat_id = cur.fetchone()[0]
+        cur.execute("INSERT INTO messages (chat_id, sender_type, message) VALUES (%s, 'user', %s)", (chat_id, message))
+        cur.execute(
+            "INSERT INTO chat_history (chat_id, action, details, employee_id) VALUES (%s, %s, 'bench', %s)",
+            (chat_id, 'reopened' if existing else 'created', operator_id)
+        )
+        conn.commit()
+        cur.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chats', type=int, default=500000)
+    parser.add_argument('--requests', type=int, default=1000)
+    args = parser.parse_args()
+
+    os.environ['ASSIGNMENT_STRATEGY'] = 'round_robin'
+    handler = load_handler('chats')
+    import db
+
+    def run(title: str, create) -> None:
+        reset_schema()
+        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn.autocommit = True
+        cur = conn.cursor()
+        seed(cur, args.chats)
+        if title.startswith('before'):
+            cur.execute('DROP INDEX idx_chats_reopen_lookup')
+        cur.close()
+        conn.close()
+        db.get_pool().closeall()
+
+        for case, email in (('new client', 'new{}@example.com'), ('reopen', 'user{}@example.com')):
+            latencies = []
+            for index in range(args.requests):
+                started = time.perf_counter()
+                create(f'User {index}', email.format(index * 2 + 1), 'Hello again')
+                latencies.append(time.perf_counter() - started)
+            print(f'{title:<28} {case:<11} p50 {percentile(latencies, 50) * 1000:>7.2f} ms  '
+                  f'p99 {percentile(latencies, 99) * 1000:>7.2f} ms')
+
+    def single_statement(user_name: str, user_email: str, message: str) -> None:
+        response = handler({'httpMethod': 'POST', 'body': json.dumps({
+            'user_name': user_name, 'user_email': user_email, 'message': message
+        })}, None)
+        assert response['statusCode'] == 201, response
+
+    run('before: 5 statements', lambda *values: legacy_create(db, *values))
+    run('after: CTE + partial index', single_statement)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+'''
+Латентность списка чатов администратора при росте таблицы до 1M строк.
+Запуск: DATABASE_URL=postgresql://localhost/chat_bench python benchmarks/chats_listing_bench.py
+'''
+import argparse
+import json
+import os
+import time
+
+import psycopg2
+
+from common import load_handler, percentile, reset_schema, staff_headers
+
+OPERATORS = 50
+ADMIN = staff_headers()
+
+
+def grow_chats(cur, start: int, stop: int) -> None:
+    cur.execute("""
+        INSERT INTO chats (user_name, user_email, status, assigned_to, created_at, updated_at, is_closed, resolution_status)
+        SELECT 'user ' || g,
+               'user' || (g %% 100000) || '@example.com',
+               CASE WHEN g %% 3 = 0 THEN 'closed' WHEN g %% 10 = 1 THEN 'waiting' ELSE 'assigned' END,
+               CASE WHEN g %% 10 = 1 THEN NULL ELSE (SELECT min(id) FROM employees WHERE role = 'operator') + g %% %s END,
+               TIMESTAMP '2020-01-01' + g * INTERVAL '1 minute',
+               TIMESTAMP '2020-01-01' + g * INTERVAL '1 minute',
+               g %% 3 = 0,
+               CASE WHEN g %% 3 <> 0 THEN NULL WHEN g %% 2 = 0 THEN 'solved' ELSE 'unsolved' END
+        FROM generate_series(%s, %s - 1) AS g
+    """, (OPERATORS, start, stop))
+    cur.execute('ANALYZE chats')
+
+
+def measure(handler, params, repeat: int) -> float:
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = handler({'httpMethod': 'GET', 'queryStringParameters': params, 'headers': ADMIN}, None)
+        latencies.append(time.perf_counter() - started)
+        assert response['statusCode'] == 200, response
+    return percentile(latencies, 50) * 1000
+
+
+def deep_cursor(handler, params, pages: int) -> str:
+    cursor = None
+    for _ in range(pages):
+        query = dict(params, cursor=cursor) if cursor else params
+        body = json.loads(handler({'httpMethod': 'GET', 'queryStringParameters': query, 'headers': ADMIN}, None)['body'])
+        cursor = body['next_cursor'] or cursor
+    return cursor
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--legacy-up-to', type=int, default=100000,
+                        help='самый большой размер, на котором мерить полный список без limit')
+    args = parser.parse_args()
+
+    reset_schema()
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO employees (login, password, name, role, status)
+        SELECT 'operator' || g, 'x', 'Operator ' || g, 'operator', 'online' FROM generate_series(1, %s) AS g
+    """, (OPERATORS,))
+
+    handler = load_handler('chats')
+    first_page = {'limit': '50'}
+    open_page = {'limit': '50', 'open_only': 'true'}
+    unsolved_page = {'limit': '50', 'resolution_status': 'unsolved'}
+
+    print(f"{'rows':>9} {'first page':>11} {'open only':>10} {'unsolved':>9} {'page 20':>9} {'operator':>9} {'full list':>10}  (p50, ms)")
+    size = 0
+    for target in (int(value) for value in args.sizes.split(',')):
+        grow_chats(cur, size, target)
+        size = target
+        cursor = deep_cursor(handler, first_page, 20)
+        operator_page = {'limit': '50', 'assigned_to': '2'}
+        results = [
+            measure(handler, first_page, args.repeat),
+            measure(handler, open_page, args.repeat),
+            measure(handler, unsolved_page, args.repeat),
+            measure(handler, dict(first_page, cursor=cursor), args.repeat),
+            measure(handler, operator_page, args.repeat)
+        ]
+        legacy = measure(handler, {}, 1) if size <= args.legacy_up_to else float('nan')
+        print(f'{size:>9} ' + ' '.join(f'{value:>10.2f}' for value in results) + f' {legacy:>10.2f}')
+
+    cur.close()
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
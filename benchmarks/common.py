@@ -0,0 +1,87 @@
+'''
+Общие утилиты для бенчмарков: загрузка handler'ов функций и подготовка локальной БД.
+Бенчмарки запускаются против одноразовой локальной Postgres из DATABASE_URL.
+'''
+import importlib.util
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+BACKEND = ROOT / 'backend'
+MIGRATIONS = ROOT / 'db_migrations'
+
+
+def load_handler(function: str, entry: str = 'handler') -> Callable[[Dict[str, Any], Any], Dict[str, Any]]:
+    '''
+    Business: Импортирует backend/<function>/index.py так же, как это делает рантайм функции
+    Args: function - имя папки функции, например 'chats'
+          entry - имя точки входа (handler или точка входа периодического задания)
+    Returns: функция entry(event, context)
+    '''
+    folder = BACKEND / function
+    if str(folder) not in sys.path:
+        sys.path.insert(0, str(folder))
+    spec = importlib.util.spec_from_file_location(f'{function.replace("-", "_")}_index', folder / 'index.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return getattr(module, entry)
+
+
+def staff_headers(employee_id: int = 1, role: str = 'admin') -> Dict[str, str]:
+    '''
+    Business: Заголовок Authorization с сессионным токеном для вызовов, доступных только сотрудникам
+    Returns: dict для event['headers']; SESSION_SECRET берётся из окружения или задаётся для бенчмарка
+    '''
+    os.environ.setdefault('SESSION_SECRET', 'benchmark-secret')
+    folder = BACKEND / 'auth'
+    if str(folder) not in sys.path:
+        sys.path.insert(0, str(folder))
+    import sessions
+
+    return {'Authorization': 'Bearer ' + sessions.encode_token(sessions.new_session(employee_id, role))}
+
+
+def reset_schema() -> None:
+    import psycopg2
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute('DROP SCHEMA public CASCADE; CREATE SCHEMA public;')
+    for path in sorted(MIGRATIONS.glob('V*.sql')):
+        cur.execute(path.read_text())
+    cur.close()
+    conn.close()
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def report(title: str, latencies: List[float], elapsed: float) -> Dict[str, float]:
+    result = {
+        'requests': len(latencies),
+        'rps': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000
+    }
+    print(f"{title:<32} {result['rps']:>10.1f} req/s  p50 {result['p50_ms']:.2f} ms  "
+          f"p95 {result['p95_ms']:.2f} ms  p99 {result['p99_ms']:.2f} ms")
+    return result
+
+
+def timed_calls(call: Callable[[], Any], count: int) -> List[float]:
+    latencies = []
+    for _ in range(count):
+        started = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - started)
+    return latencies
@@ -0,0 +1,113 @@
+'''
+Списки чатов, сообщений и сотрудников с JOIN employees и с именами из справочника в памяти (directory.py).
+Полные списки чатов и сообщений в обоих режимах собираются json_agg с JOIN - их строки служат контролем.
+EMPLOYEE_DIRECTORY читается при импорте, поэтому каждый режим меряется в отдельном процессе над одной и той же
+засеянной базой; хэш тел ответов показывает, что оба режима отдают одинаковые данные.
+Запуск: DATABASE_URL=postgresql://localhost/chat_bench python benchmarks/directory_bench.py --chats 200000
+'''
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+from typing import Any, Dict
+
+import psycopg2
+
+from common import load_handler, percentile, reset_schema, staff_headers, timed_calls
+
+MODES = ('off', 'on')
+
+
+def seed(chats: int, operators: int, messages: int) -> int:
+    '''
+    Business: operators операторов, chats чатов с назначенными операторами и один чат с messages сообщениями
+    Returns: id чата с сообщениями
+    '''
+    reset_schema()
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO employees (login, password, name, role, status)
+        SELECT 'operator' || g, 'x', 'Operator ' || g, 'operator', 'online' FROM generate_series(1, %s) AS g
+    """, (operators,))
+    cur.execute("""
+        INSERT INTO chats (user_name, user_email, status, assigned_to, created_at, updated_at, is_closed)
+        SELECT 'user ' || g, 'user' || g || '@example.com',
+               CASE WHEN g %% 10 = 1 THEN 'waiting' ELSE 'assigned' END,
+               CASE WHEN g %% 10 = 1 THEN NULL ELSE (SELECT min(id) FROM employees) + g %% %s END,
+               TIMESTAMP '2020-01-01' + g * INTERVAL '1 minute',
+               TIMESTAMP '2020-01-01' + g * INTERVAL '1 minute',
+               g %% 3 = 0
+        FROM generate_series(1, %s) AS g
+    """, (operators, chats))
+    cur.execute("SELECT id, assigned_to FROM chats WHERE assigned_to IS NOT NULL ORDER BY id LIMIT 1")
+    chat_id, operator_id = cur.fetchone()
+    cur.execute("""
+        INSERT INTO messages (chat_id, sender_type, sender_id, message)
+        SELECT %s, CASE WHEN g %% 2 = 0 THEN 'operator' ELSE 'user' END,
+               CASE WHEN g %% 2 = 0 THEN %s END, 'message ' || g
+        FROM generate_series(1, %s) AS g
+    """, (chat_id, operator_id, messages))
+    cur.execute('ANALYZE')
+    cur.close()
+    conn.close()
+    return chat_id
+
+
+def child(chat_id: int, repeat: int) -> None:
+    chats = load_handler('chats')
+    messages = load_handler('messages')
+    employees = load_handler('employees')
+    admin = staff_headers()
+    calls = {
+        'chats full': (chats, {}),
+        'chats page': (chats, {'limit': '200'}),
+        'messages full': (messages, {'chat_id': str(chat_id)}),
+        'messages page': (messages, {'chat_id': str(chat_id), 'limit': '200'}),
+        'employees': (employees, {})
+    }
+    result: Dict[str, Any] = {}
+    for name, (handler, params) in calls.items():
+        event = {'httpMethod': 'GET', 'queryStringParameters': params, 'headers': admin}
+        response = handler(event, None)
+        assert response['statusCode'] == 200, response
+        digest = hashlib.sha1(json.dumps(json.loads(response['body']), sort_keys=True).encode()).hexdigest()[:10]
+        latencies = timed_calls(lambda: handler(event, None), repeat)
+        result[name] = {'p50_ms': percentile(latencies, 50) * 1000, 'p95_ms': percentile(latencies, 95) * 1000,
+                        'digest': digest}
+    print(json.dumps(result))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chats', type=int, default=200000)
+    parser.add_argument('--operators', type=int, default=500)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--child', type=int, metavar='CHAT_ID')
+    args = parser.parse_args()
+    if args.child:
+        child(args.child, args.repeat)
+        return
+
+    chat_id = seed(args.chats, args.operators, args.messages)
+    table = {}
+    for mode in MODES:
+        env = dict(os.environ, EMPLOYEE_DIRECTORY=mode, SESSION_SECRET=os.environ.get('SESSION_SECRET', 'benchmark-secret'))
+        output = subprocess.run([sys.executable, __file__, '--child', str(chat_id), '--repeat', str(args.repeat)],
+                                env=env, capture_output=True, text=True, check=True).stdout
+        table[mode] = json.loads(output.splitlines()[-1])
+
+    print(f"{args.chats} chats, {args.operators} operators, {args.messages} messages in one chat (ms)")
+    print(f"{'call':<15} {'join p50':>9} {'join p95':>9} {'dir p50':>9} {'dir p95':>9}  same body")
+    for name in table['off']:
+        join, cached = table['off'][name], table['on'][name]
+        print(f"{name:<15} {join['p50_ms']:>9.2f} {join['p95_ms']:>9.2f} {cached['p50_ms']:>9.2f} "
+              f"{cached['p95_ms']:>9.2f}  {join['digest'] == cached['digest']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+'''
+Проверка ETag списков chats, messages и employees: GET -> запись -> GET со старым тегом обязан вернуть 200 и новый
+тег, а тот же GET с текущим тегом - 304. Дополнительно: тег одного сотрудника не подходит другому, записи, которых
+нет в ответе списка (last_assigned_at при назначении, перехеш пароля при входе), тег не меняют, а дельты
+messages по after_id тег не считают.
+Запуск: DATABASE_URL=postgresql://localhost/chat_bench python benchmarks/etag_invalidation.py
+'''
+import json
+import os
+from typing import Any, Callable, Dict, Optional
+
+import psycopg2
+
+from common import load_handler, reset_schema, staff_headers
+
+
+def get(handler: Callable, headers: Dict[str, str], params: Optional[Dict[str, str]] = None,
+        etag: Optional[str] = None) -> Dict[str, Any]:
+    event_headers = dict(headers, **({'If-None-Match': etag} if etag else {}))
+    return handler({'httpMethod': 'GET', 'headers': event_headers, 'queryStringParameters': params or {}}, None)
+
+
+def send(handler: Callable, method: str, body: Dict[str, Any],
+         headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    response = handler({'httpMethod': method, 'headers': headers or {}, 'body': json.dumps(body)}, None)
+    assert response['statusCode'] in (200, 201), response
+    return response
+
+
+def new_chat(chats: Callable, name: str) -> int:
+    body = {'user_name': name, 'user_email': f'{name.lower()}@example.com', 'message': 'Hello'}
+    return json.loads(send(chats, 'POST', body)['body'])['chat_id']
+
+
+def check_invalidation(name: str, read: Callable[[Optional[str]], Dict[str, Any]], write: Callable[[], Any]) -> None:
+    '''
+    Business: GET (тег) -> запись -> GET со старым тегом: 200 и новый тег; GET с новым тегом - 304
+    '''
+    first = read(None)
+    assert first['statusCode'] == 200 and first['headers'].get('Vary') == 'Authorization', first
+    etag = first['headers']['ETag']
+    assert read(etag)['statusCode'] == 304, f'{name}: unchanged list must answer 304'
+    write()
+    second = read(etag)
+    assert second['statusCode'] == 200, f'{name}: stale tag answered {second["statusCode"]} after a write'
+    assert second['headers']['ETag'] != etag and second['body'] != first['body'], second
+    assert read(second['headers']['ETag'])['statusCode'] == 304
+    print(f'{name:<34} ok: {etag} -> {second["headers"]["ETag"]}')
+
+
+def check_unchanged(name: str, read: Callable[[Optional[str]], Dict[str, Any]], write: Callable[[], Any]) -> None:
+    etag = read(None)['headers']['ETag']
+    write()
+    assert read(etag)['statusCode'] == 304, f'{name}: tag changed although the list did not'
+    print(f'{name:<34} ok: still {etag}')
+
+
+def main() -> None:
+    reset_schema()
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO employees (login, password, name, role, status)
+        VALUES ('legacy', 'plain-password', 'Operator', 'operator', 'online') RETURNING id
+    """)
+    operator_id = cur.fetchone()[0]
+
+    chats = load_handler('chats')
+    messages = load_handler('messages')
+    employees = load_handler('employees')
+    auth = load_handler('auth')
+    admin = staff_headers()
+    operator = staff_headers(operator_id, 'operator')
+    chat_id = new_chat(chats, 'Client')
+
+    check_invalidation('chats: new chat', lambda etag: get(chats, admin, etag=etag),
+                       lambda: new_chat(chats, 'Second'))
+    check_invalidation('chats: close', lambda etag: get(chats, admin, etag=etag),
+                       lambda: send(chats, 'PUT', {'chat_id': chat_id, 'action': 'close', 'resolution_status': 'solved'},
+                                    admin))
+    check_invalidation('chats: operator renamed', lambda etag: get(chats, admin, etag=etag),
+                       lambda: cur.execute("UPDATE employees SET name = 'Renamed' WHERE id = %s", (operator_id,)))
+    check_invalidation('messages: new message', lambda etag: get(messages, admin, {'chat_id': str(chat_id)}, etag),
+                       lambda: send(messages, 'POST', {'chat_id': chat_id, 'sender_type': 'user', 'message': 'More'}))
+    check_invalidation('messages: latest page', lambda etag: get(
+        messages, admin, {'chat_id': str(chat_id), 'limit': '20'}, etag),
+        lambda: send(messages, 'POST', {'chat_id': chat_id, 'sender_type': 'user', 'message': 'Even more'}))
+    check_invalidation('employees: new employee', lambda etag: get(employees, admin, etag=etag),
+                       lambda: send(employees, 'POST', {'login': 'new', 'password': 'secret123', 'name': 'New',
+                                                        'role': 'operator'}, admin))
+    check_invalidation('employees: status change', lambda etag: get(employees, admin, etag=etag),
+                       lambda: send(employees, 'PUT', {'id': operator_id, 'status': 'offline'}, admin))
+
+    admin_tag = get(chats, admin)['headers']['ETag']
+    assert get(chats, operator, etag=admin_tag)['statusCode'] == 200, 'admin tag matched an operator list'
+    print(f"{'chats: tag of another caller':<34} ok: 200")
+
+    send(employees, 'PUT', {'id': operator_id, 'status': 'online'}, admin)
+    check_unchanged('employees: assignment', lambda etag: get(employees, admin, etag=etag),
+                    lambda: new_chat(chats, 'Third'))
+    check_unchanged('employees: password rehash', lambda etag: get(employees, admin, etag=etag),
+                    lambda: send(auth, 'POST', {'login': 'legacy', 'password': 'plain-password'}))
+    cur.execute("SELECT password FROM employees WHERE id = %s", (operator_id,))
+    assert cur.fetchone()[0] != 'plain-password', 'login did not rehash the legacy password'
+
+    delta = get(messages, admin, {'chat_id': str(chat_id), 'after_id': '0'})
+    assert delta['statusCode'] == 200 and 'ETag' not in delta['headers'], delta
+    print(f"{'messages: after_id delta':<34} ok: no ETag")
+    cur.close()
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
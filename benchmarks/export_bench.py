@@ -0,0 +1,137 @@
+'''
+Пропускная способность выгрузки chats/index.export_handler (gzip NDJSON и CSV) на синтетической базе: МБ/с до и после
+сжатия, строк в секунду и пиковая память процесса - она не должна расти с числом чатов. Для сравнения
+--baseline-chats N снимает тот же объём прежним способом: messages GET и chat-history GET на каждый чат.
+Каждый прогон идёт в отдельном процессе, чтобы пиковая память относилась только к нему.
+Запуск: DATABASE_URL=postgresql://localhost/chat_bench python benchmarks/export_bench.py --chats 200000
+'''
+import argparse
+import gzip
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import psycopg2
+
+from common import load_handler, reset_schema, staff_headers
+
+RANGE = {'from': '2020-01-01', 'to': '2030-01-01'}
+
+
+def seed(chats: int, messages: int, operators: int) -> None:
+    '''
+    Business: chats чатов за несколько лет, по messages сообщений и по две записи истории на чат
+    '''
+    reset_schema()
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO employees (login, password, name, role, status)
+        SELECT 'operator' || g, 'x', 'Operator ' || g, 'operator', 'online' FROM generate_series(1, %s) AS g
+    """, (operators,))
+    cur.execute("""
+        INSERT INTO chats (user_name, user_email, status, assigned_to, created_at, updated_at, is_closed, resolution_status)
+        SELECT 'user ' || g, 'user' || g || '@example.com', 'closed', (SELECT min(id) FROM employees) + g %% %s,
+               TIMESTAMP '2020-01-01' + g * INTERVAL '5 minutes', TIMESTAMP '2020-01-01' + g * INTERVAL '5 minutes',
+               TRUE, CASE WHEN g %% 2 = 0 THEN 'solved' ELSE 'unsolved' END
+        FROM generate_series(1, %s) AS g
+    """, (operators, chats))
+    cur.execute("""
+        INSERT INTO messages (chat_id, sender_type, sender_id, message, created_at)
+        SELECT c.id, CASE WHEN n %% 2 = 0 THEN 'operator' ELSE 'user' END,
+               CASE WHEN n %% 2 = 0 THEN c.assigned_to END,
+               'Message ' || n || ' in chat ' || c.id || ': ' || repeat('lorem ipsum ', 1 + n %% 8),
+               c.created_at + n * INTERVAL '10 seconds'
+        FROM chats c CROSS JOIN generate_series(1, %s) AS n
+    """, (messages,))
+    cur.execute("""
+        INSERT INTO chat_history (chat_id, action, details, employee_id, created_at)
+        SELECT c.id, a.action, a.action || ' by operator', c.assigned_to, c.created_at + a.n * INTERVAL '1 hour'
+        FROM chats c CROSS JOIN (VALUES (1, 'assigned'), (2, 'closed')) AS a (n, action)
+    """)
+    cur.execute('ANALYZE')
+    cur.close()
+    conn.close()
+
+
+def child_export(fmt: str, path: str) -> Dict[str, Any]:
+    handler = load_handler('chats', 'export_handler')
+    started = time.perf_counter()
+    result = handler(dict(RANGE, format=fmt, path=path, max_batches=1000000), None)
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+
+def child_baseline(chats: int) -> Dict[str, Any]:
+    messages = load_handler('messages')
+    history = load_handler('chat-history')
+    headers = staff_headers()
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cur = conn.cursor()
+    cur.execute('SELECT id FROM chats ORDER BY id LIMIT %s', (chats,))
+    chat_ids = [row[0] for row in cur.fetchall()]
+    conn.close()
+    total = 0
+    started = time.perf_counter()
+    for chat_id in chat_ids:
+        for handler in (messages, history):
+            event = {'httpMethod': 'GET', 'headers': headers, 'queryStringParameters': {'chat_id': str(chat_id)}}
+            response = handler(event, None)
+            assert response['statusCode'] == 200, response
+            total += len(response['body'].encode())
+    return {'chats': len(chat_ids), 'rows': len(chat_ids), 'bytes': total, 'compressed_bytes': total,
+            'seconds': time.perf_counter() - started}
+
+
+def run_child(args: List[str]) -> Dict[str, Any]:
+    env = dict(os.environ, SESSION_SECRET=os.environ.get('SESSION_SECRET', 'benchmark-secret'))
+    output = subprocess.run([sys.executable, __file__, '--child', *args], env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chats', type=int, default=200000)
+    parser.add_argument('--messages', type=int, default=20, help='сообщений на чат')
+    parser.add_argument('--operators', type=int, default=200)
+    parser.add_argument('--baseline-chats', type=int, default=2000)
+    parser.add_argument('--no-seed', action='store_true', help='мерить уже засеянную базу')
+    parser.add_argument('--child', nargs='+')
+    args = parser.parse_args()
+    if args.child:
+        kind = args.child[0]
+        result = child_baseline(int(args.child[1])) if kind == 'baseline' else child_export(kind, args.child[1])
+        result['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(json.dumps(result, default=str))
+        return
+
+    if not args.no_seed:
+        seed(args.chats, args.messages, args.operators)
+
+    print(f"{'mode':<10} {'chats':>8} {'rows':>10} {'raw MB':>8} {'gz MB':>7} {'s':>7} "
+          f"{'raw MB/s':>9} {'gz MB/s':>8} {'rows/s':>9} {'max RSS MB':>11}")
+    with tempfile.TemporaryDirectory() as tmp:
+        runs = [('ndjson', ['ndjson', os.path.join(tmp, 'chats.ndjson.gz')]),
+                ('csv', ['csv', os.path.join(tmp, 'chats.csv.gz')])]
+        if args.baseline_chats:
+            runs.append(('per-chat', ['baseline', str(args.baseline_chats)]))
+        for name, child_args in runs:
+            result = run_child(child_args)
+            if name != 'per-chat':
+                with gzip.open(child_args[1]) as exported:
+                    assert sum(len(chunk) for chunk in iter(lambda: exported.read(1 << 20), b'')) == result['bytes']
+            raw_mb, gz_mb, seconds = result['bytes'] / 1e6, result['compressed_bytes'] / 1e6, result['seconds']
+            print(f"{name:<10} {result['chats']:>8} {result['rows']:>10} {raw_mb:>8.1f} {gz_mb:>7.1f} {seconds:>7.2f} "
+                  f"{raw_mb / seconds:>9.1f} {gz_mb / seconds:>8.1f} {result['rows'] / seconds:>9.0f} "
+                  f"{result['max_rss_mb']:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
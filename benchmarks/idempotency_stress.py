@@ -0,0 +1,158 @@
+'''
+Конкурентная проверка Idempotency-Key для chats POST и messages POST (одиночная и пакетная отправка):
+--duplicates потоков одновременно (через барьер) шлют один и тот же запрос с одним ключом, и каждый раунд обязан
+вставить ровно одну строку, а все ответы - совпасть (повторы помечены Idempotent-Replayed). Дальше - тот же ключ с
+другим телом (422), просроченный ключ (запрос выполняется заново) и шторм повторов с ключами и без: сколько лишних
+строк он вставляет и во что обходится.
+Запуск: DATABASE_URL=postgresql://localhost/chat_bench python benchmarks/idempotency_stress.py --duplicates 16
+'''
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import psycopg2
+
+from common import load_handler, percentile, reset_schema, staff_headers
+
+
+def count_rows(table: str) -> int:
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cur = conn.cursor()
+    cur.execute(f'SELECT count(*) FROM {table}')
+    count = cur.fetchone()[0]
+    conn.close()
+    return count
+
+
+def execute(sql: str, args: Any = ()) -> None:
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True
+    conn.cursor().execute(sql, args)
+    conn.close()
+
+
+def post(handler: Callable, body: Dict[str, Any], key: Optional[str],
+         headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    event_headers = dict(headers or {})
+    if key:
+        event_headers['Idempotency-Key'] = key
+    return handler({'httpMethod': 'POST', 'headers': event_headers, 'body': json.dumps(body)}, None)
+
+
+def simultaneous(handler: Callable, body: Dict[str, Any], key: str, duplicates: int,
+                 headers: Optional[Dict[str, str]] = None) -> List[Dict[str, Any]]:
+    '''
+    Business: duplicates одинаковых запросов с одним ключом, отпущенных барьером одновременно
+    '''
+    barrier = threading.Barrier(duplicates)
+
+    def send(_: int) -> Dict[str, Any]:
+        barrier.wait()
+        return post(handler, body, key, headers)
+
+    with ThreadPoolExecutor(duplicates) as pool:
+        return list(pool.map(send, range(duplicates)))
+
+
+def check_round(name: str, table: str, rows_per_request: int, send: Callable[[str], List[Dict[str, Any]]],
+                rounds: int) -> None:
+    before = count_rows(table)
+    replays = 0
+    for index in range(rounds):
+        responses = send(f'{name}-{index}-{uuid.uuid4()}')
+        assert {r['statusCode'] for r in responses} == {201}, [r['statusCode'] for r in responses]
+        assert len({r['body'] for r in responses}) == 1, {r['body'] for r in responses}
+        fresh = [r for r in responses if 'Idempotent-Replayed' not in r['headers']]
+        assert len(fresh) == 1, f'{len(fresh)} responses executed the insert'
+        replays += len(responses) - 1
+    inserted = count_rows(table) - before
+    assert inserted == rounds * rows_per_request, f'{name}: {inserted} rows for {rounds} rounds'
+    print(f'{name:<22} ok: {rounds} rounds, {inserted} rows inserted, {replays} replayed responses')
+
+
+def retry_storm(handler: Callable, make_body: Callable[[int], Dict[str, Any]], requests: int, retries: int,
+                threads: int, use_keys: bool) -> Dict[str, float]:
+    '''
+    Business: requests логических запросов, каждый отправлен 1 + retries раз (как клиент после таймаутов)
+    Returns: вставлено строк, p50/p95 вызова и общее время
+    '''
+    before = count_rows('messages')
+    latencies: List[float] = []
+    lock = threading.Lock()
+
+    def logical(index: int) -> None:
+        key = str(uuid.uuid4()) if use_keys else None
+        for _ in range(1 + retries):
+            started = time.perf_counter()
+            response = post(handler, make_body(index), key)
+            with lock:
+                latencies.append(time.perf_counter() - started)
+            assert response['statusCode'] == 201, response
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(logical, range(requests)))
+    return {'rows': count_rows('messages') - before, 'p50_ms': percentile(latencies, 50) * 1000,
+            'p95_ms': percentile(latencies, 95) * 1000, 'seconds': time.perf_counter() - started}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--duplicates', type=int, default=16, help='одновременных копий одного запроса')
+    parser.add_argument('--rounds', type=int, default=50)
+    parser.add_argument('--storm-requests', type=int, default=2000)
+    parser.add_argument('--storm-retries', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=16)
+    args = parser.parse_args()
+    os.environ['DB_POOL_SIZE'] = str(max(args.duplicates, args.threads))
+
+    reset_schema()
+    execute("INSERT INTO employees (login, password, name, role, status) VALUES ('op', 'x', 'Op', 'operator', 'online')")
+    chats = load_handler('chats')
+    messages = load_handler('messages')
+    admin = staff_headers()
+    chat_id = json.loads(post(chats, {'user_name': 'Stress', 'message': 'Hello'}, None)['body'])['chat_id']
+
+    check_round('chats POST', 'chats', 1, lambda key: simultaneous(
+        chats, {'user_name': f'User {key}', 'user_email': f'{key}@example.com', 'message': 'Hello'}, key,
+        args.duplicates), args.rounds)
+    check_round('messages POST', 'messages', 1, lambda key: simultaneous(
+        messages, {'chat_id': chat_id, 'sender_type': 'user', 'message': f'Message {key}'}, key,
+        args.duplicates), args.rounds)
+    check_round('messages batch POST', 'messages', 3, lambda key: simultaneous(
+        messages, {'messages': [{'chat_id': chat_id, 'message': f'Batch {key} {n}'} for n in range(3)]}, key,
+        args.duplicates, admin), args.rounds)
+
+    key = str(uuid.uuid4())
+    body = {'chat_id': chat_id, 'sender_type': 'user', 'message': 'original'}
+    assert post(messages, body, key)['statusCode'] == 201
+    conflict = post(messages, dict(body, message='changed'), key)
+    assert conflict['statusCode'] == 422, conflict
+    print(f"{'reused key':<22} ok: different body -> 422")
+
+    before = count_rows('messages')
+    execute("UPDATE idempotency_keys SET expires_at = CURRENT_TIMESTAMP - INTERVAL '1 second' WHERE key = %s", (key,))
+    again = post(messages, body, key)
+    assert again['statusCode'] == 201 and 'Idempotent-Replayed' not in again['headers'], again
+    assert count_rows('messages') == before + 1
+    print(f"{'expired key':<22} ok: request executed again")
+
+    print()
+    print(f"retry storm: {args.storm_requests} requests x {1 + args.storm_retries} sends, {args.threads} threads")
+    print(f"{'mode':<12} {'rows':>8} {'p50 ms':>8} {'p95 ms':>8} {'seconds':>8}")
+    for use_keys in (False, True):
+        result = retry_storm(
+            messages, lambda index: {'chat_id': chat_id, 'sender_type': 'user', 'message': f'Storm {index}'},
+            args.storm_requests, args.storm_retries, args.threads, use_keys
+        )
+        print(f"{'with keys' if use_keys else 'no keys':<12} {result['rows']:>8} {result['p50_ms']:>8.2f} "
+              f"{result['p95_ms']:>8.2f} {result['seconds']:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
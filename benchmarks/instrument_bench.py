@@ -0,0 +1,62 @@
+'''
+Накладные расходы трассировки REQUEST_TRACE: один и тот же вызов messages GET с off, header и log.
+Режим читается при импорте функции, поэтому каждый режим меряется в отдельном процессе.
+Запуск: DATABASE_URL=postgresql://localhost/chat_bench python benchmarks/instrument_bench.py
+'''
+import argparse
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import time
+
+import psycopg2
+
+from common import load_handler, percentile, reset_schema, staff_headers
+
+
+def child(mode: str, chat_id: int, requests: int) -> None:
+    os.environ['REQUEST_TRACE'] = mode
+    handler = load_handler('messages')
+    event = {'httpMethod': 'GET', 'queryStringParameters': {'chat_id': str(chat_id), 'limit': '50'},
+             'headers': staff_headers()}
+    latencies = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        handler(event, None)
+        for _ in range(requests):
+            started = time.perf_counter()
+            handler(event, None)
+            latencies.append(time.perf_counter() - started)
+    print(f'{mode:<7} p50 {percentile(latencies, 50) * 1e6:>9.1f} us  p99 {percentile(latencies, 99) * 1e6:>9.1f} us')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--child', nargs=2, metavar=('MODE', 'CHAT_ID'))
+    args = parser.parse_args()
+    if args.child:
+        child(args.child[0], int(args.child[1]), args.requests)
+        return
+
+    reset_schema()
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute("INSERT INTO chats (user_name, user_email) VALUES ('Bench', 'bench@example.com') RETURNING id")
+    chat_id = cur.fetchone()[0]
+    cur.execute("""
+        INSERT INTO messages (chat_id, sender_type, message)
+        SELECT %s, 'user', 'Message ' || g FROM generate_series(1, 200) AS g
+    """, (chat_id,))
+    cur.close()
+    conn.close()
+
+    for mode in ('off', 'header', 'log'):
+        subprocess.run([sys.executable, __file__, '--requests', str(args.requests), '--child', mode, str(chat_id)],
+                       check=True)
+
+
+if __name__ == '__main__':
+    main()
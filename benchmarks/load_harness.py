@@ -0,0 +1,245 @@
+'''
+Нагрузочный прогон функций локально: сценарии собираются из backend/*/tests.json, handler вызывается напрямую
+из потоков или процессов против одноразовой Postgres. Отчёт - req/s, p50/p95/p99 и запросы к БД на вызов;
+результаты сохраняются в JSON, чтобы сравнивать коммиты (--compare).
+Запуск: DATABASE_URL=postgresql://localhost/chat_bench python benchmarks/load_harness.py --scenario mixed
+'''
+import argparse
+import json
+import os
+import random
+import subprocess
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+import psycopg2
+import psycopg2.extensions
+
+from common import BACKEND, ROOT, load_handler, percentile, reset_schema, staff_headers
+
+RESULTS = ROOT / 'benchmarks' / 'results'
+
+SCENARIOS: Dict[str, List[Tuple[str, str, int]]] = {
+    'create_burst': [('chats', 'POST', 1)],
+    'message_storm': [('messages', 'POST', 8), ('messages', 'GET', 2)],
+    'dashboard': [('chats', 'GET', 4), ('employees', 'GET', 2), ('chat-history', 'GET', 2), ('messages', 'GET', 2)],
+    'mixed': [('chats', 'POST', 2), ('chats', 'GET', 3), ('messages', 'POST', 4), ('messages', 'GET', 3),
+              ('employees', 'GET', 1), ('chat-history', 'GET', 1)]
+}
+
+_local = threading.local()
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        _local.round_trips = getattr(_local, 'round_trips', 0) + 1
+        return super().execute(query, vars)
+
+
+class CountingConnection(psycopg2.extensions.connection):
+    def cursor(self, *args, **kwargs):
+        kwargs.setdefault('cursor_factory', CountingCursor)
+        return super().cursor(*args, **kwargs)
+
+    def commit(self):
+        _local.round_trips = getattr(_local, 'round_trips', 0) + 1
+        return super().commit()
+
+
+def count_round_trips() -> None:
+    '''
+    Business: Подменяет фабрику соединений пула, чтобы считать execute и commit в текущем потоке
+    '''
+    import db
+
+    def connect(pool) -> Any:
+        pool._count('handshakes')
+        return psycopg2.connect(os.environ.get(pool.dsn_env), connection_factory=CountingConnection)
+
+    db.ConnectionPool._connect = connect
+
+
+def load_cases() -> Dict[Tuple[str, str], List[Dict[str, Any]]]:
+    '''
+    Business: Читает tests.json всех функций; long-poll кейсы (wait) пропускаются, чтобы не мерить ожидание
+    Returns: кейсы по ключу (функция, метод)
+    '''
+    cases: Dict[Tuple[str, str], List[Dict[str, Any]]] = defaultdict(list)
+    for path in sorted(BACKEND.glob('*/tests.json')):
+        for case in json.loads(path.read_text())['tests']:
+            if 'wait=' in case.get('path', ''):
+                continue
+            cases[(path.parent.name, case['method'])].append(case)
+    return cases
+
+
+def to_event(case: Dict[str, Any], chat_ids: List[int], rng: random.Random, headers: Dict[str, str]) -> Dict[str, Any]:
+    '''
+    Business: Превращает кейс tests.json в событие функции с живыми chat_id, уникальными email и токеном сотрудника
+    Idempotency-Key кейса заменяется новым на каждое событие: тело уже другое, и повтор ключа дал бы 422 вместо
+    вставки; кейсы, которые и должны отвечать 4xx (слишком длинный ключ), отправляются как есть
+    '''
+    query = dict(parse_qsl(urlsplit(case.get('path', '/')).query))
+    if 'chat_id' in query:
+        query['chat_id'] = str(rng.choice(chat_ids))
+    body = json.loads(json.dumps(case.get('body'))) if case.get('body') is not None else None
+    items = body.get('messages') if isinstance(body, dict) and isinstance(body.get('messages'), list) else [body]
+    for item in items:
+        if isinstance(item, dict):
+            if 'chat_id' in item:
+                item['chat_id'] = rng.choice(chat_ids)
+            if 'user_email' in item:
+                item['user_email'] = f'load{rng.randrange(10 ** 6)}@example.com'
+    event_headers = dict(case.get('headers') or {}, **headers)
+    if case.get('expectedStatus', 200) < 400:
+        for name in [name for name in event_headers if name.lower() == 'idempotency-key']:
+            event_headers[name] = str(uuid.UUID(int=rng.getrandbits(128)))
+    event = {
+        'httpMethod': case['method'],
+        'queryStringParameters': query,
+        'headers': event_headers
+    }
+    if body is not None:
+        event['body'] = json.dumps(body)
+    return event
+
+
+_handlers: Dict[str, Callable] = {}
+_handlers_lock = threading.Lock()
+
+
+def handler_for(function: str) -> Callable:
+    with _handlers_lock:
+        if function not in _handlers:
+            _handlers[function] = load_handler(function)
+            count_round_trips()
+        return _handlers[function]
+
+
+def run_worker(scenario: str, requests: int, chat_ids: List[int], seed: int) -> List[Tuple[str, int, float, int]]:
+    '''
+    Business: Один поток или процесс нагрузки
+    Returns: (кейс, HTTP-статус, секунды, запросов к БД) на каждый вызов
+    '''
+    rng = random.Random(seed)
+    cases = load_cases()
+    mix = [(function, method) for function, method, weight in SCENARIOS[scenario] for _ in range(weight)]
+    headers = staff_headers()
+    samples = []
+    for _ in range(requests):
+        function, method = rng.choice(mix)
+        case = rng.choice(cases[(function, method)])
+        event = to_event(case, chat_ids, rng, headers)
+        handler = handler_for(function)
+        _local.round_trips = 0
+        started = time.perf_counter()
+        try:
+            status = handler(event, None)['statusCode']
+        except Exception:
+            status = 599
+        samples.append((f"{function} {method} {case['name']}", status, time.perf_counter() - started, _local.round_trips))
+    return samples
+
+
+def summarize(samples: List[Tuple[str, int, float, int]], elapsed: float) -> Dict[str, Any]:
+    def stats(rows: List[Tuple[str, int, float, int]]) -> Dict[str, Any]:
+        latencies = [row[2] for row in rows]
+        return {
+            'requests': len(rows),
+            'rps': len(rows) / elapsed if elapsed else 0.0,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p95_ms': percentile(latencies, 95) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'db_round_trips': sum(row[3] for row in rows) / len(rows) if rows else 0.0,
+            'errors': sum(1 for row in rows if row[1] >= 500),
+            'client_errors': sum(1 for row in rows if 400 <= row[1] < 500)
+        }
+
+    by_case = defaultdict(list)
+    for row in samples:
+        by_case[row[0]].append(row)
+    return {'total': stats(samples), 'cases': {name: stats(rows) for name, rows in sorted(by_case.items())}}
+
+
+def seed_chats(count: int, operators: int) -> List[int]:
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO employees (login, password, name, role, status)
+        SELECT 'operator' || g, 'x', 'Operator ' || g, 'operator', 'online' FROM generate_series(1, %s) AS g
+    """, (operators,))
+    cur.execute("""
+        INSERT INTO chats (user_name, user_email, status, assigned_to)
+        SELECT 'user ' || g, 'user' || g || '@example.com', 'assigned',
+               (SELECT min(id) FROM employees WHERE role = 'operator') + g %% %s
+        FROM generate_series(1, %s) AS g
+        RETURNING id
+    """, (operators, count))
+    chat_ids = [row[0] for row in cur.fetchall()]
+    cur.execute("""
+        INSERT INTO messages (chat_id, sender_type, message)
+        SELECT c.id, 'user', 'Seed message ' || g FROM chats c, generate_series(1, 20) AS g
+    """)
+    cur.execute('ANALYZE')
+    cur.close()
+    conn.close()
+    return chat_ids
+
+
+def print_report(title: str, result: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    print(f"{'case':<64} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'db/req':>7} {'4xx':>5} {'5xx':>5}")
+    rows = list(result['cases'].items()) + [(title, result['total'])]
+    for name, stats in rows:
+        line = (f"{name[:64]:<64} {stats['rps']:>9.1f} {stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} "
+                f"{stats['p99_ms']:>8.2f} {stats['db_round_trips']:>7.1f} {stats['client_errors']:>5} "
+                f"{stats['errors']:>5}")
+        before = (baseline or {}).get('cases', {}).get(name) if name != title else (baseline or {}).get('total')
+        if before:
+            line += f"  p99 {stats['p99_ms'] - before['p99_ms']:+.2f} ms, req/s {stats['rps'] - before['rps']:+.1f}"
+        print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='mixed')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--processes', action='store_true', help='процессы вместо потоков (отдельный пул и GIL на воркер)')
+    parser.add_argument('--chats', type=int, default=1000)
+    parser.add_argument('--operators', type=int, default=20)
+    parser.add_argument('--output', type=Path, help='куда сохранить JSON (по умолчанию benchmarks/results/)')
+    parser.add_argument('--compare', type=Path, help='JSON прошлого прогона для сравнения')
+    args = parser.parse_args()
+
+    reset_schema()
+    chat_ids = seed_chats(args.chats, args.operators)
+    per_worker = args.requests // args.workers
+    executor = ProcessPoolExecutor if args.processes else ThreadPoolExecutor
+
+    started = time.perf_counter()
+    with executor(args.workers) as pool:
+        futures = [pool.submit(run_worker, args.scenario, per_worker, chat_ids, seed) for seed in range(args.workers)]
+        samples = [sample for future in futures for sample in future.result()]
+    elapsed = time.perf_counter() - started
+
+    commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    result = dict(summarize(samples, elapsed), scenario=args.scenario, commit=commit, workers=args.workers,
+                  mode='processes' if args.processes else 'threads', elapsed_s=elapsed)
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+    print_report(args.scenario, result, baseline)
+
+    output = args.output or RESULTS / f"{args.scenario}-{commit or 'nogit'}-{result['mode']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, indent=2, ensure_ascii=False))
+    print(f'saved {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+'''
+Открытие чата оператором: прежние три вызова (chats, messages, chat-history) против chat-history view=open.
+Вызовы идут в процессе, поэтому сетевой round-trip и холодный старт каждой функции задаются --rtt-ms.
+Перед замером проверяется, что чтения открытого чата (messages, view=open, история) не заходят в секции *_cold.
+Запуск: DATABASE_URL=postgresql://localhost/chat_bench python benchmarks/open_chat_bench.py
+'''
+import argparse
+import os
+import time
+from typing import Any, List
+
+import psycopg2
+
+from common import load_handler, report, reset_schema, staff_headers, timed_calls
+
+
+class ExplainCursor:
+    '''
+    Business: Курсор, который выполняет запрос функции под EXPLAIN ANALYZE и запоминает план вместо строк
+    '''
+
+    def __init__(self, cur) -> None:
+        self.cur = cur
+        self.plan: List[str] = []
+
+    def execute(self, query: str, args: Any = ()) -> None:
+        self.cur.execute('EXPLAIN (ANALYZE, COSTS OFF, TIMING OFF) ' + query, args)
+        self.plan = [row[0] for row in self.cur.fetchall()]
+
+    def fetchone(self) -> None:
+        return None
+
+
+def assert_pruned(name: str, plan: List[str]) -> None:
+    cold = [line for line in plan if '_cold' in line and 'never executed' not in line]
+    assert not cold, f'{name}:\n' + '\n'.join(plan)
+    print(f'{name}: cold partitions pruned')
+
+
+def check_pruning(cur, chat_id: int) -> None:
+    '''
+    Business: EXPLAIN ANALYZE чтений открытого чата - выборки messages с messages.CHAT_PARTITION, view=open и
+              списка истории chat-history - секции *_cold отсечены
+    '''
+    partition = load_handler('messages', 'CHAT_PARTITION')
+    cur.execute(f"""
+        EXPLAIN (ANALYZE, COSTS OFF, TIMING OFF)
+        SELECT m.id FROM messages m WHERE m.chat_id = %s AND {partition} ORDER BY m.id
+    """, (chat_id, chat_id))
+    assert_pruned('messages page', [row[0] for row in cur.fetchall()])
+
+    explain = ExplainCursor(cur)
+    load_handler('chat-history', 'open_chat')(explain, chat_id, 50)
+    assert_pruned('chat-history view=open', explain.plan)
+
+    history = load_handler('chat-history', 'chat_partition')('h')
+    cur.execute(f"""
+        EXPLAIN (ANALYZE, COSTS OFF, TIMING OFF)
+        SELECT h.id FROM chat_history h WHERE h.chat_id = %(chat_id)s AND {history} ORDER BY h.created_at, h.id
+    """, {'chat_id': chat_id})
+    assert_pruned('chat-history list', [row[0] for row in cur.fetchall()])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chats', type=int, default=2000)
+    parser.add_argument('--messages', type=int, default=500, help='сообщений в открываемом чате')
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--rtt-ms', type=float, default=0.0, help='добавочная задержка на каждый HTTP-вызов')
+    args = parser.parse_args()
+
+    reset_schema()
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute("INSERT INTO employees (login, password, name, role) VALUES ('op', 'x', 'Operator', 'operator') RETURNING id")
+    operator_id = cur.fetchone()[0]
+    cur.execute("""
+        INSERT INTO chats (user_name, user_email, status, assigned_to)
+        SELECT 'user ' || g, 'user' || g || '@example.com', 'assigned', %s FROM generate_series(1, %s) AS g
+    """, (operator_id, args.chats))
+    cur.execute("SELECT max(id) FROM chats")
+    chat_id = cur.fetchone()[0]
+    cur.execute("""
+        INSERT INTO messages (chat_id, sender_type, sender_id, message)
+        SELECT %s, CASE WHEN g %% 2 = 0 THEN 'operator' ELSE 'user' END, CASE WHEN g %% 2 = 0 THEN %s END,
+               'Message number ' || g
+        FROM generate_series(1, %s) AS g
+    """, (chat_id, operator_id, args.messages))
+    cur.execute("""
+        INSERT INTO chat_history (chat_id, action, details, employee_id)
+        SELECT %s, 'assigned', 'Assigned ' || g, %s FROM generate_series(1, 20) AS g
+    """, (chat_id, operator_id))
+    cur.execute('ANALYZE')
+    check_pruning(cur, chat_id)
+    cur.close()
+    conn.close()
+
+    headers = staff_headers(operator_id, 'operator')
+    chats = load_handler('chats')
+    messages = load_handler('messages')
+    history = load_handler('chat-history')
+    query = {'chat_id': str(chat_id)}
+    rtt = args.rtt_ms / 1000
+
+    def call(handler, params) -> None:
+        time.sleep(rtt)
+        response = handler({'httpMethod': 'GET', 'queryStringParameters': params, 'headers': headers}, None)
+        assert response['statusCode'] == 200, response
+
+    def three_calls() -> None:
+        call(chats, {})
+        call(messages, query)
+        call(history, query)
+
+    def open_view() -> None:
+        call(history, dict(query, view='open'))
+
+    for title, flow in (('chats + messages + history', three_calls), ('chat-history view=open', open_view)):
+        flow()
+        started = time.perf_counter()
+        latencies = timed_calls(flow, args.requests)
+        report(title, latencies, time.perf_counter() - started)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+'''
+Сквозная проверка outbox: события пишутся в транзакции запроса, два воркера разбирают их параллельно,
+каждое событие доставляется ровно один раз, упавший обработчик повторяется с backoff.
+Медленный обработчик не влияет на латентность chats POST - она меряется до и после регистрации обработчиков.
+Запуск: DATABASE_URL=postgresql://localhost/chat_bench python benchmarks/outbox_e2e.py
+'''
+import argparse
+import json
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+from common import load_handler, percentile, reset_schema, staff_headers
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chats', type=int, default=200)
+    parser.add_argument('--handler-ms', type=float, default=20, help='время работы медленного обработчика')
+    args = parser.parse_args()
+
+    reset_schema()
+    admin = staff_headers()
+    chats = load_handler('chats')
+    outbox_handler = load_handler('chats', 'outbox_handler')
+    import outbox
+
+    outbox.BACKOFF_BASE = 0.05
+    delivered = Counter()
+    failed_once = set()
+    lock = threading.Lock()
+
+    def slow_side_effect(event) -> None:
+        time.sleep(args.handler_ms / 1000)
+        with lock:
+            delivered[event['id']] += 1
+
+    def flaky_on_close(event) -> None:
+        with lock:
+            if event['id'] not in failed_once:
+                failed_once.add(event['id'])
+                raise RuntimeError('downstream unavailable')
+
+    def create(index: int) -> float:
+        started = time.perf_counter()
+        response = chats({'httpMethod': 'POST', 'body': json.dumps({
+            'user_name': f'User {index}', 'user_email': f'user{index}@example.com', 'message': 'Hi'
+        })}, None)
+        assert response['statusCode'] == 201, response
+        return time.perf_counter() - started
+
+    baseline = [create(index) for index in range(args.chats)]
+    outbox.register('chat.closed', flaky_on_close)
+    outbox.register('*', slow_side_effect)
+    with_handlers = [create(index) for index in range(args.chats, 2 * args.chats)]
+
+    for chat_id in range(1, args.chats + 1, 2):
+        response = chats({'httpMethod': 'PUT', 'headers': admin, 'body': json.dumps({
+            'action': 'close', 'chat_id': chat_id, 'resolution_status': 'solved'
+        })}, None)
+        assert response['statusCode'] == 200, response
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute("SELECT count(*), count(*) FILTER (WHERE event_type = 'chat.closed') FROM chat_outbox")
+    total, closed = cur.fetchone()
+
+    started = time.perf_counter()
+    totals = Counter()
+    while True:
+        with ThreadPoolExecutor(2) as executor:
+            for result in executor.map(lambda _: outbox_handler({'limit': 50}, None), range(2)):
+                totals.update(result)
+        cur.execute("SELECT count(*) FROM chat_outbox WHERE processed_at IS NULL AND failed_at IS NULL")
+        if cur.fetchone()[0] == 0:
+            break
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - started
+
+    assert len(delivered) == total, (len(delivered), total)
+    assert max(delivered.values()) == 1, 'event delivered twice'
+    assert len(failed_once) == closed and totals['retried'] == closed, (totals, closed)
+    assert totals['processed'] == total and totals['failed'] == 0, totals
+
+    print(f'chats POST p50 without handlers {percentile(baseline, 50) * 1000:.2f} ms, '
+          f'with {args.handler_ms:.0f} ms handlers {percentile(with_handlers, 50) * 1000:.2f} ms')
+    print(f'{total} events delivered once each by 2 workers in {elapsed:.2f} s, {closed} retried after failure')
+    cur.close()
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
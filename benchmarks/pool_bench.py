@@ -0,0 +1,45 @@
+'''
+Сравнение пула соединений с прежней схемой "connect на каждый запрос".
+Запуск: DATABASE_URL=postgresql://localhost/chat_bench python benchmarks/pool_bench.py
+'''
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import load_handler, report, reset_schema, staff_headers, timed_calls
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    reset_schema()
+    handler = load_handler('employees')
+    import db
+
+    event = {'httpMethod': 'GET', 'headers': staff_headers()}
+    per_thread = args.requests // args.threads
+
+    def pooled() -> None:
+        handler(event, None)
+
+    def connect_per_request() -> None:
+        handler(event, None)
+        db.get_pool().closeall()
+
+    for title, call in (('connect per request', connect_per_request), ('pooled', pooled)):
+        pool = db.get_pool()
+        pool.closeall()
+        pool.stats = dict.fromkeys(pool.stats, 0)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.threads) as executor:
+            chunks = list(executor.map(lambda _: timed_calls(call, per_thread), range(args.threads)))
+        elapsed = time.perf_counter() - started
+        report(title, [lat for chunk in chunks for lat in chunk], elapsed)
+        print('   pool stats:', db.pool_stats('DATABASE_URL'))
+
+
+if __name__ == '__main__':
+    main()
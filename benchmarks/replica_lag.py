@@ -0,0 +1,127 @@
+'''
+Проверка маршрутизации чтений на реплику с искусственным отставанием: две локальные Postgres - primary и
+потоковая standby с recovery_min_apply_delay. Оператор отправляет сообщение и сразу читает чат:
+с токеном X-Read-After он обязан увидеть своё сообщение, без токена - видно, сколько чтений отстаёт.
+Поднять пару кластеров (нужны initdb, pg_ctl, pg_basebackup в PATH):
+  python benchmarks/replica_lag.py --setup /tmp/chat_replica --lag-ms 500
+Запуск с уже поднятой парой:
+  DATABASE_URL=postgresql://localhost:55432/postgres DATABASE_READ_URL=postgresql://localhost:55433/postgres \\
+  python benchmarks/replica_lag.py --writes 200
+'''
+import argparse
+import json
+import os
+import subprocess
+import time
+from pathlib import Path
+from typing import Any, Dict
+
+import psycopg2
+
+from common import load_handler, percentile, reset_schema, staff_headers
+
+
+def setup_clusters(root: Path, lag_ms: int, primary_port: int, replica_port: int) -> None:
+    '''
+    Business: initdb primary, pg_basebackup -R для standby, задержка применения WAL на standby, запуск обоих
+    '''
+    primary, replica = root / 'primary', root / 'replica'
+    subprocess.run(['initdb', '-D', str(primary), '-A', 'trust', '-U', os.environ.get('USER', 'postgres')], check=True)
+    with open(primary / 'postgresql.conf', 'a') as conf:
+        conf.write(f"port = {primary_port}\nwal_level = replica\nmax_wal_senders = 4\nhot_standby = on\n")
+    with open(primary / 'pg_hba.conf', 'a') as hba:
+        hba.write('local replication all trust\nhost replication all 127.0.0.1/32 trust\n')
+    subprocess.run(['pg_ctl', '-D', str(primary), '-l', str(root / 'primary.log'), '-w', 'start'], check=True)
+    subprocess.run(['pg_basebackup', '-D', str(replica), '-R', '-h', 'localhost', '-p', str(primary_port)], check=True)
+    with open(replica / 'postgresql.conf', 'a') as conf:
+        conf.write(f"port = {replica_port}\nrecovery_min_apply_delay = '{lag_ms}ms'\n")
+    subprocess.run(['pg_ctl', '-D', str(replica), '-l', str(root / 'replica.log'), '-w', 'start'], check=True)
+    print(f'export DATABASE_URL=postgresql://localhost:{primary_port}/postgres')
+    print(f'export DATABASE_READ_URL=postgresql://localhost:{replica_port}/postgres')
+    print(f'stop: pg_ctl -D {replica} stop && pg_ctl -D {primary} stop')
+
+
+def wait_for_replica(timeout: float = 30) -> None:
+    primary = psycopg2.connect(os.environ['DATABASE_URL'])
+    primary.autocommit = True
+    cur = primary.cursor()
+    cur.execute('SELECT pg_current_wal_lsn()::text')
+    lsn = cur.fetchone()[0]
+    primary.close()
+    replica = psycopg2.connect(os.environ['DATABASE_READ_URL'])
+    replica.autocommit = True
+    cur = replica.cursor()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        cur.execute('SELECT pg_last_wal_replay_lsn() >= %s::pg_lsn', (lsn,))
+        if cur.fetchone()[0]:
+            break
+        time.sleep(0.05)
+    replica.close()
+
+
+def run(writes: int, use_token: bool, messages: Any, chat_id: int, headers: Dict[str, str]) -> Dict[str, Any]:
+    '''
+    Business: writes раз - сообщение оператора и сразу чтение последних сообщений чата
+    Returns: доля чтений без своего сообщения (stale), p50/p95 чтения и распределение по пулам
+    '''
+    import db
+
+    stale = 0
+    latencies = []
+    before = db.pool_stats()
+    for index in range(writes):
+        text = f'lag probe {use_token} {index}'
+        response = messages({'httpMethod': 'POST', 'headers': headers,
+                             'body': json.dumps({'chat_id': chat_id, 'sender_type': 'operator', 'message': text})}, None)
+        assert response['statusCode'] == 201, response
+        read_headers = dict(headers)
+        if use_token and 'X-Read-After' in response['headers']:
+            read_headers['X-Read-After'] = response['headers']['X-Read-After']
+        started = time.perf_counter()
+        response = messages({'httpMethod': 'GET', 'headers': read_headers,
+                             'queryStringParameters': {'chat_id': str(chat_id), 'limit': '5'}}, None)
+        latencies.append(time.perf_counter() - started)
+        if text not in [message['message'] for message in json.loads(response['body'])['messages']]:
+            stale += 1
+    after = db.pool_stats()
+    checkouts = {name: after[name]['checkouts'] - before.get(name, {}).get('checkouts', 0) for name in after}
+    return {'stale': stale, 'p50_ms': percentile(latencies, 50) * 1000, 'p95_ms': percentile(latencies, 95) * 1000,
+            'checkouts': checkouts}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--setup', type=Path, help='каталог для новой пары primary/standby')
+    parser.add_argument('--lag-ms', type=int, default=500)
+    parser.add_argument('--ports', type=int, nargs=2, default=(55432, 55433))
+    parser.add_argument('--writes', type=int, default=200)
+    args = parser.parse_args()
+    if args.setup:
+        setup_clusters(args.setup, args.lag_ms, *args.ports)
+        return
+
+    assert os.environ.get('DATABASE_READ_URL'), 'DATABASE_READ_URL не задан'
+    reset_schema()
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute("INSERT INTO employees (login, password, name, role, status) VALUES ('lag', 'x', 'Lag', 'operator', 'online') RETURNING id")
+    operator_id = cur.fetchone()[0]
+    cur.execute("INSERT INTO chats (user_name, user_email, status, assigned_to) VALUES ('Lag', 'lag@example.com', 'assigned', %s) RETURNING id",
+                (operator_id,))
+    chat_id = cur.fetchone()[0]
+    conn.close()
+    wait_for_replica()
+
+    messages = load_handler('messages')
+    headers = staff_headers(operator_id, 'operator')
+    print(f"{'mode':<14} {'stale reads':>12} {'p50 ms':>8} {'p95 ms':>8}  pool checkouts")
+    for use_token in (False, True):
+        result = run(args.writes, use_token, messages, chat_id, headers)
+        print(f"{'with token' if use_token else 'no token':<14} {result['stale']:>5}/{args.writes:<6} "
+              f"{result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f}  {result['checkouts']}")
+
+
+if __name__ == '__main__':
+    main()
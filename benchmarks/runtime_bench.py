@@ -0,0 +1,107 @@
+'''
+Холодный старт и тёплый путь каждой функции без базы: импорт index.py и первый вызов в свежем процессе,
+затем p50 для OPTIONS, 405 и 401 без токена. --baseline <git-ревизия> меряет ту же таблицу для старого backend/
+(например, коммита до runtime.py), JSON_CODEC=stdlib - без orjson.
+Запуск: python benchmarks/runtime_bench.py --baseline HEAD~1
+'''
+import argparse
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict
+
+from common import BACKEND, ROOT, percentile
+
+FUNCTIONS = ['auth', 'chats', 'messages', 'employees', 'chat-history']
+EVENTS = {
+    'OPTIONS': {'httpMethod': 'OPTIONS'},
+    '405': {'httpMethod': 'DELETE'},
+    '401': {'httpMethod': 'GET', 'queryStringParameters': {}, 'headers': {}}
+}
+
+
+def child(backend: Path, function: str, requests: int) -> None:
+    started = time.perf_counter()
+    folder = backend / function
+    sys.path.insert(0, str(folder))
+    spec = importlib.util.spec_from_file_location('index', folder / 'index.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    imported = time.perf_counter()
+    module.handler(EVENTS['OPTIONS'], None)
+    result: Dict[str, Any] = {
+        'import_ms': (imported - started) * 1000,
+        'first_call_ms': (time.perf_counter() - imported) * 1000,
+        'psycopg2': 'psycopg2' in sys.modules
+    }
+    for name, event in EVENTS.items():
+        latencies = []
+        for _ in range(requests):
+            call_started = time.perf_counter()
+            module.handler(dict(event), None)
+            latencies.append(time.perf_counter() - call_started)
+        result[name] = percentile(latencies, 50) * 1e6
+    print(json.dumps(result))
+
+
+def measure(backend: Path, requests: int, runs: int) -> Dict[str, Dict[str, Any]]:
+    '''
+    Business: Запускает каждую функцию runs раз в новом процессе и берёт медиану холодных и тёплых замеров
+    '''
+    env = dict(os.environ, SESSION_SECRET=os.environ.get('SESSION_SECRET', 'benchmark-secret'))
+    table = {}
+    for function in FUNCTIONS:
+        samples = []
+        for _ in range(runs):
+            output = subprocess.run(
+                [sys.executable, __file__, '--child', str(backend), function, '--requests', str(requests)],
+                env=env, capture_output=True, text=True, check=True
+            ).stdout
+            samples.append(json.loads(output.splitlines()[-1]))
+        table[function] = {key: percentile([s[key] for s in samples], 50) for key in samples[0] if key != 'psycopg2'}
+        table[function]['psycopg2'] = samples[0]['psycopg2']
+    return table
+
+
+def print_table(title: str, table: Dict[str, Dict[str, Any]]) -> None:
+    print(title)
+    print(f"{'function':<14} {'import ms':>10} {'1st call ms':>12} {'psycopg2':>9} "
+          f"{'OPTIONS us':>11} {'405 us':>8} {'401 us':>8}")
+    for function, row in table.items():
+        print(f"{function:<14} {row['import_ms']:>10.2f} {row['first_call_ms']:>12.3f} {str(row['psycopg2']):>9} "
+              f"{row['OPTIONS']:>11.2f} {row['405']:>8.2f} {row['401']:>8.2f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--runs', type=int, default=7, help='свежих процессов на функцию')
+    parser.add_argument('--baseline', help='git-ревизия для сравнения')
+    parser.add_argument('--child', nargs=2, metavar=('BACKEND', 'FUNCTION'))
+    args = parser.parse_args()
+    if args.child:
+        child(Path(args.child[0]), args.child[1], args.requests)
+        return
+
+    print_table(f"working tree (JSON_CODEC={os.environ.get('JSON_CODEC', 'auto')})",
+                measure(BACKEND, args.requests, args.runs))
+    if args.baseline:
+        with tempfile.TemporaryDirectory() as tmp:
+            archive = subprocess.run(['git', 'archive', args.baseline, 'backend'], cwd=ROOT,
+                                     capture_output=True, check=True).stdout
+            with tempfile.TemporaryFile() as tar:
+                tar.write(archive)
+                tar.seek(0)
+                tarfile.open(fileobj=tar).extractall(tmp)
+            print()
+            print_table(f'baseline {args.baseline}', measure(Path(tmp) / 'backend', args.requests, args.runs))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+'''
+Латентность полнотекстового поиска messages GET ?q= на синтетическом корпусе в миллионы сообщений.
+Запуск: DATABASE_URL=postgresql://localhost/chat_bench python benchmarks/search_bench.py --messages 3000000
+'''
+import argparse
+import json
+import os
+import time
+
+import psycopg2
+
+from common import load_handler, percentile, reset_schema, staff_headers
+
+WORDS = [
+    'здравствуйте', 'заказ', 'доставка', 'оплата', 'курьер', 'возврат', 'карта', 'спасибо', 'помогите', 'статус',
+    'hello', 'order', 'delivery', 'payment', 'please', 'help', 'account', 'password', 'invoice', 'thanks'
+]
+
+
+def seed(cur, chats: int, messages: int, operators: int) -> None:
+    cur.execute("""
+        INSERT INTO employees (login, password, name, role, status)
+        SELECT 'operator' || g, 'x', 'Operator ' || g, 'operator', 'online' FROM generate_series(1, %s) AS g
+    """, (operators,))
+    cur.execute("""
+        INSERT INTO chats (user_name, user_email, status, assigned_to, created_at, is_closed, resolution_status)
+        SELECT 'user ' || g, 'user' || g || '@example.com', 'assigned',
+               (SELECT min(id) FROM employees WHERE role = 'operator') + g %% %s,
+               TIMESTAMP '2022-01-01' + g * INTERVAL '10 minutes', g %% 3 = 0,
+               CASE WHEN g %% 3 <> 0 THEN NULL WHEN g %% 2 = 0 THEN 'solved' ELSE 'unsolved' END
+        FROM generate_series(1, %s) AS g
+    """, (operators, chats))
+    for start in range(0, messages, 1000000):
+        stop = min(messages, start + 1000000)
+        cur.execute("""
+            INSERT INTO messages (chat_id, sender_type, message, created_at)
+            SELECT 1 + g %% %(chats)s, CASE WHEN g %% 2 = 0 THEN 'user' ELSE 'operator' END,
+                   (%(words)s::text[])[1 + g %% 20] || ' ' || (%(words)s::text[])[1 + (g / 7) %% 20] || ' ' ||
+                   (%(words)s::text[])[1 + (g / 49) %% 20] ||
+                   CASE WHEN g %% 1000 = 0 THEN ' refund ORD-' || g ELSE '' END ||
+                   CASE WHEN g %% 50000 = 0 THEN ' contact me at client' || g || '@mail.example' ELSE '' END,
+                   TIMESTAMP '2022-01-01' + g * INTERVAL '20 seconds'
+            FROM generate_series(%(start)s, %(stop)s - 1) AS g
+        """, {'chats': chats, 'words': WORDS, 'start': start, 'stop': stop})
+    cur.execute('ANALYZE')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=3000000)
+    parser.add_argument('--chats', type=int, default=200000)
+    parser.add_argument('--operators', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=30)
+    args = parser.parse_args()
+
+    reset_schema()
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True
+    cur = conn.cursor()
+    started = time.perf_counter()
+    seed(cur, args.chats, args.messages, args.operators)
+    print(f'seeded {args.messages} messages in {time.perf_counter() - started:.1f} s')
+    cur.execute("SELECT min(id) FROM employees WHERE role = 'operator'")
+    operator_id = cur.fetchone()[0]
+    cur.close()
+    conn.close()
+
+    handler = load_handler('messages')
+    admin = staff_headers()
+    operator = staff_headers(operator_id, 'operator')
+
+    def search(params, headers=admin):
+        response = handler({'httpMethod': 'GET', 'queryStringParameters': params, 'headers': headers}, None)
+        assert response['statusCode'] == 200, response
+        return json.loads(response['body'])
+
+    second_page = {'q': 'refund', 'limit': '20', 'cursor': search({'q': 'refund', 'limit': '20'})['next_cursor']}
+    cases = [
+        ('rare email', {'q': f'client{50000 * 7}@mail.example', 'limit': '20'}, admin),
+        ('order number', {'q': 'ORD-123000', 'limit': '20'}, admin),
+        ('refund, ranked', {'q': 'refund', 'limit': '20'}, admin),
+        ('refund, page 2', second_page, admin),
+        ('refund, recent', {'q': 'refund', 'limit': '20', 'sort': 'recent'}, admin),
+        ('refund + unsolved + dates', {'q': 'refund', 'limit': '20', 'resolution_status': 'unsolved',
+                                       'created_from': '2022-06-01', 'created_to': '2022-09-01'}, admin),
+        ('refund, operator scope', {'q': 'refund', 'limit': '20'}, operator),
+        ('common word, recent', {'q': 'order', 'limit': '20', 'sort': 'recent'}, admin),
+        ('common word, ranked', {'q': 'order', 'limit': '20'}, admin)
+    ]
+
+    print(f"{'query':<28} {'p50 ms':>9} {'p95 ms':>9} {'hits':>5}")
+    for title, params, headers in cases:
+        hits = len(search(params, headers)['results'])
+        latencies = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            search(params, headers)
+            latencies.append(time.perf_counter() - started)
+        print(f'{title:<28} {percentile(latencies, 50) * 1000:>9.2f} {percentile(latencies, 95) * 1000:>9.2f} {hits:>5}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+'''
+Память и латентность выдачи длинного чата: fetchall + dict + json.dumps против json_agg в Postgres.
+Запуск: DATABASE_URL=postgresql://localhost/chat_bench python benchmarks/serialization_bench.py
+'''
+import argparse
+import json
+import os
+import time
+import tracemalloc
+
+import psycopg2
+
+from common import load_handler, reset_schema, staff_headers
+
+QUERY = """
+    SELECT m.id, m.sender_type, m.message, m.created_at, e.name as sender_name
+    FROM messages m
+    LEFT JOIN employees e ON m.sender_id = e.id
+    WHERE m.chat_id = %s
+    ORDER BY m.id ASC
+"""
+
+
+def python_body(cur, chat_id: int) -> str:
+    cur.execute(QUERY, (chat_id,))
+    result = []
+    for msg in cur.fetchall():
+        result.append({
+            'id': msg[0],
+            'sender_type': msg[1],
+            'message': msg[2],
+            'created_at': msg[3].isoformat() if msg[3] else None,
+            'sender_name': msg[4]
+        })
+    return json.dumps(result)
+
+
+def measure(title: str, build) -> None:
+    tracemalloc.start()
+    started = time.perf_counter()
+    body = build()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{title:<28} {elapsed * 1000:>9.1f} ms  peak {peak / 2**20:>8.1f} MiB  body {len(body) / 2**20:.1f} MiB')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    args = parser.parse_args()
+
+    reset_schema()
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cur = conn.cursor()
+    cur.execute("INSERT INTO chats (user_name, user_email) VALUES ('Bench', 'bench@example.com') RETURNING id")
+    chat_id = cur.fetchone()[0]
+    cur.execute("""
+        INSERT INTO messages (chat_id, sender_type, message)
+        SELECT %s, 'user', 'Message number ' || g || ' with some typical support text about an order'
+        FROM generate_series(1, %s) AS g
+    """, (chat_id, args.rows))
+    conn.commit()
+
+    messages = load_handler('messages')
+    event = {'httpMethod': 'GET', 'queryStringParameters': {'chat_id': str(chat_id)}, 'headers': staff_headers()}
+    messages(event, None)
+
+    measure('fetchall + json.dumps', lambda: python_body(cur, chat_id))
+    measure('handler (json_agg)', lambda: messages(event, None)['body'])
+
+    cur.close()
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
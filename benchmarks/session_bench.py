@@ -0,0 +1,41 @@
+'''
+Стоимость проверки сессионного токена на запрос: подпись, срок и отзыв из тёплого кэша.
+Запуск: DATABASE_URL=postgresql://localhost/chat_bench python benchmarks/session_bench.py
+'''
+import argparse
+import time
+
+from common import reset_schema, staff_headers
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tokens', type=int, default=100000)
+    parser.add_argument('--revoked', type=int, default=1000)
+    args = parser.parse_args()
+
+    reset_schema()
+    token = staff_headers()['Authorization'][len('Bearer '):]
+    import sessions
+
+    sessions.decode_token(token)
+    for index in range(args.revoked):
+        sessions.denylist.add(f'revoked{index}')
+
+    started = time.perf_counter()
+    for _ in range(args.tokens):
+        assert sessions.decode_token(token) is not None
+    valid = time.perf_counter() - started
+
+    forged = token[:-4] + 'AAAA'
+    started = time.perf_counter()
+    for _ in range(args.tokens):
+        assert sessions.decode_token(forged) is None
+    invalid = time.perf_counter() - started
+
+    print(f'valid token:  {valid / args.tokens * 1e6:>8.2f} us per check')
+    print(f'forged token: {invalid / args.tokens * 1e6:>8.2f} us per check')
+
+
+if __name__ == '__main__':
+    main()
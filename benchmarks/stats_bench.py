@@ -0,0 +1,177 @@
+'''
+Аналитика операторов: employees GET ?view=stats из operator_daily_stats против подсчёта тех же метрик
+по chats/messages/chat_history на лету, плюс время пересчёта stats_backfill_handler.
+Сначала проверяется сам пересчёт: живой трафик через chats/messages пишет сегодняшние инкременты, данные сдвигаются
+на день назад, и stats_backfill_handler за вчера обязан получить те же строки, а view=stats - их отдать.
+Запуск: DATABASE_URL=postgresql://localhost/chat_bench python benchmarks/stats_bench.py --chats 500000
+'''
+import argparse
+import json
+import os
+import time
+from datetime import date, timedelta
+
+import psycopg2
+
+from common import load_handler, percentile, reset_schema, staff_headers
+
+STATS_COLUMNS = ('chats_created', 'chats_closed', 'solved', 'unsolved', 'first_responses',
+                 'first_response_seconds', 'handle_seconds')
+
+ON_THE_FLY = """
+    SELECT c.created_at::date, c.assigned_to,
+           count(*) FILTER (WHERE c.resolution_status = 'solved'),
+           count(*) FILTER (WHERE c.resolution_status = 'unsolved'),
+           avg(EXTRACT(EPOCH FROM f.first_at - c.created_at))
+    FROM chats c
+    LEFT JOIN LATERAL (
+        SELECT min(created_at) AS first_at FROM messages
+        WHERE chat_id = c.id AND sender_type = 'operator'
+    ) f ON TRUE
+    WHERE c.created_at >= %s::date - 29
+    GROUP BY 1, 2
+"""
+
+
+def seed(cur, chats: int, operators: int) -> None:
+    cur.execute("""
+        INSERT INTO employees (login, password, name, role, status)
+        SELECT 'operator' || g, 'x', 'Operator ' || g, 'operator', 'online' FROM generate_series(1, %s) AS g
+    """, (operators,))
+    cur.execute("""
+        INSERT INTO chats (user_name, user_email, status, assigned_to, created_at, is_closed, resolution_status)
+        SELECT 'user ' || g, 'user' || g || '@example.com', 'closed',
+               (SELECT min(id) FROM employees WHERE role = 'operator') + g %% %s,
+               CURRENT_DATE - 365 + g * (365.0 / %s) * INTERVAL '1 day', TRUE,
+               CASE WHEN g %% 4 = 0 THEN 'unsolved' ELSE 'solved' END
+        FROM generate_series(1, %s) AS g
+    """, (operators, chats, chats))
+    cur.execute("""
+        INSERT INTO chat_history (chat_id, action, details, employee_id, created_at)
+        SELECT id, 'created', 'New chat created', assigned_to, created_at FROM chats
+        UNION ALL
+        SELECT id, 'closed', 'Chat closed as ' || resolution_status, assigned_to, created_at + INTERVAL '25 minutes'
+        FROM chats
+    """)
+    cur.execute("""
+        INSERT INTO messages (chat_id, sender_type, sender_id, message, created_at)
+        SELECT c.id, CASE WHEN g = 1 THEN 'user' ELSE 'operator' END, CASE WHEN g = 1 THEN NULL ELSE c.assigned_to END,
+               'message ' || g, c.created_at + g * INTERVAL '90 seconds'
+        FROM chats c, generate_series(1, 6) AS g
+    """)
+    cur.execute('ANALYZE')
+
+
+def daily_rows(cur) -> dict:
+    cur.execute(f"SELECT day, employee_id, {', '.join(STATS_COLUMNS)} FROM operator_daily_stats")
+    return {(row[0], row[1]): row[2:] for row in cur.fetchall()}
+
+
+def check_backfill(cur, chats: int) -> None:
+    '''
+    Business: Сравнивает строки пересчёта со строками, которые за тот же трафик накопили инкременты функций
+    '''
+    reset_schema()
+    cur.execute("""
+        INSERT INTO employees (login, password, name, role, status)
+        VALUES ('op1', 'x', 'Operator 1', 'operator', 'online'), ('op2', 'x', 'Operator 2', 'operator', 'online')
+        RETURNING id
+    """)
+    operators = [row[0] for row in cur.fetchall()]
+    chats_handler = load_handler('chats')
+    messages_handler = load_handler('messages')
+    for index in range(chats):
+        created = chats_handler({'httpMethod': 'POST', 'body': json.dumps({
+            'user_name': f'user {index}', 'user_email': f'user{index}@example.com', 'message': 'Hello'})}, None)
+        assert created['statusCode'] == 201, created
+        chat_id = json.loads(created['body'])['chat_id']
+        cur.execute('SELECT assigned_to FROM chats WHERE id = %s', (chat_id,))
+        operator = staff_headers(cur.fetchone()[0] or operators[0], 'operator')
+        if index % 5:
+            for text in ('Hi, looking into it', 'Done'):
+                sent = messages_handler({'httpMethod': 'POST', 'headers': operator,
+                                         'body': json.dumps({'chat_id': chat_id, 'sender_type': 'operator',
+                                                             'message': text})}, None)
+                assert sent['statusCode'] == 201, sent
+        if index % 3:
+            closed = chats_handler({'httpMethod': 'PUT', 'headers': operator, 'body': json.dumps({
+                'chat_id': chat_id, 'action': 'close', 'resolution_status': 'solved' if index % 2 else 'unsolved'})}, None)
+            assert closed['statusCode'] == 200, closed
+
+    cur.execute("UPDATE chats SET created_at = created_at - INTERVAL '1 day', updated_at = updated_at - INTERVAL '1 day', "
+                "first_response_at = first_response_at - INTERVAL '1 day'")
+    for table in ('messages', 'chat_history'):
+        cur.execute(f"UPDATE {table} SET created_at = created_at - INTERVAL '1 day'")
+    cur.execute('UPDATE operator_daily_stats SET day = day - 1')
+    live = daily_rows(cur)
+    cur.execute("SELECT id, first_response_at FROM chats ORDER BY id")
+    live_marks = cur.fetchall()
+    cur.execute("UPDATE chats SET first_response_at = NULL")
+    cur.execute("DELETE FROM operator_daily_stats")
+
+    yesterday = str(date.today() - timedelta(days=1))
+    result = load_handler('employees', 'stats_backfill_handler')({'from': yesterday, 'to': yesterday}, None)
+    backfilled = daily_rows(cur)
+    cur.execute("SELECT id, first_response_at FROM chats ORDER BY id")
+    assert cur.fetchall() == live_marks, 'backfilled first_response_at differs from the live messages POST marks'
+    assert result['stats_rows'] == len(live), (result, live)
+    assert backfilled.keys() == live.keys(), (backfilled, live)
+    for key, values in live.items():
+        assert all(abs(a - b) < 1e-6 for a, b in zip(values, backfilled[key])), (key, values, backfilled[key])
+
+    response = load_handler('employees')({'httpMethod': 'GET', 'headers': staff_headers(),
+                                          'queryStringParameters': {'view': 'stats', 'from': yesterday, 'to': yesterday}}, None)
+    assert response['statusCode'] == 200, response
+    days = json.loads(response['body'])['days']
+    assert sum(day['chats_created'] for day in days) == chats, days
+    print(f"backfill check ok: {len(live)} rows for {chats} chats match the live increments, "
+          f"{result['first_responses_marked']} first responses marked")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chats', type=int, default=500000)
+    parser.add_argument('--operators', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument('--check-chats', type=int, default=60, help='чатов живого трафика для проверки пересчёта')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True
+    cur = conn.cursor()
+    check_backfill(cur, args.check_chats)
+
+    reset_schema()
+    seed(cur, args.chats, args.operators)
+
+    started = time.perf_counter()
+    result = load_handler('employees', 'stats_backfill_handler')({}, None)
+    print(f"backfill: {result['stats_rows']} rows in {time.perf_counter() - started:.2f} s")
+
+    handler = load_handler('employees')
+    event = {'httpMethod': 'GET', 'queryStringParameters': {'view': 'stats'}, 'headers': staff_headers()}
+
+    def from_rollups():
+        response = handler(event, None)
+        assert response['statusCode'] == 200, response
+        return len(json.loads(response['body'])['days'])
+
+    def on_the_fly():
+        cur.execute(ON_THE_FLY, (time.strftime('%Y-%m-%d'),))
+        return len(cur.fetchall())
+
+    print(f"{'last 30 days':<24} {'p50 ms':>9} {'p95 ms':>9} {'rows':>6}")
+    for title, call in (('rollups (view=stats)', from_rollups), ('on the fly', on_the_fly)):
+        rows = call()
+        latencies = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            call()
+            latencies.append(time.perf_counter() - started)
+        print(f'{title:<24} {percentile(latencies, 50) * 1000:>9.2f} {percentile(latencies, 95) * 1000:>9.2f} {rows:>6}')
+    cur.close()
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+'''
+Проверка курсора updated_after в chats GET: транзакция, начатая раньше чужой, но закоммиченная после ответа
+клиенту, получает updated_at меньше выданного курсора. Следующий опрос с этим курсором обязан её вернуть
+(окно CHATS_UPDATED_OVERLAP_SECONDS), а long-poll без изменений новее курсора - ждать, а не отвечать сразу.
+Запуск: DATABASE_URL=postgresql://localhost/chat_bench python benchmarks/updated_after_overlap.py
+'''
+import json
+import os
+import time
+from typing import Any, Callable, Dict, List
+
+import psycopg2
+
+from common import load_handler, reset_schema, staff_headers
+
+
+def poll(chats: Callable, cursor: str, wait: int = 0) -> Dict[str, Any]:
+    params = {'updated_after': cursor, 'wait': str(wait)}
+    response = chats({'httpMethod': 'GET', 'headers': staff_headers(), 'queryStringParameters': params}, None)
+    assert response['statusCode'] == 200, response
+    return json.loads(response['body'])
+
+
+def ids(page: Dict[str, Any]) -> List[int]:
+    return sorted(chat['id'] for chat in page['chats'])
+
+
+def names(page: Dict[str, Any]) -> List[str]:
+    return sorted(chat['user_name'] for chat in page['chats'])
+
+
+def main() -> None:
+    reset_schema()
+    chats = load_handler('chats')
+    created = chats({'httpMethod': 'POST', 'headers': {},
+                     'body': json.dumps({'user_name': 'Late', 'message': 'Hello'})}, None)
+    late_id = json.loads(created['body'])['chat_id']
+    cursor = poll(chats, '2000-01-01T00:00:00')['cursor']
+
+    late = psycopg2.connect(os.environ['DATABASE_URL'])
+    late_cur = late.cursor()
+    late_cur.execute("UPDATE chats SET user_name = 'Late commit', updated_at = CURRENT_TIMESTAMP WHERE id = %s",
+                     (late_id,))
+    time.sleep(0.1)
+    created = chats({'httpMethod': 'POST', 'headers': {},
+                     'body': json.dumps({'user_name': 'Early', 'message': 'Hello'})}, None)
+    early_id = json.loads(created['body'])['chat_id']
+    page = poll(chats, cursor)
+    assert early_id in ids(page) and 'Late commit' not in names(page), page
+    cursor = page['cursor']
+    late.commit()
+    late.close()
+
+    page = poll(chats, cursor)
+    assert 'Late commit' in names(page), f'late commit {late_id} is behind cursor {cursor}: {page}'
+    assert max(page['cursor'], cursor) == page['cursor']
+    print(f"{'late commit behind the cursor':<34} ok: {names(page)} after {cursor}")
+
+    started = time.perf_counter()
+    page = poll(chats, page['cursor'], wait=2)
+    waited = time.perf_counter() - started
+    assert waited >= 1.5, f'long-poll answered after {waited:.2f}s with only overlap rows'
+    print(f"{'long-poll with only overlap rows':<34} ok: waited {waited:.2f}s, {len(page['chats'])} repeated")
+
+
+if __name__ == '__main__':
+    main()
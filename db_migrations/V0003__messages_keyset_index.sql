@@ -0,0 +1,2 @@
+-- Composite index for keyset pagination of messages inside a chat
+CREATE INDEX IF NOT EXISTS idx_messages_chat_id_id ON messages (chat_id, id);
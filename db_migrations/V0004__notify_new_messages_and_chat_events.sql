@@ -0,0 +1,31 @@
+-- Wake long-poll requests on new messages: payload is chat_id
+CREATE OR REPLACE FUNCTION notify_message_inserted() RETURNS trigger AS $$
+BEGIN
+  PERFORM pg_notify('chat_messages', NEW.chat_id::text);
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS messages_notify_inserted ON messages;
+CREATE TRIGGER messages_notify_inserted
+AFTER INSERT ON messages
+FOR EACH ROW EXECUTE PROCEDURE notify_message_inserted();
+
+-- Wake long-poll requests on chat changes: payload is the affected operator id ('' for unassigned chats)
+CREATE OR REPLACE FUNCTION notify_chat_changed() RETURNS trigger AS $$
+BEGIN
+  PERFORM pg_notify('chat_events', COALESCE(NEW.assigned_to::text, ''));
+  IF TG_OP = 'UPDATE' AND OLD.assigned_to IS DISTINCT FROM NEW.assigned_to THEN
+    PERFORM pg_notify('chat_events', COALESCE(OLD.assigned_to::text, ''));
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS chats_notify_changed ON chats;
+CREATE TRIGGER chats_notify_changed
+AFTER INSERT OR UPDATE ON chats
+FOR EACH ROW EXECUTE PROCEDURE notify_chat_changed();
+
+-- Long-poll lookups by change time
+CREATE INDEX IF NOT EXISTS idx_chats_updated_at ON chats (updated_at);
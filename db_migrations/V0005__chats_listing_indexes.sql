@@ -0,0 +1,10 @@
+-- Keyset pagination of the chat list: ORDER BY is_closed, created_at DESC, id DESC
+CREATE INDEX IF NOT EXISTS idx_chats_listing ON chats (is_closed, created_at DESC, id DESC);
+
+-- Same order scoped to one operator (operator view and admin assigned_to filter)
+CREATE INDEX IF NOT EXISTS idx_chats_assigned_listing ON chats (assigned_to, is_closed, created_at DESC, id DESC);
+
+-- Admin filters by lifecycle status and resolution
+CREATE INDEX IF NOT EXISTS idx_chats_status_listing ON chats (status, is_closed, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_chats_resolution_listing ON chats (resolution_status, created_at DESC, id DESC)
+  WHERE resolution_status IS NOT NULL;
@@ -0,0 +1,3 @@
+-- Rotation point for operator assignment (round-robin and least-open tie-break)
+ALTER TABLE employees
+ADD COLUMN IF NOT EXISTS last_assigned_at TIMESTAMP;
@@ -0,0 +1,55 @@
+-- Open chats per operator, maintained by trigger on chats
+CREATE TABLE IF NOT EXISTS operator_load (
+  employee_id INTEGER PRIMARY KEY REFERENCES employees(id),
+  open_chats INTEGER NOT NULL DEFAULT 0
+);
+
+-- Single-row waiting queue depth (open chats with status 'waiting')
+CREATE TABLE IF NOT EXISTS chat_queue (
+  id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+  waiting_chats INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE OR REPLACE FUNCTION track_chat_counters() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'UPDATE' THEN
+    IF OLD.is_closed IS NOT DISTINCT FROM NEW.is_closed
+       AND OLD.assigned_to IS NOT DISTINCT FROM NEW.assigned_to
+       AND OLD.status IS NOT DISTINCT FROM NEW.status THEN
+      RETURN NEW;
+    END IF;
+    IF NOT COALESCE(OLD.is_closed, FALSE) AND OLD.assigned_to IS NOT NULL THEN
+      UPDATE operator_load SET open_chats = open_chats - 1 WHERE employee_id = OLD.assigned_to;
+    END IF;
+    IF NOT COALESCE(OLD.is_closed, FALSE) AND OLD.status = 'waiting' THEN
+      UPDATE chat_queue SET waiting_chats = waiting_chats - 1 WHERE id;
+    END IF;
+  END IF;
+
+  IF NOT COALESCE(NEW.is_closed, FALSE) AND NEW.assigned_to IS NOT NULL THEN
+    INSERT INTO operator_load (employee_id, open_chats) VALUES (NEW.assigned_to, 1)
+    ON CONFLICT (employee_id) DO UPDATE SET open_chats = operator_load.open_chats + 1;
+  END IF;
+  IF NOT COALESCE(NEW.is_closed, FALSE) AND NEW.status = 'waiting' THEN
+    INSERT INTO chat_queue (id, waiting_chats) VALUES (TRUE, 1)
+    ON CONFLICT (id) DO UPDATE SET waiting_chats = chat_queue.waiting_chats + 1;
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS chats_track_counters ON chats;
+CREATE TRIGGER chats_track_counters
+AFTER INSERT OR UPDATE ON chats
+FOR EACH ROW EXECUTE PROCEDURE track_chat_counters();
+
+-- Backfill from existing chats
+INSERT INTO operator_load (employee_id, open_chats)
+SELECT assigned_to, count(*) FROM chats
+WHERE assigned_to IS NOT NULL AND is_closed IS NOT TRUE
+GROUP BY assigned_to
+ON CONFLICT (employee_id) DO UPDATE SET open_chats = EXCLUDED.open_chats;
+
+INSERT INTO chat_queue (id, waiting_chats)
+SELECT TRUE, count(*) FROM chats WHERE status = 'waiting' AND is_closed IS NOT TRUE
+ON CONFLICT (id) DO UPDATE SET waiting_chats = EXCLUDED.waiting_chats;
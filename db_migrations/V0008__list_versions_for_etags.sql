@@ -0,0 +1,32 @@
+-- Version counters for conditional GET (ETag) of mutable lists.
+-- Bumped by deferred triggers right before commit, so the counter changes in commit order
+-- and the row lock is held only for the commit itself.
+CREATE TABLE IF NOT EXISTS list_versions (
+  scope VARCHAR(50) PRIMARY KEY,
+  version BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO list_versions (scope, version) VALUES ('chats', 0), ('employees', 0)
+ON CONFLICT (scope) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_list_version() RETURNS trigger AS $$
+BEGIN
+  UPDATE list_versions SET version = version + 1 WHERE scope = TG_ARGV[0];
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS chats_bump_list_version ON chats;
+CREATE CONSTRAINT TRIGGER chats_bump_list_version
+AFTER INSERT OR UPDATE ON chats
+DEFERRABLE INITIALLY DEFERRED
+FOR EACH ROW EXECUTE PROCEDURE bump_list_version('chats');
+
+DROP TRIGGER IF EXISTS employees_bump_list_version ON employees;
+CREATE CONSTRAINT TRIGGER employees_bump_list_version
+AFTER INSERT OR UPDATE ON employees
+DEFERRABLE INITIALLY DEFERRED
+FOR EACH ROW EXECUTE PROCEDURE bump_list_version('employees');
+
+-- Insert-only history gets its version from count/max(id) per chat
+CREATE INDEX IF NOT EXISTS idx_chat_history_chat_id_id ON chat_history (chat_id, id);
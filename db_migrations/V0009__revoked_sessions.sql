@@ -0,0 +1,7 @@
+-- Denylist of revoked session tokens; rows are useless after the token expires
+CREATE TABLE IF NOT EXISTS revoked_sessions (
+  token_id VARCHAR(64) PRIMARY KEY,
+  expires_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_revoked_sessions_expires_at ON revoked_sessions (expires_at);
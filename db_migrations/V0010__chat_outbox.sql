@@ -0,0 +1,22 @@
+-- Transactional outbox: side effects of chat/message changes are recorded in the same transaction
+-- and delivered asynchronously by chats/index.outbox_handler
+CREATE TABLE IF NOT EXISTS chat_outbox (
+  id BIGSERIAL PRIMARY KEY,
+  event_type VARCHAR(50) NOT NULL,
+  chat_id INTEGER,
+  payload JSONB NOT NULL DEFAULT '{}'::jsonb,
+  attempts INTEGER NOT NULL DEFAULT 0,
+  available_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  processed_at TIMESTAMP,
+  failed_at TIMESTAMP,
+  last_error TEXT,
+  created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Worker claims: only pending events, in availability order
+CREATE INDEX IF NOT EXISTS idx_chat_outbox_pending ON chat_outbox (available_at, id)
+WHERE processed_at IS NULL AND failed_at IS NULL;
+
+-- Retention cleanup
+CREATE INDEX IF NOT EXISTS idx_chat_outbox_processed_at ON chat_outbox (processed_at)
+WHERE processed_at IS NOT NULL;
@@ -0,0 +1,7 @@
+-- Full-text search over message bodies. The 'simple' configuration keeps tokens as written
+-- (no stemming), so order numbers, emails and mixed Russian/English text are all searchable.
+-- Adding a stored generated column rewrites messages once.
+ALTER TABLE messages
+ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (to_tsvector('simple', message)) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_messages_search_vector ON messages USING GIN (search_vector);
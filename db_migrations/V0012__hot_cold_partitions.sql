@@ -0,0 +1,87 @@
+-- Hot/cold split of messages and chat_history: LIST partitions on an archived flag.
+-- Open and recently closed chats live in the small *_hot partitions; chats/index.archive_handler
+-- moves closed chats older than ARCHIVE_AFTER_DAYS to *_cold. Handlers keep querying the parent tables.
+
+-- messages
+ALTER TABLE messages RENAME TO messages_legacy;
+ALTER INDEX messages_pkey RENAME TO messages_legacy_pkey;
+DROP INDEX IF EXISTS idx_messages_chat_id_id;
+DROP INDEX IF EXISTS idx_messages_search_vector;
+
+CREATE TABLE messages (
+  id INTEGER NOT NULL DEFAULT nextval('messages_id_seq'),
+  chat_id INTEGER NOT NULL REFERENCES chats(id),
+  sender_type VARCHAR(50) NOT NULL CHECK (sender_type IN ('user', 'operator')),
+  sender_id INTEGER REFERENCES employees(id),
+  message TEXT NOT NULL,
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  archived BOOLEAN NOT NULL DEFAULT FALSE,
+  search_vector tsvector GENERATED ALWAYS AS (to_tsvector('simple', message)) STORED,
+  PRIMARY KEY (id, archived)
+) PARTITION BY LIST (archived);
+
+CREATE TABLE messages_hot PARTITION OF messages FOR VALUES IN (FALSE);
+CREATE TABLE messages_cold PARTITION OF messages FOR VALUES IN (TRUE);
+
+INSERT INTO messages (id, chat_id, sender_type, sender_id, message, created_at)
+SELECT id, chat_id, sender_type, sender_id, message, created_at FROM messages_legacy;
+
+ALTER SEQUENCE messages_id_seq OWNED BY messages.id;
+DROP TABLE messages_legacy;
+
+CREATE INDEX IF NOT EXISTS idx_messages_chat_id_id ON messages (chat_id, id);
+CREATE INDEX IF NOT EXISTS idx_messages_search_vector ON messages USING GIN (search_vector);
+
+CREATE TRIGGER messages_notify_inserted
+AFTER INSERT ON messages
+FOR EACH ROW EXECUTE PROCEDURE notify_message_inserted();
+
+-- chat_history
+ALTER TABLE chat_history RENAME TO chat_history_legacy;
+ALTER INDEX chat_history_pkey RENAME TO chat_history_legacy_pkey;
+DROP INDEX IF EXISTS idx_chat_history_chat_id_id;
+
+CREATE TABLE chat_history (
+  id INTEGER NOT NULL DEFAULT nextval('chat_history_id_seq'),
+  chat_id INTEGER NOT NULL REFERENCES chats(id),
+  action VARCHAR(100) NOT NULL,
+  details TEXT,
+  employee_id INTEGER REFERENCES employees(id),
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  archived BOOLEAN NOT NULL DEFAULT FALSE,
+  PRIMARY KEY (id, archived)
+) PARTITION BY LIST (archived);
+
+CREATE TABLE chat_history_hot PARTITION OF chat_history FOR VALUES IN (FALSE);
+CREATE TABLE chat_history_cold PARTITION OF chat_history FOR VALUES IN (TRUE);
+
+INSERT INTO chat_history (id, chat_id, action, details, employee_id, created_at)
+SELECT id, chat_id, action, details, employee_id, created_at FROM chat_history_legacy;
+
+ALTER SEQUENCE chat_history_id_seq OWNED BY chat_history.id;
+DROP TABLE chat_history_legacy;
+
+CREATE INDEX IF NOT EXISTS idx_chat_history_chat_id_id ON chat_history (chat_id, id);
+
+-- Archival bookkeeping on chats; the partial index keeps the archival job's scan to candidates only
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS archived_at TIMESTAMP;
+
+CREATE INDEX IF NOT EXISTS idx_chats_archive_candidates ON chats (updated_at)
+  WHERE is_closed = TRUE AND archived_at IS NULL;
+
+-- Reopening an archived chat (chats POST) brings its messages and history back to the hot partitions
+CREATE OR REPLACE FUNCTION restore_archived_chat() RETURNS trigger AS $$
+BEGIN
+  IF OLD.archived_at IS NOT NULL AND NOT NEW.is_closed THEN
+    UPDATE messages SET archived = FALSE WHERE chat_id = NEW.id AND archived = TRUE;
+    UPDATE chat_history SET archived = FALSE WHERE chat_id = NEW.id AND archived = TRUE;
+    NEW.archived_at := NULL;
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS chats_restore_archived ON chats;
+CREATE TRIGGER chats_restore_archived
+BEFORE UPDATE ON chats
+FOR EACH ROW EXECUTE PROCEDURE restore_archived_chat();
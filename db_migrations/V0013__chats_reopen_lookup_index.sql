@@ -0,0 +1,3 @@
+-- chats POST looks up the client's latest closed unsolved chat to reopen it
+CREATE INDEX IF NOT EXISTS idx_chats_reopen_lookup ON chats (user_email, updated_at DESC)
+  WHERE is_closed = TRUE AND resolution_status = 'unsolved';
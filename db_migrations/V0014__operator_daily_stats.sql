@@ -0,0 +1,28 @@
+-- Incremental analytics rollups per operator per day, fed by chats POST (created), messages POST
+-- (first operator reply) and chats PUT (close). employee_id 0 collects chats created without an operator.
+CREATE TABLE IF NOT EXISTS operator_daily_stats (
+  day DATE NOT NULL,
+  employee_id INTEGER NOT NULL,
+  chats_created INTEGER NOT NULL DEFAULT 0,
+  chats_closed INTEGER NOT NULL DEFAULT 0,
+  solved INTEGER NOT NULL DEFAULT 0,
+  unsolved INTEGER NOT NULL DEFAULT 0,
+  first_responses INTEGER NOT NULL DEFAULT 0,
+  first_response_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+  handle_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+  PRIMARY KEY (day, employee_id)
+);
+
+-- Marks the first operator reply so it is counted once per chat
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS first_response_at TIMESTAMP;
+
+-- Backfill from existing messages with the live rule (first operator message by id), so the first reply after
+-- deploy in an already answered chat is not counted as its first response
+UPDATE chats c SET first_response_at = f.created_at
+FROM (
+  SELECT DISTINCT ON (chat_id) chat_id, created_at
+  FROM messages
+  WHERE sender_type = 'operator' AND sender_id IS NOT NULL
+  ORDER BY chat_id, id
+) f
+WHERE c.id = f.chat_id AND c.first_response_at IS NULL;
@@ -0,0 +1,16 @@
+-- Idempotency-Key for chats POST and messages POST: the first response per (scope, key) is replayed to retries
+-- until expires_at. A key is claimed in the same transaction as the inserts it guards, so a concurrent duplicate
+-- waits on the unique index and then reads the stored response
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+  scope VARCHAR(32) NOT NULL,
+  key VARCHAR(255) NOT NULL,
+  request_hash BYTEA NOT NULL,
+  status_code SMALLINT,
+  response TEXT,
+  expires_at TIMESTAMP NOT NULL
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_idempotency_keys_scope_key ON idempotency_keys (scope, key);
+
+-- Expiry cleanup (chats/index.outbox_handler)
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires_at ON idempotency_keys (expires_at);
@@ -0,0 +1,42 @@
+-- list_versions without a single hot row: each scope is split into 16 slots and a transaction bumps the slot
+-- picked by its xid, so concurrent commits rarely wait on the same row lock. The version is the sum of the
+-- slots; bumps stay deferred to commit, so a reader that sees the new sum also sees the committed rows.
+ALTER TABLE list_versions ADD COLUMN IF NOT EXISTS slot SMALLINT NOT NULL DEFAULT 0;
+ALTER TABLE list_versions DROP CONSTRAINT IF EXISTS list_versions_pkey;
+ALTER TABLE list_versions ADD PRIMARY KEY (scope, slot);
+
+INSERT INTO list_versions (scope, slot, version)
+SELECT s.scope, g, 0
+FROM (VALUES ('chats'), ('employees')) AS s (scope)
+CROSS JOIN generate_series(0, 15) AS g
+ON CONFLICT (scope, slot) DO NOTHING;
+
+-- One bump per scope per transaction: the first deferred row event marks the transaction, the rest return
+CREATE OR REPLACE FUNCTION bump_list_version() RETURNS trigger AS $$
+DECLARE
+  flag TEXT := 'list_versions.bumped_' || TG_ARGV[0];
+BEGIN
+  IF current_setting(flag, TRUE) = 'on' THEN
+    RETURN NULL;
+  END IF;
+  PERFORM set_config(flag, 'on', TRUE);
+  UPDATE list_versions SET version = version + 1
+  WHERE scope = TG_ARGV[0] AND slot = txid_current() % 16;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Only columns that list responses show bump the version: archival, first_response_at and
+-- last_assigned_at or password rehash updates leave cached lists valid
+DROP TRIGGER IF EXISTS chats_bump_list_version ON chats;
+CREATE CONSTRAINT TRIGGER chats_bump_list_version
+AFTER INSERT OR DELETE OR UPDATE OF user_name, user_email, status, assigned_to, is_closed, resolution_status, updated_at
+ON chats
+DEFERRABLE INITIALLY DEFERRED
+FOR EACH ROW EXECUTE PROCEDURE bump_list_version('chats');
+
+DROP TRIGGER IF EXISTS employees_bump_list_version ON employees;
+CREATE CONSTRAINT TRIGGER employees_bump_list_version
+AFTER INSERT OR DELETE OR UPDATE OF login, name, role, status ON employees
+DEFERRABLE INITIALLY DEFERRED
+FOR EACH ROW EXECUTE PROCEDURE bump_list_version('employees');
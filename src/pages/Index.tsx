@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card';
 import { Button } from '@/components/ui/button';
 import { Input } from '@/components/ui/input';
@@ -15,6 +15,13 @@ const CHATS_URL = `${API_BASE}/4aa94d3b-a429-4dfe-a6e5-329b8b09d317`;
 const MESSAGES_URL = `${API_BASE}/fd8314a4-0d2b-4636-b3c6-afd2ab8750de`;
 const EMPLOYEES_URL = `${API_BASE}/2a92d690-5999-45f3-854b-5ed8accefa75`;
 const HISTORY_URL = `${API_BASE}/d1128593-3ef8-4ab8-a946-44fabaadb4d9`;
+const CHATS_PAGE_SIZE = 50;
+const CHAT_STATUS_FILTERS = [
+  { value: '', label: 'Все' },
+  { value: 'waiting', label: 'Ожидают' },
+  { value: 'assigned', label: 'В работе' },
+  { value: 'closed', label: 'Закрытые' }
+];
 
 interface Employee {
   id: number;
@@ -22,6 +29,7 @@ interface Employee {
   name: string;
   role: string;
   status: string;
+  token?: string;
 }
 
 interface Chat {
@@ -55,12 +63,15 @@ interface Message {
 export default function Index() {
   const [view, setView] = useState<'user' | 'login' | 'operator' | 'admin'>('user');
   const [currentUser, setCurrentUser] = useState<Employee | null>(null);
+  const readAfter = useRef<string | null>(null);
   
   const [loginForm, setLoginForm] = useState({ login: '', password: '' });
   const [userChatForm, setUserChatForm] = useState({ name: '', email: '', message: '' });
   
   const [employees, setEmployees] = useState<Employee[]>([]);
   const [chats, setChats] = useState<Chat[]>([]);
+  const [chatsCursor, setChatsCursor] = useState<string | null>(null);
+  const [chatStatus, setChatStatus] = useState('');
   const [selectedChat, setSelectedChat] = useState<Chat | null>(null);
   const [messages, setMessages] = useState<Message[]>([]);
   const [newMessage, setNewMessage] = useState('');
@@ -78,36 +89,74 @@ export default function Index() {
 
   useEffect(() => {
     if (selectedChat) {
-      loadMessages(selectedChat.id);
-      loadHistory(selectedChat.id);
+      openChat(selectedChat.id);
     }
   }, [selectedChat]);
 
-  const loadHistory = async (chatId: number) => {
-    const res = await fetch(`${HISTORY_URL}?chat_id=${chatId}`);
+  const authHeaders = (token = currentUser?.token): Record<string, string> => ({
+    'Content-Type': 'application/json',
+    Authorization: `Bearer ${token}`,
+    ...(readAfter.current ? { 'X-Read-After': readAfter.current } : {})
+  });
+
+  const rememberWrite = (res: Response) => {
+    const token = res.headers.get('X-Read-After');
+    if (token) readAfter.current = token;
+  };
+
+  const postIdempotent = async (url: string, headers: Record<string, string>, body: unknown, attempts = 3) => {
+    const idempotencyKey = crypto.randomUUID();
+    for (let attempt = 1; ; attempt++) {
+      try {
+        const res = await fetch(url, {
+          method: 'POST',
+          headers: { ...headers, 'Idempotency-Key': idempotencyKey },
+          body: JSON.stringify(body)
+        });
+        if (res.status < 502 || attempt >= attempts) return res;
+      } catch (error) {
+        if (attempt >= attempts) throw error;
+      }
+      await new Promise(resolve => setTimeout(resolve, 500 * attempt));
+    }
+  };
+
+  const openChat = async (chatId: number) => {
+    const res = await fetch(`${HISTORY_URL}?chat_id=${chatId}&view=open`, { headers: authHeaders() });
     const data = await res.json();
-    setHistory(data);
+    setMessages(data.messages);
+    setHistory(data.history);
   };
 
   const loadEmployees = async () => {
-    const res = await fetch(EMPLOYEES_URL);
+    const res = await fetch(EMPLOYEES_URL, { headers: authHeaders() });
     const data = await res.json();
     setEmployees(data);
   };
 
-  const loadChats = async () => {
-    const url = currentUser?.role === 'operator' 
-      ? `${CHATS_URL}?operator_id=${currentUser.id}&role=operator`
-      : CHATS_URL;
-    const res = await fetch(url);
+  const loadChats = async (cursor: string | null = null, status = chatStatus) => {
+    const params = new URLSearchParams({ limit: String(CHATS_PAGE_SIZE) });
+    if (status) params.set('status', status);
+    if (cursor) params.set('cursor', cursor);
+    const res = await fetch(`${CHATS_URL}?${params}`, { headers: authHeaders() });
     const data = await res.json();
-    setChats(data);
+    setChats(prev => {
+      if (!cursor) return data.chats;
+      const loaded = new Set(prev.map(chat => chat.id));
+      return [...prev, ...data.chats.filter((chat: Chat) => !loaded.has(chat.id))];
+    });
+    setChatsCursor(data.next_cursor);
+  };
+
+  const filterChats = (status: string) => {
+    setChatStatus(status);
+    loadChats(null, status);
   };
 
-  const loadMessages = async (chatId: number) => {
-    const res = await fetch(`${MESSAGES_URL}?chat_id=${chatId}`);
+  const loadNewMessages = async (chatId: number, afterId: number) => {
+    const res = await fetch(`${MESSAGES_URL}?chat_id=${chatId}&after_id=${afterId}&limit=200`, { headers: authHeaders() });
     const data = await res.json();
-    setMessages(data);
+    setMessages(prev => [...prev, ...data.messages]);
   };
 
   const handleLogin = async (e: React.FormEvent) => {
@@ -124,11 +173,11 @@ export default function Index() {
         setCurrentUser(user);
         setView(user.role === 'admin' ? 'admin' : 'operator');
         
-        await fetch(EMPLOYEES_URL, {
+        rememberWrite(await fetch(EMPLOYEES_URL, {
           method: 'PUT',
-          headers: { 'Content-Type': 'application/json' },
+          headers: authHeaders(user.token),
           body: JSON.stringify({ id: user.id, status: 'online' })
-        });
+        }));
         
         toast.success('Вы успешно вошли в систему');
       } else {
@@ -142,14 +191,10 @@ export default function Index() {
   const handleUserChat = async (e: React.FormEvent) => {
     e.preventDefault();
     try {
-      const res = await fetch(CHATS_URL, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({
-          user_name: userChatForm.name,
-          user_email: userChatForm.email,
-          message: userChatForm.message
-        })
+      const res = await postIdempotent(CHATS_URL, { 'Content-Type': 'application/json' }, {
+        user_name: userChatForm.name,
+        user_email: userChatForm.email,
+        message: userChatForm.message
       });
       
       if (res.ok) {
@@ -166,19 +211,14 @@ export default function Index() {
     if (!selectedChat || !newMessage.trim()) return;
     
     try {
-      await fetch(MESSAGES_URL, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({
-          chat_id: selectedChat.id,
-          sender_type: 'operator',
-          sender_id: currentUser?.id,
-          message: newMessage
-        })
-      });
+      rememberWrite(await postIdempotent(MESSAGES_URL, authHeaders(), {
+        chat_id: selectedChat.id,
+        sender_type: 'operator',
+        message: newMessage
+      }));
       
       setNewMessage('');
-      loadMessages(selectedChat.id);
+      loadNewMessages(selectedChat.id, messages.length ? messages[messages.length - 1].id : 0);
     } catch (error) {
       toast.error('Ошибка отправки сообщения');
     }
@@ -188,16 +228,15 @@ export default function Index() {
     if (!selectedChat || !currentUser) return;
     
     try {
-      await fetch(CHATS_URL, {
+      rememberWrite(await fetch(CHATS_URL, {
         method: 'PUT',
-        headers: { 'Content-Type': 'application/json' },
+        headers: authHeaders(),
         body: JSON.stringify({
           action: 'close',
           chat_id: selectedChat.id,
-          resolution_status: resolution,
-          employee_id: currentUser.id
+          resolution_status: resolution
         })
-      });
+      }));
       
       toast.success(resolution === 'solved' ? 'Чат закрыт как решенный' : 'Чат закрыт как нерешенный');
       setSelectedChat(null);
@@ -209,11 +248,11 @@ export default function Index() {
 
   const handleStatusChange = async (employeeId: number, status: string) => {
     try {
-      await fetch(EMPLOYEES_URL, {
+      rememberWrite(await fetch(EMPLOYEES_URL, {
         method: 'PUT',
-        headers: { 'Content-Type': 'application/json' },
+        headers: authHeaders(),
         body: JSON.stringify({ id: employeeId, status })
-      });
+      }));
       loadEmployees();
       toast.success('Статус обновлен');
     } catch (error) {
@@ -224,11 +263,11 @@ export default function Index() {
   const handleAddEmployee = async (e: React.FormEvent) => {
     e.preventDefault();
     try {
-      await fetch(EMPLOYEES_URL, {
+      rememberWrite(await fetch(EMPLOYEES_URL, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: authHeaders(),
         body: JSON.stringify(newEmployee)
-      });
+      }));
       setNewEmployee({ login: '', password: '', name: '', role: 'operator' });
       loadEmployees();
       toast.success('Сотрудник добавлен');
@@ -360,6 +399,11 @@ export default function Index() {
           <Button variant="outline" onClick={() => {
             if (currentUser) {
               handleStatusChange(currentUser.id, 'offline');
+              fetch(AUTH_URL, {
+                method: 'POST',
+                headers: authHeaders(),
+                body: JSON.stringify({ action: 'logout' })
+              });
             }
             setCurrentUser(null);
             setView('user');
@@ -378,8 +422,20 @@ export default function Index() {
             <TabsContent value="chats" className="space-y-0">
               <div className="grid grid-cols-1 lg:grid-cols-3 gap-4">
                 <Card>
-                  <CardHeader>
+                  <CardHeader className="space-y-3">
                     <CardTitle className="text-lg">Список чатов</CardTitle>
+                    <div className="flex flex-wrap gap-1">
+                      {CHAT_STATUS_FILTERS.map(filter => (
+                        <Button
+                          key={filter.value}
+                          size="sm"
+                          variant={chatStatus === filter.value ? 'default' : 'outline'}
+                          onClick={() => filterChats(filter.value)}
+                        >
+                          {filter.label}
+                        </Button>
+                      ))}
+                    </div>
                   </CardHeader>
                   <CardContent>
                     <ScrollArea className="h-[600px]">
@@ -414,6 +470,11 @@ export default function Index() {
                             )}
                           </div>
                         ))}
+                        {chatsCursor && (
+                          <Button variant="ghost" size="sm" className="w-full" onClick={() => loadChats(chatsCursor)}>
+                            Показать ещё
+                          </Button>
+                        )}
                       </div>
                     </ScrollArea>
                   </CardContent>
@@ -676,6 +737,11 @@ export default function Index() {
                         <p className="text-xs opacity-70">{chat.user_email}</p>
                       </div>
                     ))}
+                    {chatsCursor && (
+                      <Button variant="ghost" size="sm" className="w-full" onClick={() => loadChats(chatsCursor)}>
+                        Показать ещё
+                      </Button>
+                    )}
                   </div>
                 </ScrollArea>
               </CardContent>